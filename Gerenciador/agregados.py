@@ -0,0 +1,289 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+# Campos mantidos por produto. Valores monetários ficam sempre em float; a
+# formatação "R$" é responsabilidade da camada de exibição.
+CAMPOS = (
+    "Entradas",
+    "Saídas",
+    "Valor Entradas",
+    "Valor Saídas",
+    "Soma Custo Entradas",
+    "Registros Entrada",
+    "Saídas Sem Preço",
+)
+
+
+def _novo_produto():
+    totais = dict.fromkeys(CAMPOS, 0)
+    totais["Custo Primeira Entrada"] = None
+    return totais
+
+
+class AgregadosEstoque:
+    """Totais de entradas e saídas por produto, atualizados em O(1) a cada registro."""
+
+    def __init__(self):
+        self._produtos = {}
+
+    @classmethod
+    def de_dataframe(cls, df):
+        """Constrói os agregados a partir de um DataFrame de movimentações em uma única passada.
+
+        As somas por produto são feitas com np.bincount sobre os códigos do
+        produto (os da categoria, quando a coluna já é categórica).
+        """
+        agregados = cls()
+        if df.empty:
+            return agregados
+
+        codigos, produtos = pd.factorize(df["Produto"])
+        entradas = (df["Tipo"] == "entrada").to_numpy()
+        saidas = (df["Tipo"] == "saída").to_numpy()
+        quantidade = pd.to_numeric(df["Quantidade"]).to_numpy(dtype=float)
+        custo = pd.to_numeric(df["Custo Unitário"]).to_numpy(dtype=float)
+        preco = pd.to_numeric(df["Preço de Venda"]).to_numpy(dtype=float)
+
+        def somar(pesos):
+            return np.bincount(codigos, weights=pesos, minlength=len(produtos))
+
+        grupos = pd.DataFrame({
+            "Entradas": somar(quantidade * entradas).astype(np.int64),
+            "Saídas": somar(quantidade * saidas).astype(np.int64),
+            "Valor Entradas": somar(quantidade * custo * entradas),
+            "Valor Saídas": somar(quantidade * preco * saidas),
+            "Soma Custo Entradas": somar(custo * entradas),
+            "Registros Entrada": somar(entradas).astype(np.int64),
+            "Saídas Sem Preço": somar(saidas & (preco <= 0)).astype(np.int64),
+        }, index=np.asarray(produtos, dtype=object))
+
+        # Custo da primeira entrada de cada produto, na ordem das linhas
+        linhas_entrada = np.flatnonzero(entradas)
+        com_entrada, primeiras = np.unique(codigos[linhas_entrada], return_index=True)
+        custo_primeira = np.full(len(produtos), np.nan)
+        custo_primeira[com_entrada] = custo[linhas_entrada[primeiras]]
+        grupos["Custo Primeira Entrada"] = custo_primeira
+        return cls.de_totais(grupos)
+
+    @classmethod
+    def de_totais(cls, totais):
+        """Constrói os agregados a partir de totais já calculados, indexados por produto.
+
+        Usado pelos backends de armazenamento, que somam os campos de CAMPOS
+        diretamente na consulta em vez de devolver as movimentações.
+        """
+        agregados = cls()
+        for produto, linha in zip(totais.index, totais.to_dict("records")):
+            valores = _novo_produto()
+            valores.update({campo: linha[campo] for campo in CAMPOS})
+            custo = linha.get("Custo Primeira Entrada")
+            valores["Custo Primeira Entrada"] = None if pd.isna(custo) else float(custo)
+            agregados._produtos[produto] = valores
+        return agregados
+
+    def adicionar(self, registro):
+        """Incorpora um novo registro de movimentação aos totais do produto."""
+        totais = self._produtos.setdefault(registro["Produto"], _novo_produto())
+        quantidade = registro["Quantidade"]
+        if registro["Tipo"] == "entrada":
+            custo = registro["Custo Unitário"]
+            totais["Entradas"] += quantidade
+            totais["Valor Entradas"] += quantidade * custo
+            totais["Soma Custo Entradas"] += custo
+            totais["Registros Entrada"] += 1
+            if totais["Custo Primeira Entrada"] is None:
+                totais["Custo Primeira Entrada"] = custo
+        elif registro["Tipo"] == "saída":
+            preco = registro["Preço de Venda"]
+            totais["Saídas"] += quantidade
+            totais["Valor Saídas"] += quantidade * preco
+            if preco <= 0:
+                totais["Saídas Sem Preço"] += 1
+
+    def remover(self, registro):
+        """Desfaz adicionar(registro) nos totais do produto, descartando o produto sem movimentações.
+
+        O Custo Primeira Entrada só é perdido quando não restam entradas: as
+        entradas de um produto têm todas o mesmo Custo Unitário.
+        """
+        totais = self._produtos[registro["Produto"]]
+        quantidade = registro["Quantidade"]
+        if registro["Tipo"] == "entrada":
+            custo = registro["Custo Unitário"]
+            totais["Entradas"] -= quantidade
+            totais["Valor Entradas"] -= quantidade * custo
+            totais["Soma Custo Entradas"] -= custo
+            totais["Registros Entrada"] -= 1
+            if not totais["Registros Entrada"]:
+                totais["Custo Primeira Entrada"] = None
+        elif registro["Tipo"] == "saída":
+            preco = registro["Preço de Venda"]
+            totais["Saídas"] -= quantidade
+            totais["Valor Saídas"] -= quantidade * preco
+            if preco <= 0:
+                totais["Saídas Sem Preço"] -= 1
+        if not totais["Registros Entrada"] and not totais["Saídas"]:
+            del self._produtos[registro["Produto"]]
+
+    def adicionar_lote(self, df):
+        """Incorpora um lote de movimentações, agregando-o em uma única passada antes de somar."""
+        for produto, valores in AgregadosEstoque.de_dataframe(df)._produtos.items():
+            totais = self._produtos.setdefault(produto, _novo_produto())
+            for campo in CAMPOS:
+                totais[campo] += valores[campo]
+            if totais["Custo Primeira Entrada"] is None:
+                totais["Custo Primeira Entrada"] = valores["Custo Primeira Entrada"]
+
+    def __contains__(self, produto):
+        return produto in self._produtos
+
+    def __len__(self):
+        return len(self._produtos)
+
+    def produtos(self):
+        """Retorna a lista ordenada de produtos conhecidos."""
+        return sorted(self._produtos)
+
+    def custo_referencia(self, produto):
+        """Custo Unitário da primeira entrada do produto, ou None se não houver entradas."""
+        totais = self._produtos.get(produto)
+        return None if totais is None else totais["Custo Primeira Entrada"]
+
+    def registros_entrada(self, produto):
+        totais = self._produtos.get(produto)
+        return 0 if totais is None else totais["Registros Entrada"]
+
+    def custo_medio(self, produto):
+        """Média simples do Custo Unitário das entradas do produto (sem ponderar pela quantidade)."""
+        totais = self._produtos.get(produto)
+        if not totais or not totais["Registros Entrada"]:
+            return 0.0
+        return totais["Soma Custo Entradas"] / totais["Registros Entrada"]
+
+    def saldo(self, produto):
+        """Saldo atual em quantidade do produto."""
+        totais = self._produtos.get(produto)
+        return 0 if totais is None else totais["Entradas"] - totais["Saídas"]
+
+    def lucro(self, produto):
+        """Lucro das saídas do produto em relação à média simples dos custos das entradas."""
+        totais = self._produtos.get(produto)
+        if totais is None:
+            return 0.0
+        return totais["Valor Saídas"] - totais["Saídas"] * self.custo_medio(produto)
+
+    def _tabela(self):
+        return pd.DataFrame.from_dict(self._produtos, orient="index", columns=list(CAMPOS))
+
+    @staticmethod
+    def _resumo(totais, cmv=None):
+        colunas = ["Entradas", "Saídas", "Saldo Atual", "Valor Entradas", "Valor Saídas", "Lucro"]
+        registros = totais["Registros Entrada"].to_numpy(dtype=float)
+        custo_medio = np.divide(
+            totais["Soma Custo Entradas"].to_numpy(dtype=float),
+            registros,
+            out=np.zeros(len(totais)),
+            where=registros > 0,
+        )
+        resumo = pd.DataFrame({
+            "Entradas": totais["Entradas"],
+            "Saídas": totais["Saídas"],
+            "Saldo Atual": totais["Entradas"] - totais["Saídas"],
+            "Valor Entradas": totais["Valor Entradas"].astype(float),
+            "Valor Saídas": totais["Valor Saídas"].astype(float),
+            "Lucro": totais["Valor Saídas"].to_numpy(dtype=float) - totais["Saídas"].to_numpy() * custo_medio,
+        }, columns=colunas)
+        if cmv is not None:
+            # Lucro pelo custo das mercadorias vendidas da valoração, quando disponível
+            cmv = cmv.reindex(resumo.index)
+            resumo["Lucro"] = resumo["Lucro"].where(cmv.isna(), resumo["Valor Saídas"] - cmv)
+        resumo.index.name = "Produto"
+        return resumo
+
+    def resumo(self, cmv=None):
+        """Retorna o resumo por produto com valores numéricos, sem formatação.
+
+        cmv (Series por produto, ver valoracao.ValoracaoEstoque.cmv) define o
+        custo das saídas no Lucro; sem ele, vale a média simples dos custos.
+        """
+        return self._resumo(self._tabela(), cmv)
+
+    def resumir(self, cmv=None):
+        """Produz o ResumoEstoque com os números por produto e globais a partir de uma única tabela."""
+        totais = self._tabela()
+        return ResumoEstoque.de_resumo(
+            self._resumo(totais, cmv), saidas_sem_preco=int(totais["Saídas Sem Preço"].sum())
+        )
+
+
+@dataclass
+class ResumoEstoque:
+    """Resultado único da agregação, lido pelo resumo, pelas métricas globais e pelos principais produtos."""
+
+    por_produto: pd.DataFrame
+    totais: dict
+    saidas_sem_preco: int = 0
+
+    @classmethod
+    def de_resumo(cls, por_produto, saidas_sem_preco=0):
+        """Calcula os totais globais somando as colunas do resumo por produto."""
+        por_produto = por_produto.sort_values("Saldo Atual", ascending=False)
+        colunas = ["Entradas", "Saídas", "Valor Entradas", "Valor Saídas", "Lucro"]
+        return cls(
+            por_produto=por_produto,
+            totais={coluna: por_produto[coluna].sum() for coluna in colunas},
+            saidas_sem_preco=saidas_sem_preco,
+        )
+
+    @classmethod
+    def vazio(cls):
+        return cls.de_resumo(AgregadosEstoque().resumo())
+
+    @property
+    def empty(self):
+        return self.por_produto.empty
+
+    def principais(self, n=5):
+        """Retorna os n produtos com maior saldo atual."""
+        return self.por_produto.head(n)
+
+
+def aggregate_movimentacoes(df):
+    """Agrega os dados de movimentações por Produto, Tipo e Custo Unitário, tratando saídas corretamente."""
+    if df.empty:
+        return df
+
+    # Ajustar quantidades para saídas (negativas)
+    quantidade = df["Quantidade"].to_numpy(dtype=np.int64)
+    df = df.assign(**{"Quantidade Ajustada": np.where(df["Tipo"] == "entrada", quantidade, -quantidade)})
+
+    # Agrupar por Produto, Tipo e Custo Unitário
+    grouped = df.groupby(["Produto", "Tipo", "Custo Unitário"], observed=True).agg({
+        "Quantidade Ajustada": "sum",  # Somar quantidades ajustadas
+        "Data": "max",                 # Pegar a data mais recente
+        "Preço de Venda": "last"       # Pegar o último preço de venda
+    }).reset_index()
+
+    # Renomear coluna para manter consistência
+    grouped = grouped.rename(columns={"Quantidade Ajustada": "Quantidade"})
+
+    # Reordenar colunas
+    return grouped[["Data", "Produto", "Tipo", "Quantidade", "Custo Unitário", "Preço de Venda"]]
+
+
+def agregar_movimentacoes_em_blocos(blocos):
+    """aggregate_movimentacoes sobre blocos em ordem de data, combinando os parciais de cada bloco."""
+    colunas = ["Data", "Produto", "Tipo", "Quantidade", "Custo Unitário", "Preço de Venda"]
+    parciais = [aggregate_movimentacoes(bloco) for bloco in blocos if not bloco.empty]
+    if not parciais:
+        return pd.DataFrame(columns=colunas)
+    grouped = pd.concat(parciais, ignore_index=True).groupby(
+        ["Produto", "Tipo", "Custo Unitário"], observed=True
+    ).agg({
+        "Quantidade": "sum",       # Quantidades já com sinal em cada parcial
+        "Data": "max",
+        "Preço de Venda": "last"   # Blocos em ordem de data: o último parcial é o mais recente
+    }).reset_index()
+    return grouped[colunas]
@@ -1,120 +1,67 @@
 import streamlit as st
 import pandas as pd
-from datetime import datetime, date
-import tempfile
-import os
+import numpy as np
+from datetime import date
 import plotly.express as px
+import functools
 import logging
+from collections import deque
+
+from agregados import ResumoEstoque, aggregate_movimentacoes, agregar_movimentacoes_em_blocos
+from armazenamento import FiltroMovimentacoes, SEM_FILTRO, criar_backend
+from exportacao import FORMATOS, exportar, fatiar, nome_relatorio
+from graficos import reduzir_barras, reduzir_serie, usar_webgl
+from estoque import EstoqueCompartilhado
+from importacao import ler_em_blocos
+from ledger import QUANTIDADE_MAXIMA
+from medicao import MEDICAO_PADRAO, MedicaoExecucoes
 
 # Configuração de logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Configuração da página
-st.set_page_config(page_title="Controle de Mercadorias", layout="wide")
+# Colunas do resumo formatadas como moeda apenas na exibição
+COLUNAS_MONETARIAS = ["Valor Entradas", "Valor Saídas", "Lucro"]
 
-# CSS personalizado (mantido igual ao original)
-st.markdown(
-    """
-    <style>
-        .main .block-container {
-            padding: 2rem;
-            max-width: 1200px;
-            margin: auto;
-            background-color: #FFFFFF;
-        }
-        h1, h2, h3, h4 {
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            color: #1A3C5A;
-        }
-        .css-1avcm0n {
-            font-family: 'Segoe UI', sans-serif;
-            color: #1A3C5A;
-        }
-        .stButton>button {
-            background-color: #2E7D32;
-            color: white;
-            border: none;
-            border-radius: 8px;
-            padding: 0.5rem 1rem;
-            font-weight: bold;
-        }
-        .stButton>button:hover {
-            background-color: #4CAF50;
-            cursor: pointer;
-        }
-        .css-kniuvf {
-            background-color: #F5F7FA;
-            border: 1px solid #E0E0E0;
-            border-radius: 8px;
-            padding: 1rem;
-            font-size: 1.2rem;
-        }
-        a {
-            color: #4CAF50;
-            text-decoration: none;
-        }
-        a:hover {
-            color: #2E7D32;
-        }
-        table {
-            border-collapse: collapse;
-            width: 100%;
-        }
-        th, td {
-            padding: 8px;
-            text-align: left;
-            border-bottom: 1px solid #E0E0E0;
-        }
-        th {
-            background-color: #1A3C5A;
-            color: white;
-        }
-        .form-container {
-            background-color: #F5F7FA;
-            padding: 1.5rem;
-            border-radius: 8px;
-            margin-bottom: 2rem;
-            border: 1px solid #E0E0E0;
-        }
-        .stTextInput>div>input,
-        .stNumberInput>div>input,
-        .stSelectbox>div>select,
-        .stDateInput>div>input {
-            border-radius: 4px;
-            border: 1px solid #E0E0E0;
-            background-color: #FFFFFF;
-        }
-    </style>
-    """,
-    unsafe_allow_html=True
-)
-
-# Inicialização do session_state
-if "df" not in st.session_state:
-    st.session_state.df = pd.DataFrame(
-        columns=["Data", "Produto", "Tipo", "Quantidade", "Custo Unitário", "Preço de Venda"]
-    )
+# Intervalo (s) de atualização automática do andamento das exportações
+INTERVALO_ANDAMENTO = 1.0
+
+# Correções (edições e remoções) que cada sessão pode desfazer
+LIMITE_DESFAZER = 50
+
+@st.cache_resource
+def obter_estoque():
+    """Estoque único do processo, compartilhado por todas as sessões."""
+    return EstoqueCompartilhado(criar_backend())
+
+# Definido por main(); as funções de interface só são chamadas durante a execução do app
+estoque = None
 
-if "form_data" not in st.session_state:
-    st.session_state.form_data = {
-        "data": date.today(),
-        "produto": "",
-        "tipo": "entrada",
-        "quantidade": 0,
-        "custo_unitario": 0.0,
-        "preco_venda": 0.0
-    }
+def fase(nome):
+    """Mede uma fase da execução atual (sem custo quando a medição está desligada)."""
+    return st.session_state.medicao.fase(nome)
 
-if "confirmar_limpeza" not in st.session_state:
-    st.session_state.confirmar_limpeza = False
+def fragmento_medido(nome, **opcoes):
+    """st.fragment medido como a fase nome, inclusive quando só o fragmento é reexecutado."""
+    def decorar(funcao):
+        @functools.wraps(funcao)
+        def medir(*args, **kwargs):
+            with st.session_state.medicao.fragmento(nome):
+                return funcao(*args, **kwargs)
+        return st.fragment(medir, **opcoes)
+    return decorar
 
 # ==============================================================================
 # FUNÇÕES DE MANIPULAÇÃO DE DADOS
 # ==============================================================================
 
+@fragmento_medido("inserção")
 def inserir_registro_manual():
-    """Permite a inserção manual de um registro usando st.form."""
+    """Permite a inserção manual de um registro usando st.form.
+
+    Fragmento: envios recusados na validação reexecutam só o formulário; um
+    registro gravado reexecuta a página, cujas seções dependem do livro.
+    """
     st.markdown("### Inserção de Novo Registro", unsafe_allow_html=True)
     with st.container():
         st.markdown('<div class="form-container">', unsafe_allow_html=True)
@@ -149,6 +96,7 @@ def inserir_registro_manual():
                 quantidade = st.number_input(
                     "Quantidade",
                     min_value=0,
+                    max_value=QUANTIDADE_MAXIMA,
                     step=1,
                     value=st.session_state.form_data["quantidade"],
                     help="Digite a quantidade movimentada"
@@ -177,64 +125,57 @@ def inserir_registro_manual():
             submit_button = st.form_submit_button("Adicionar Registro")
             
             if submit_button:
-                if not produto.strip():
-                    st.error("O campo 'Produto' não pode estar vazio.")
-                    return
-                
-                if quantidade <= 0:
-                    st.error("A quantidade deve ser maior que 0.")
-                    return
-                
-                if tipo == "saída" and preco_venda <= 0:
-                    st.error("O 'Preço de Venda' deve ser maior que 0 para saídas.")
-                    return
-                
-                if tipo == "entrada" and custo_unit <= 0:
-                    st.error("O 'Custo Unitário' deve ser maior que 0 para entradas.")
+                erro = erro_campos_registro(produto, tipo, quantidade, custo_unit, preco_venda)
+                if erro:
+                    st.error(erro)
                     return
                 
-                # Validar Custo Unitário para entradas do mesmo produto
-                produto = produto.lower().strip()
-                entradas_produto = st.session_state.df[
-                    (st.session_state.df["Produto"] == produto) & 
-                    (st.session_state.df["Tipo"] == "entrada")
-                ]
-                if not entradas_produto.empty:
-                    custo_existente = entradas_produto["Custo Unitário"].iloc[0]
-                    if round(custo_unit, 2) != round(custo_existente, 2):
-                        st.error(
-                            f"O produto '{produto}' já possui entradas com Custo Unitário R$ {custo_existente:.2f}. "
-                            f"Não é permitido registrar com um valor diferente (R$ {custo_unit:.2f})."
-                        )
-                        return
-                
-                # Validar se há estoque suficiente para saídas
-                if tipo == "saída":
-                    saldo_atual = calcular_saldo(st.session_state.df)
-                    if produto in saldo_atual.index:
-                        saldo_qty = saldo_atual.loc[produto, "Saldo Atual"]
-                        if quantidade > saldo_qty:
+                # Validações e gravação na mesma seção crítica do estoque compartilhado
+                with estoque.trava:
+                    # Validar Custo Unitário para entradas do mesmo produto
+                    produto = produto.lower().strip()
+                    agregados = estoque.agregados
+                    custo_existente = agregados.custo_referencia(produto)
+                    if custo_existente is not None:
+                        if round(custo_unit, 2) != round(custo_existente, 2):
                             st.error(
-                                f"Estoque insuficiente para o produto '{produto}'. "
-                                f"Saldo atual: {saldo_qty}, Quantidade solicitada: {quantidade}."
+                                f"O produto '{produto}' já possui entradas com Custo Unitário R$ {custo_existente:.2f}. "
+                                f"Não é permitido registrar com um valor diferente (R$ {custo_unit:.2f})."
                             )
                             return
-                    else:
-                        st.error(f"O produto '{produto}' não possui entradas registradas.")
-                        return
                 
-                registro = {
-                    "Data": data_registro,
-                    "Produto": produto,
-                    "Tipo": tipo,
-                    "Quantidade": quantidade,
-                    "Custo Unitário": custo_unit,
-                    "Preço de Venda": preco_venda
-                }
-                st.session_state.df = pd.concat(
-                    [st.session_state.df, pd.DataFrame([registro])],
-                    ignore_index=True
-                )
+                    # Validar se há estoque suficiente para saídas na data do registro
+                    # e em todas as datas seguintes (saídas retroativas)
+                    if tipo == "saída":
+                        if produto in agregados:
+                            saldo_qty = estoque.saldos.saldo_em(produto, data_registro)
+                            if quantidade > saldo_qty:
+                                st.error(
+                                    f"Estoque insuficiente para o produto '{produto}' em {data_registro:%d/%m/%Y}. "
+                                    f"Saldo na data: {saldo_qty}, Quantidade solicitada: {quantidade}."
+                                )
+                                return
+                            minimo_futuro = estoque.saldos.minimo_apos(produto, data_registro)
+                            if minimo_futuro is not None and quantidade > minimo_futuro:
+                                st.error(
+                                    f"A saída deixaria o estoque do produto '{produto}' negativo em datas posteriores a "
+                                    f"{data_registro:%d/%m/%Y}. Menor saldo futuro: {minimo_futuro}, "
+                                    f"Quantidade solicitada: {quantidade}."
+                                )
+                                return
+                        else:
+                            st.error(f"O produto '{produto}' não possui entradas registradas.")
+                            return
+                
+                    registro = {
+                        "Data": data_registro,
+                        "Produto": produto,
+                        "Tipo": tipo,
+                        "Quantidade": quantidade,
+                        "Custo Unitário": custo_unit,
+                        "Preço de Venda": preco_venda
+                    }
+                    estoque.adicionar(registro)
                 # Resetar valores padrão do formulário
                 st.session_state.form_data = {
                     "data": date.today(),
@@ -244,85 +185,225 @@ def inserir_registro_manual():
                     "custo_unitario": 0.0,
                     "preco_venda": 0.0
                 }
-                st.success("Registro adicionado com sucesso!")
+                st.session_state.mensagem_insercao = "Registro adicionado com sucesso!"
+                st.rerun()
         
+        mensagem = st.session_state.pop("mensagem_insercao", None)
+        if mensagem:
+            st.success(mensagem)
         st.markdown('</div>', unsafe_allow_html=True)
 
-@st.cache_data
-def calcular_saldo(df):
-    """Calcula o resumo do estoque por produto."""
-    try:
-        logger.info("Iniciando cálculo do saldo")
+def erro_campos_registro(produto, tipo, quantidade, custo_unit, preco_venda):
+    """Mensagem do primeiro campo inválido do formulário de registro, ou None."""
+    if not produto.strip():
+        return "O campo 'Produto' não pode estar vazio."
+    if quantidade <= 0:
+        return "A quantidade deve ser maior que 0."
+    if quantidade > QUANTIDADE_MAXIMA:
+        return f"A quantidade deve ser no máximo {QUANTIDADE_MAXIMA}."
+    if tipo == "saída" and preco_venda <= 0:
+        return "O 'Preço de Venda' deve ser maior que 0 para saídas."
+    if tipo == "entrada" and custo_unit <= 0:
+        return "O 'Custo Unitário' deve ser maior que 0 para entradas."
+    return None
+
+@fragmento_medido("correção")
+def corrigir_registros():
+    """Edição, exclusão e desfazer de registros pelo ID (exibido na análise detalhada por produto).
+
+    Fragmento: escolher o ID reexecuta só esta seção; uma correção gravada
+    reexecuta a página. Cada sessão desfaz só as próprias correções, guardadas
+    em st.session_state.correcoes.
+    """
+    with st.expander("Correção de Registros"):
+        mensagem = st.session_state.pop("mensagem_correcao", None)
+        if mensagem:
+            st.success(mensagem)
+        
+        correcoes = st.session_state.correcoes
+        # Correções cujo registro já mudou depois (em outra sessão, por exemplo) não podem mais ser desfeitas
+        while correcoes and not estoque.correcao_vigente(correcoes[-1]):
+            correcoes.pop()
+        if correcoes:
+            ultima = correcoes[-1]
+            if st.button(f"Desfazer {ultima.operacao} do registro {ultima.id_registro}"):
+                try:
+                    estoque.desfazer(ultima)
+                except ValueError as e:
+                    st.error(str(e))
+                else:
+                    correcoes.pop()
+                    st.session_state.mensagem_correcao = (
+                        f"Desfeita a {ultima.operacao} do registro {ultima.id_registro}."
+                    )
+                    st.rerun()
         
-        # Verificar saídas inválidas
-        saidas_invalidas = df[(df["Tipo"] == "saída") & (df["Preço de Venda"] <= 0)]
-        if not saidas_invalidas.empty:
-            st.warning(
-                "Existem saídas com 'Preço de Venda' igual a 0. "
-                "Por favor, corrija os registros para cálculos precisos."
+        id_registro = int(st.number_input(
+            "ID do registro",
+            min_value=0,
+            step=1,
+            key="correcao_id",
+            help="ID exibido na tabela da análise detalhada por produto"
+        ))
+        registro = estoque.registro(id_registro)
+        if registro is None:
+            st.info(f"Nenhum registro com ID {id_registro}.")
+            return
+        
+        with st.form(key="correcao_form"):
+            col1, col2, col3 = st.columns(3)
+            data_registro = col1.date_input("Data", value=pd.Timestamp(registro["Data"]).date())
+            produto = col2.text_input("Produto", value=registro["Produto"])
+            tipo = col3.selectbox("Tipo", ["entrada", "saída"], index=["entrada", "saída"].index(registro["Tipo"]))
+            col4, col5, col6 = st.columns(3)
+            quantidade = col4.number_input(
+                "Quantidade", min_value=0, max_value=QUANTIDADE_MAXIMA, step=1, value=registro["Quantidade"]
+            )
+            custo_unit = col5.number_input(
+                "Custo Unitário", min_value=0.0, step=0.01, format="%.2f", value=registro["Custo Unitário"]
+            )
+            preco_venda = col6.number_input(
+                "Preço de Venda", min_value=0.0, step=0.01, format="%.2f", value=registro["Preço de Venda"]
             )
+            salvar = st.form_submit_button("Salvar Alterações")
         
-        # Calcular quantidades de entradas e saídas
-        entradas_qty = df[df["Tipo"] == "entrada"].groupby("Produto")["Quantidade"].sum()
-        saidas_qty = df[df["Tipo"] == "saída"].groupby("Produto")["Quantidade"].sum()
-        saldo_qty = entradas_qty.subtract(saidas_qty, fill_value=0)
+        if salvar:
+            erro = erro_campos_registro(produto, tipo, quantidade, custo_unit, preco_venda)
+            if erro:
+                st.error(erro)
+                return
+            try:
+                correcao = estoque.editar(id_registro, {
+                    "Data": data_registro,
+                    "Produto": produto.lower().strip(),
+                    "Tipo": tipo,
+                    "Quantidade": quantidade,
+                    "Custo Unitário": custo_unit,
+                    "Preço de Venda": preco_venda
+                })
+            except ValueError as e:
+                st.error(str(e))
+                return
+            correcoes.append(correcao)
+            st.session_state.mensagem_correcao = f"Registro {id_registro} alterado com sucesso!"
+            st.rerun()
+        
+        if st.button("Excluir Registro"):
+            try:
+                correcoes.append(estoque.remover(id_registro))
+            except ValueError as e:
+                st.error(str(e))
+                return
+            st.session_state.mensagem_correcao = f"Registro {id_registro} excluído com sucesso!"
+            st.rerun()
+
+@fragmento_medido("importação")
+def importar_registros_em_lote():
+    """Permite importar movimentações em lote a partir de um arquivo CSV ou Excel.
+
+    Fragmento: escolher o arquivo e as opções não reexecuta a página; ao fim da
+    importação a página é reexecutada e o resultado exibido em seguida.
+    """
+    with st.expander("Importação em Lote (CSV/Excel)"):
+        st.caption(
+            "O arquivo deve conter as colunas: Data, Produto, Tipo, Quantidade, "
+            "Custo Unitário e Preço de Venda."
+        )
+        arquivo = st.file_uploader("Arquivo de movimentações", type=["csv", "xlsx"])
+        col1, col2 = st.columns(2)
+        with col1:
+            separador = st.selectbox("Separador (CSV)", [",", ";"])
+        with col2:
+            decimal = st.selectbox("Separador decimal (CSV)", [".", ","])
         
-        # Calcular valores de entradas
-        df_entradas = df[df["Tipo"] == "entrada"].copy()
-        df_entradas["Valor Entradas"] = df_entradas["Quantidade"] * df_entradas["Custo Unitário"]
-        entradas_valor = df_entradas.groupby("Produto")["Valor Entradas"].sum()
+        resultado = st.session_state.pop("resultado_importacao", None)
+        if resultado is not None:
+            exibir_resultado_importacao(*resultado)
         
-        # Calcular valores de saídas
-        df_saidas = df[df["Tipo"] == "saída"].copy()
-        df_saidas["Valor Saídas"] = df_saidas["Quantidade"] * df_saidas["Preço de Venda"]
-        saidas_valor = df_saidas.groupby("Produto")["Valor Saídas"].sum()
+        if arquivo is None or not st.button("Importar Arquivo"):
+            return
         
-        # Calcular custo médio e lucro
-        custo_medio = df[df["Tipo"] == "entrada"].groupby("Produto")["Custo Unitário"].mean()
-        df_saidas = df_saidas.join(custo_medio.rename("Custo Médio"), on="Produto")
-        df_saidas["Custo Médio"] = df_saidas["Custo Médio"].fillna(0.0)
-        df_saidas["Lucro"] = df_saidas["Quantidade"] * (df_saidas["Preço de Venda"] - df_saidas["Custo Médio"])
-        lucro = df_saidas.groupby("Produto")["Lucro"].sum().fillna(0)
+        opcoes_csv = {} if arquivo.name.lower().endswith(".xlsx") else {"sep": separador, "decimal": decimal}
+        progresso = st.progress(0.0, text="Importando...")
         
-        # Criar DataFrame de saldo
-        saldo = pd.DataFrame({
-            "Entradas": entradas_qty,
-            "Saídas": saidas_qty,
-            "Saldo Atual": saldo_qty,
-            "Valor Entradas": entradas_valor,
-            "Valor Saídas": saidas_valor,
-            "Lucro": lucro
-        }).fillna(0)
+        def ao_progredir(numero_bloco, linhas_lidas, total_aceitos):
+            progresso.progress(
+                min(arquivo.tell() / max(arquivo.size, 1), 1.0),
+                text=f"Bloco {numero_bloco}: {linhas_lidas} linhas lidas, {total_aceitos} importadas"
+            )
         
-        # Formatar valores monetários
-        saldo["Valor Entradas"] = saldo["Valor Entradas"].apply(lambda x: f"R$ {x:,.2f}")
-        saldo["Valor Saídas"] = saldo["Valor Saídas"].apply(lambda x: f"R$ {x:,.2f}")
-        saldo["Lucro"] = saldo["Lucro"].apply(lambda x: f"R$ {x:,.2f}")
+        try:
+            blocos = ler_em_blocos(arquivo, arquivo.name, **opcoes_csv)
+            total_aceitos, rejeitados = estoque.importar(blocos, ao_progredir)
+        except Exception as e:
+            logger.error(f"Erro ao importar arquivo: {str(e)}")
+            st.error(f"Erro ao importar o arquivo: {str(e)}")
+            return
         
-        logger.info("Cálculo do saldo concluído")
-        return saldo.sort_values("Saldo Atual", ascending=False)
-    
+        progresso.progress(1.0, text="Importação concluída")
+        if total_aceitos:
+            st.session_state.resultado_importacao = (total_aceitos, rejeitados)
+            st.rerun()
+        exibir_resultado_importacao(total_aceitos, rejeitados)
+
+def exibir_resultado_importacao(total_aceitos, rejeitados):
+    """Exibe o total importado e as linhas rejeitadas, com o download do relatório de rejeições."""
+    st.success(f"{total_aceitos} registros importados com sucesso!")
+    if not rejeitados.empty:
+        st.warning(f"{len(rejeitados)} registros foram rejeitados.")
+        st.dataframe(rejeitados.head(1000), use_container_width=True)
+        st.download_button(
+            label="Download do Relatório de Rejeições",
+            data=rejeitados.to_csv(index=False).encode("utf-8"),
+            file_name="rejeicoes_importacao.csv",
+            mime="text/csv"
+        )
+
+def em_cache(nome, filtro, calcular, versao=None):
+    """Obtém um resultado do cache compartilhado, indexado pela versão do livro e pelo filtro.
+
+    Quem calcula a partir de dados já lidos informa a versão em que os leu, para
+    que um resultado antigo não seja guardado sob uma versão mais nova do livro.
+    """
+    chave = (nome, estoque.versao if versao is None else versao, filtro)
+    return estoque.cache.obter(chave, calcular)
+
+def consultar_movimentacoes(filtro=SEM_FILTRO, versao=None):
+    """Consulta as movimentações no armazenamento, reaproveitando o resultado enquanto o livro não mudar."""
+    return em_cache("consulta", filtro, lambda: estoque.consultar(filtro), versao)
+
+def calcular_saldo(filtro, df_filtrado, versao=None):
+    """Calcula o resumo do estoque por produto e os totais globais, uma única vez por filtro."""
+    try:
+        return em_cache("resumo", filtro, lambda: estoque.resumir(filtro, df_filtrado), versao)
     except Exception as e:
         logger.error(f"Erro ao calcular saldo: {str(e)}")
         st.error("Ocorreu um erro ao calcular o saldo. Verifique os dados inseridos.")
-        return pd.DataFrame()
+        return ResumoEstoque.vazio()
 
 # ==============================================================================
 # FUNÇÕES DE VISUALIZAÇÃO
 # ==============================================================================
 
+def exibir_figura(nome, chave, construir, aviso="Nenhum dado disponível para o gráfico.", versao=None):
+    """Desenha a figura de construir(), em cache pela versão do livro e pelas entradas declaradas em chave.
+
+    construir() retorna None quando não há dados; nesse caso é exibido o aviso.
+    """
+    fig = em_cache(f"figura {nome}", chave, construir, versao)
+    if fig is None:
+        st.warning(aviso)
+        return
+    st.plotly_chart(fig, use_container_width=True)
+
 def create_bar_chart(data, x, y, title, labels, barmode="group"):
-    """Cria um gráfico de barras com Plotly."""
+    """Cria um gráfico de barras com Plotly (None se não houver dados)."""
     if data.empty:
-        st.warning("Nenhum dado disponível para o gráfico.")
-        return
-    data_clean = data.copy()
-    for col in y:
-        if data[col].dtype == object and "R$" in str(data[col].iloc[0]):
-            data_clean[col] = data[col].str.replace("R$ ", "").str.replace(",", "").astype(float)
-    
+        return None
+    # Maiores produtos e uma barra "Outros", para limitar o tamanho da figura
+    data = reduzir_barras(data, y)
     fig = px.bar(
-        data_clean.reset_index(),
+        data.reset_index(),
         x=x,
         y=y,
         barmode=barmode,
@@ -335,69 +416,70 @@ def create_bar_chart(data, x, y, title, labels, barmode="group"):
         legend_title_text="Tipo",
         margin=dict(l=40, r=40, t=60, b=80)
     )
-    st.plotly_chart(fig, use_container_width=True)
+    return fig
 
-def grafico_barra_quantidade(saldo):
+def grafico_barra_quantidade(filtro, saldo, versao):
     """Gera um gráfico de barras comparativo de quantidades."""
-    create_bar_chart(
+    exibir_figura("quantidades", filtro, lambda: create_bar_chart(
         saldo,
         x="Produto",
         y=["Entradas", "Saídas"],
         title="Comparativo de Quantidades (Entradas x Saídas)",
         labels={"value": "Quantidade", "variable": "Tipo"}
-    )
+    ), versao=versao)
 
-def grafico_barra_valor(saldo):
+def grafico_barra_valor(filtro, saldo, versao):
     """Gera um gráfico de barras comparativo de valores."""
-    create_bar_chart(
+    exibir_figura("valores", filtro, lambda: create_bar_chart(
         saldo,
         x="Produto",
         y=["Valor Entradas", "Valor Saídas"],
         title="Comparativo de Valores (Entradas x Saídas)",
         labels={"value": "Valor (R$)", "variable": "Tipo"}
-    )
+    ), versao=versao)
 
-def grafico_linha_evolucao(produto, df_produto, agregacao="Diária"):
+def grafico_linha_evolucao(produto, agregacao="Diária"):
     """Gera um gráfico de linha com a evolução da quantidade."""
-    if df_produto.empty:
-        st.warning("Nenhum dado disponível para o gráfico.")
-        return
-    
-    df_resumo = df_produto.copy()
-    df_resumo["Data"] = pd.to_datetime(df_resumo["Data"])
-    
-    if agregacao == "Semanal":
-        df_resumo["Data"] = df_resumo["Data"].dt.to_period("W").apply(lambda r: r.start_time)
-    elif agregacao == "Mensal":
-        df_resumo["Data"] = df_resumo["Data"].dt.to_period("M").apply(lambda r: r.start_time)
+    def construir():
+        # Série já agregada por período, mantida incrementalmente a cada registro
+        df_resumo = estoque.ler(lambda: estoque.rollups.serie(produto, agregacao))
+        if df_resumo.empty:
+            return None
+        
+        # Séries longas são reduzidas com LTTB e desenhadas com WebGL
+        df_resumo = reduzir_serie(df_resumo)
+        webgl = usar_webgl(len(df_resumo))
+        fig = px.line(
+            df_resumo,
+            x="Data",
+            y="Quantidade",
+            color="Tipo",
+            title=f"Evolução {agregacao} - {produto}",
+            markers=not webgl,
+            render_mode="webgl" if webgl else "auto",
+            labels={"Quantidade": "Quantidade", "Data": "Data"}
+        )
+        fig.update_layout(
+            xaxis_title="Data",
+            yaxis_title="Quantidade",
+            plot_bgcolor="#FFFFFF",
+            margin=dict(l=40, r=40, t=60, b=80)
+        )
+        return fig
     
-    df_resumo["Quantidade"] = df_resumo.apply(
-        lambda row: row["Quantidade"] if row["Tipo"] == "entrada" else -row["Quantidade"], axis=1
-    )
-    df_resumo = df_resumo.groupby(["Data", "Tipo"])["Quantidade"].sum().reset_index()
-    fig = px.line(
-        df_resumo,
-        x="Data",
-        y="Quantidade",
-        color="Tipo",
-        title=f"Evolução {agregacao} - {produto}",
-        markers=True,
-        labels={"Quantidade": "Quantidade", "Data": "Data"}
-    )
-    fig.update_layout(
-        xaxis_title="Data",
-        yaxis_title="Quantidade",
-        plot_bgcolor="#FFFFFF",
-        margin=dict(l=40, r=40, t=60, b=80)
-    )
-    st.plotly_chart(fig, use_container_width=True)
+    exibir_figura("evolucao", (produto, agregacao), construir)
 
-def grafico_top_produtos(df_filtrado):
+def grafico_top_produtos(filtro, resumo, versao):
     """Gera um gráfico dos principais produtos por saldo."""
-    principais = calcular_saldo(df_filtrado).reset_index().sort_values("Saldo Atual", ascending=False).head(5)
+    principais = resumo.principais(5).reset_index()
     if principais.empty:
         st.warning("Nenhum dado disponível para exibir os principais produtos.")
         return
+    exibir_figura("principais", filtro, lambda: figura_top_produtos(principais), versao=versao)
+    st.table(principais.style.format(formatar_moeda, subset=COLUNAS_MONETARIAS))
+
+def figura_top_produtos(principais):
+    """Cria o gráfico de barras dos principais produtos."""
     fig = px.bar(
         principais,
         x="Produto",
@@ -408,37 +490,88 @@ def grafico_top_produtos(df_filtrado):
     )
     fig.update_traces(texttemplate="%{text:.2s}", textposition="outside")
     fig.update_layout(uniformtext_minsize=8, uniformtext_mode="hide", margin=dict(l=40, r=40, t=60, b=80))
-    st.plotly_chart(fig, use_container_width=True)
-    st.table(principais)
+    return fig
 
 # ==============================================================================
 # FUNÇÕES DE EXPORTAÇÃO E FORMATAÇÃO
 # ==============================================================================
 
-def exportar_relatorio(df, saldo):
-    """Exporta os dados e o resumo para um arquivo Excel."""
+def chave_relatorio(filtro, formato, versao):
+    """Identifica um relatório pela versão do livro, pelo filtro e pelo formato."""
+    return ("relatorio", versao, filtro, formato)
+
+def exportar_relatorio(filtro, df, saldo, formato, versao):
+    """Agenda a geração do relatório em segundo plano, reaproveitando um pedido idêntico."""
+    def gerar(ao_progredir):
+        if df is None:
+            blocos = estoque.varrer(filtro, ao_progredir=ao_progredir)
+        else:
+            blocos = fatiar(df, ao_progredir=ao_progredir)
+        return exportar(formato, blocos, saldo).getvalue()
+
+    return estoque.exportacoes.submeter(chave_relatorio(filtro, formato, versao), gerar, nome_relatorio(formato))
+
+@fragmento_medido("exportação")
+def exibir_exportacao(filtro):
+    """Exibe o pedido de relatório e o andamento ou o download da geração em segundo plano.
+
+    Fragmento: escolher o formato e pedir o relatório não reexecuta a página.
+    Como o livro pode ter mudado desde a última execução completa, as
+    movimentações e o resumo são relidos aqui (do cache, se a versão for a mesma).
+    """
+    formato = st.selectbox("Formato do relatório", list(FORMATOS), key="formato_relatorio")
+    versao = estoque.versao
+    chave = chave_relatorio(filtro, formato, versao)
+    if st.button("Exportar Relatório"):
+        df_filtrado = None if estoque.fora_da_memoria else consultar_movimentacoes(filtro, versao)
+        saldo = calcular_saldo(filtro, df_filtrado, versao).por_produto
+        exportar_relatorio(filtro, df_filtrado, saldo, formato, versao)
+        st.session_state.relatorio_pedido = chave
+
+    tarefa = estoque.exportacoes.obter(chave)
+    pedido = st.session_state.get("relatorio_pedido")
+    if tarefa is None and pedido is not None and pedido[2:] == chave[2:]:
+        # O livro mudou depois do pedido: o relatório pedido continua visível,
+        # com os dados do momento do pedido
+        chave = pedido
+        tarefa = estoque.exportacoes.obter(chave)
+        if tarefa is not None:
+            st.info("O livro mudou depois do pedido; o relatório traz os dados do momento em que foi pedido.")
+    if tarefa is None:
+        return
+    if not tarefa.concluida:
+        exibir_andamento(chave)
+        return
     try:
-        data_atual = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        nome_arquivo = f"Relatorio_Controle_Mercadorias_{data_atual}.xlsx"
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
-            caminho_arquivo = tmp.name
-        with pd.ExcelWriter(caminho_arquivo, engine="xlsxwriter") as writer:
-            df.to_excel(writer, index=False, sheet_name="Dados")
-            saldo.to_excel(writer, sheet_name="Resumo")
-        return caminho_arquivo, nome_arquivo
+        dados = tarefa.resultado()
     except Exception as e:
         logger.error(f"Erro ao exportar relatório: {str(e)}")
         st.error("Erro ao gerar o relatório. Tente novamente.")
-        return None, None
+        return
+    st.download_button(
+        label="Download do Relatório",
+        data=dados,
+        file_name=tarefa.nome_arquivo,
+        mime=FORMATOS[formato][1]
+    )
+    st.success("Relatório gerado com sucesso!")
+
+@st.fragment(run_every=INTERVALO_ANDAMENTO)
+def exibir_andamento(chave):
+    """Atualiza sozinho o andamento da exportação; ao terminar, reexecuta a página para exibir o download."""
+    tarefa = estoque.exportacoes.obter(chave)
+    if tarefa is None or tarefa.concluida:
+        st.rerun()
+    st.progress(tarefa.progresso, text="Gerando relatório... você pode continuar usando o sistema.")
+
+def formatar_moeda(valor):
+    """Formata um valor numérico como moeda para exibição."""
+    return f"R$ {valor:,.2f}"
 
 def formatar_tabela_resumo(saldo):
     """Formata a tabela de resumo do estoque."""
-    def color_lucro(val):
-        try:
-            val_float = float(val.replace("R$ ", "").replace(",", ""))
-            return "color: red" if val_float < 0 else "color: green" if val_float > 0 else "color: black"
-        except:
-            return "color: black"
+    def color_lucro(lucro):
+        return np.select([lucro < 0, lucro > 0], ["color: red", "color: green"], "color: black")
     
     styles = [
         {"selector": "th", "props": [("font-size", "12pt"), ("text-align", "center")]},
@@ -446,7 +579,8 @@ def formatar_tabela_resumo(saldo):
     ]
     return (
         saldo.style
-        .applymap(color_lucro, subset=["Lucro"])
+        .format(formatar_moeda, subset=COLUNAS_MONETARIAS)
+        .apply(color_lucro, subset=["Lucro"])
         .set_table_styles(styles)
     )
 
@@ -454,41 +588,41 @@ def formatar_tabela_resumo(saldo):
 # FUNÇÕES DE INTERFACE
 # ==============================================================================
 
-def configurar_filtros(df):
-    """Configura os filtros na sidebar."""
+def configurar_filtros(estoque):
+    """Configura os filtros na sidebar e retorna os predicados a serem aplicados na consulta."""
     st.sidebar.header("Filtros")
-    if df.empty:
+    data_min, data_max = estoque.intervalo_datas()
+    if data_min is None:
         st.sidebar.info("Nenhum dado para filtrar.")
-        return df
+        return SEM_FILTRO
     
-    datas = pd.to_datetime(df["Data"]).dropna()
-    data_min, data_max = min(datas, default=date.today()), max(datas, default=date.today())
     intervalo = st.sidebar.date_input(
         "Período",
         value=[data_min, data_max],
         help="Selecione o intervalo de datas para filtrar"
     )
     
-    df_filtrado = df
+    # Filtros que cobrem todo o livro são normalizados para None e não viram predicados
+    inicio = fim = None
     if isinstance(intervalo, (list, tuple)) and len(intervalo) == 2:
         inicio, fim = intervalo
         if inicio > fim:
             st.error("A data inicial não pode ser posterior à data final.")
-            return df
-        df_filtrado = df_filtrado[
-            (pd.to_datetime(df_filtrado["Data"]) >= pd.to_datetime(inicio)) &
-            (pd.to_datetime(df_filtrado["Data"]) <= pd.to_datetime(fim))
-        ]
+            return SEM_FILTRO
+        inicio = inicio if inicio > data_min else None
+        fim = fim if fim < data_max else None
+    filtro_periodo = FiltroMovimentacoes(inicio=inicio, fim=fim)
     
-    produtos_disp = sorted(df_filtrado["Produto"].unique())
+    produtos_disp = estoque.produtos(filtro_periodo)
     produtos_sel = st.sidebar.multiselect(
         "Produtos",
         options=produtos_disp,
         default=produtos_disp,
         help="Selecione os produtos a serem exibidos"
     )
-    if produtos_sel:
-        df_filtrado = df_filtrado[df_filtrado["Produto"].isin(produtos_sel)]
+    produtos = None
+    if produtos_sel and len(produtos_sel) < len(produtos_disp):
+        produtos = tuple(sorted(produtos_sel))
     
     tipo_mov = st.sidebar.multiselect(
         "Tipo de Movimentação",
@@ -496,24 +630,31 @@ def configurar_filtros(df):
         default=["entrada", "saída"],
         help="Selecione os tipos de movimentação"
     )
-    if tipo_mov:
-        df_filtrado = df_filtrado[df_filtrado["Tipo"].isin(tipo_mov)]
+    tipos = None
+    if tipo_mov and len(tipo_mov) < 2:
+        tipos = tuple(tipo_mov)
     
-    return df_filtrado
+    return FiltroMovimentacoes(inicio=inicio, fim=fim, produtos=produtos, tipos=tipos)
 
+@st.fragment
 def configurar_limpeza_dados():
-    """Configura a seção de limpeza de dados na sidebar."""
-    st.sidebar.header("Limpar Dados")
-    st.session_state.confirmar_limpeza = st.sidebar.checkbox(
+    """Configura a seção de limpeza de dados (chamada dentro da sidebar).
+
+    Fragmento: a confirmação não reexecuta a página; a limpeza sim.
+    """
+    st.header("Limpar Dados")
+    st.session_state.confirmar_limpeza = st.checkbox(
         "Confirmar limpeza dos dados",
         value=st.session_state.confirmar_limpeza
     )
     
-    if st.sidebar.button("Limpar Dados"):
+    mensagem = st.session_state.pop("mensagem_limpeza", None)
+    if mensagem:
+        st.success(mensagem)
+    
+    if st.button("Limpar Dados"):
         if st.session_state.confirmar_limpeza:
-            st.session_state.df = pd.DataFrame(
-                columns=["Data", "Produto", "Tipo", "Quantidade", "Custo Unitário", "Preço de Venda"]
-            )
+            estoque.limpar()
             st.session_state.form_data = {
                 "data": date.today(),
                 "produto": "",
@@ -523,178 +664,337 @@ def configurar_limpeza_dados():
                 "preco_venda": 0.0
             }
             st.session_state.confirmar_limpeza = False
-            st.sidebar.success("Dados limpos com sucesso!")
+            st.session_state.mensagem_limpeza = "Dados limpos com sucesso!"
+            st.rerun()
         else:
-            st.sidebar.warning("Marque a caixa de confirmação para limpar os dados.")
+            st.warning("Marque a caixa de confirmação para limpar os dados.")
 
 def configurar_analise_detalhada():
-    """Configura a seção de análise detalhada por produto."""
-    st.sidebar.header("Análise Detalhada por Produto")
-    produtos_analise = sorted(st.session_state.df["Produto"].unique().tolist())
-    produto_escolhido = st.sidebar.selectbox(
+    """Configura a seleção do produto e da agregação da análise detalhada."""
+    produtos_analise = estoque.ler(estoque.agregados.produtos)
+    col_produto, col_agregacao = st.columns(2)
+    produto_escolhido = col_produto.selectbox(
         "Selecione um produto",
         options=["Nenhum"] + produtos_analise,
         help="Escolha um produto para análise detalhada"
     )
-    agregacao = st.sidebar.selectbox(
+    agregacao = col_agregacao.selectbox(
         "Agregação Temporal",
         ["Diária", "Semanal", "Mensal"],
         help="Selecione o nível de agregação temporal"
     )
     return produto_escolhido, agregacao
 
-def aggregate_movimentacoes(df):
-    """Agrega os dados de movimentações por Produto, Tipo e Custo Unitário, tratando saídas corretamente."""
-    if df.empty:
-        return df
-    
-    # Ajustar quantidades para saídas (negativas)
-    df = df.copy()
-    df["Quantidade Ajustada"] = df.apply(
-        lambda row: row["Quantidade"] if row["Tipo"] == "entrada" else -row["Quantidade"], axis=1
+def movimentacoes_agregadas(df, versao):
+    """Movimentações agregadas por produto, tipo e custo; sem df, combinando os blocos do livro."""
+    if df is not None:
+        return aggregate_movimentacoes(df)
+    return em_cache(
+        "movimentacoes agregadas", SEM_FILTRO, lambda: agregar_movimentacoes_em_blocos(estoque.varrer()), versao
     )
-    
-    # Agrupar por Produto, Tipo e Custo Unitário
-    grouped = df.groupby(["Produto", "Tipo", "Custo Unitário"]).agg({
-        "Quantidade Ajustada": "sum",  # Somar quantidades ajustadas
-        "Data": "max",                 # Pegar a data mais recente
-        "Preço de Venda": "last"       # Pegar o último preço de venda
-    }).reset_index()
-    
-    # Renomear coluna para manter consistência
-    grouped = grouped.rename(columns={"Quantidade Ajustada": "Quantidade"})
-    
-    # Reordenar colunas
-    return grouped[["Data", "Produto", "Tipo", "Quantidade", "Custo Unitário", "Preço de Venda"]]
 
-def exibir_dados_movimentacoes(df):
-    """Exibe a tabela de movimentações com agregação por produto e custo unitário."""
+def movimentacoes_ordenadas(df, coluna, crescente, versao):
+    """Movimentações agregadas e ordenadas, em cache até a próxima escrita no livro."""
+    def calcular():
+        agregadas = movimentacoes_agregadas(df, versao)
+        if agregadas.empty:
+            return agregadas
+        return agregadas.sort_values(coluna, ascending=crescente, kind="stable", ignore_index=True)
+    return em_cache("movimentacoes", (coluna, crescente), calcular, versao)
+
+@fragmento_medido("tabela de movimentações")
+def exibir_dados_movimentacoes():
+    """Exibe a tabela de movimentações agregada, paginada e ordenável.
+
+    Fragmento: ordenação e paginação reexecutam apenas a tabela, que relê as
+    movimentações (do cache, se o livro não mudou) para não exibir dados antigos.
+    """
     st.subheader("Dados de Movimentações")
-    if df.empty:
+    versao = estoque.versao
+    df = None
+    if not estoque.fora_da_memoria:
+        with fase("consulta de movimentações") as medida:
+            df = consultar_movimentacoes(versao=versao)
+            medida.registrar(linhas=len(df))
+    sem_dados = not len(estoque.agregados) if df is None else df.empty
+    if sem_dados:
         st.info("Nenhum dado inserido até o momento.")
         return
     
-    # Agregar os dados antes de exibir
-    df_aggregated = aggregate_movimentacoes(df)
+    col_ordem, col_sentido, col_tamanho, col_pagina = st.columns(4)
+    coluna = col_ordem.selectbox(
+        "Ordenar por", ["Data", "Produto", "Tipo", "Quantidade", "Custo Unitário", "Preço de Venda"],
+        key="mov_ordem"
+    )
+    crescente = col_sentido.selectbox("Ordem", ["Decrescente", "Crescente"], key="mov_sentido") == "Crescente"
+    tamanho = col_tamanho.selectbox("Linhas por página", [25, 50, 100, 250], key="mov_tamanho")
     
-    # Criar uma cópia para formatação
-    df_display = df_aggregated.copy()
-    df_display["Custo Unitário"] = df_display["Custo Unitário"].apply(lambda x: f"R$ {x:,.2f}")
-    df_display["Preço de Venda"] = df_display["Preço de Venda"].apply(lambda x: f"R$ {x:,.2f}")
+    df_aggregated = movimentacoes_ordenadas(df, coluna, crescente, versao)
+    total_paginas = max((len(df_aggregated) + tamanho - 1) // tamanho, 1)
+    pagina = col_pagina.number_input(
+        f"Página (de {total_paginas})", min_value=1, max_value=total_paginas, value=1, step=1, key="mov_pagina"
+    )
     
-    def color_tipo(val):
-        color = '#E3F2FD' if val == "entrada" else '#FFEBEE'
-        return f'background-color: {color}'
+    # Apenas a página visível é formatada e estilizada
+    inicio = (min(int(pagina), total_paginas) - 1) * tamanho
+    df_display = df_aggregated.iloc[inicio:inicio + tamanho].copy()
+    df_display["Data"] = df_display["Data"].dt.strftime("%Y-%m-%d")
+    
+    def color_tipo(tipos):
+        return np.where(tipos == "entrada", "background-color: #E3F2FD", "background-color: #FFEBEE")
     
     styled_df = (
         df_display.style
-        .applymap(color_tipo, subset=["Tipo"])
+        .apply(color_tipo, subset=["Tipo"])
+        .format(formatar_moeda, subset=["Custo Unitário", "Preço de Venda"])
         .set_properties(**{'text-align': 'left'})
-        .set_table_styles([
-            {'selector': 'th', 'props': [('font-size', '12pt'), ('text-align', 'center')]},
-            {'selector': 'td', 'props': [('font-size', '11pt')]}
-        ])
     )
-    st.write(styled_df)
+    st.dataframe(styled_df, use_container_width=True, hide_index=True)
+    st.caption(f"{len(df_aggregated)} linhas agregadas")
 
-def exibir_resumo_estoque(df_filtrado):
+def exibir_resumo_estoque(filtro, resumo, versao):
     """Exibe o resumo do estoque e gráficos."""
-    if df_filtrado.empty:
+    if resumo.empty:
         st.info("Nenhum dado disponível após os filtros.")
         return
     
-    saldo = calcular_saldo(df_filtrado)
+    saldo = resumo.por_produto
+    
+    # Verificar saídas inválidas
+    if resumo.saidas_sem_preco:
+        st.warning(
+            "Existem saídas com 'Preço de Venda' igual a 0. "
+            "Por favor, corrija os registros para cálculos precisos."
+        )
     
     st.subheader("Resumo do Estoque por Produto")
-    st.write(formatar_tabela_resumo(saldo))
+    with fase("tabela de resumo"):
+        st.write(formatar_tabela_resumo(saldo))
     
     st.subheader("Gráficos Comparativos")
-    col_chart1, col_chart2 = st.columns(2)
-    with col_chart1:
-        grafico_barra_quantidade(saldo)
-    with col_chart2:
-        grafico_barra_valor(saldo)
+    with fase("gráficos"):
+        col_chart1, col_chart2 = st.columns(2)
+        with col_chart1:
+            grafico_barra_quantidade(filtro, saldo, versao)
+        with col_chart2:
+            grafico_barra_valor(filtro, saldo, versao)
     
     # Cálculos globais
-    total_entradas_qty = df_filtrado[df_filtrado["Tipo"]=="entrada"]["Quantidade"].sum()
-    total_saidas_qty = df_filtrado[df_filtrado["Tipo"]=="saída"]["Quantidade"].sum()
-    total_valor_entradas = (
-        df_filtrado[df_filtrado["Tipo"]=="entrada"]["Quantidade"] *
-        df_filtrado[df_filtrado["Tipo"]=="entrada"]["Custo Unitário"]
-    ).sum()
-    total_valor_saidas = (
-        df_filtrado[df_filtrado["Tipo"]=="saída"]["Quantidade"] *
-        df_filtrado[df_filtrado["Tipo"]=="saída"]["Preço de Venda"]
-    ).sum()
-    
-    # Cálculo do lucro global
-    df_saidas = df_filtrado[df_filtrado["Tipo"] == "saída"].copy()
-    custo_medio = df_filtrado[df_filtrado["Tipo"] == "entrada"].groupby("Produto")["Custo Unitário"].mean()
-    df_saidas = df_saidas.join(custo_medio.rename("Custo Médio"), on="Produto")
-    df_saidas["Custo Médio"] = df_saidas["Custo Médio"].fillna(0.0)
-    df_saidas["Lucro"] = df_saidas["Quantidade"] * (df_saidas["Preço de Venda"] - df_saidas["Custo Médio"])
-    lucro_global = df_saidas["Lucro"].sum()
+    totais = resumo.totais
+    total_entradas_qty = totais["Entradas"]
+    total_saidas_qty = totais["Saídas"]
+    total_valor_entradas = totais["Valor Entradas"]
+    total_valor_saidas = totais["Valor Saídas"]
+    lucro_global = totais["Lucro"]
     
     st.subheader("Resumo Global")
     col_res1, col_res2, col_res3, col_res4, col_res5 = st.columns(5)
     col_res1.metric("Entradas (Qtd)", value=int(total_entradas_qty))
     col_res2.metric("Saídas (Qtd)", value=int(total_saidas_qty))
-    col_res3.metric("Valor Entradas", value=f"R$ {total_valor_entradas:,.2f}")
-    col_res4.metric("Valor Saídas", value=f"R$ {total_valor_saidas:,.2f}")
+    col_res3.metric("Valor Entradas", value=formatar_moeda(total_valor_entradas))
+    col_res4.metric("Valor Saídas", value=formatar_moeda(total_valor_saidas))
     
     lucro_label = "Lucro (Perda)" if lucro_global < 0 else "Lucro"
     lucro_value = abs(lucro_global) if lucro_global < 0 else lucro_global
     delta = f"-R$ {abs(lucro_global):,.2f}" if lucro_global < 0 else f"+R$ {lucro_global:,.2f}"
     delta_color = "inverse" if lucro_global < 0 else "normal"
-    col_res5.metric(lucro_label, value=f"R$ {lucro_value:,.2f}", delta=delta, delta_color=delta_color)
+    col_res5.metric(lucro_label, value=formatar_moeda(lucro_value), delta=delta, delta_color=delta_color)
     
-    if st.button("Exportar Relatório para Excel"):
-        with st.spinner("Gerando relatório..."):
-            caminho, nome_arquivo = exportar_relatorio(df_filtrado, saldo)
-            if caminho and nome_arquivo:
-                with open(caminho, "rb") as file:
-                    st.download_button(
-                        label="Download do Relatório",
-                        data=file,
-                        file_name=nome_arquivo,
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                    )
-                os.unlink(caminho)
-                st.success("Relatório gerado com sucesso!")
+    exibir_exportacao(filtro)
+
+@fragmento_medido("análise detalhada")
+def exibir_analise_detalhada():
+    """Exibe a análise detalhada por produto.
 
-def exibir_analise_detalhada(produto_escolhido, agregacao):
-    """Exibe a análise detalhada por produto."""
+    Fragmento: trocar o produto ou a agregação reexecuta apenas esta seção.
+    """
+    st.subheader("Análise Detalhada por Produto")
+    produto_escolhido, agregacao = configurar_analise_detalhada()
     if produto_escolhido == "Nenhum":
         return
     
-    df_prod = st.session_state.df[st.session_state.df["Produto"] == produto_escolhido]
+    df_prod = consultar_movimentacoes(FiltroMovimentacoes(produtos=(produto_escolhido,)))
     if df_prod.empty:
         st.info(f"Nenhum dado disponível para o produto {produto_escolhido}.")
         return
     
-    st.subheader(f"Análise Detalhada - {produto_escolhido}")
-    st.dataframe(df_prod, use_container_width=True)
-    grafico_linha_evolucao(produto_escolhido, df_prod, agregacao)
+    with fase("tabela do produto"):
+        st.dataframe(
+            df_prod,
+            use_container_width=True,
+            column_config={"Data": st.column_config.DateColumn("Data", format="YYYY-MM-DD")}
+        )
+    with fase("gráfico de evolução"):
+        grafico_linha_evolucao(produto_escolhido, agregacao)
 
-def exibir_principais_produtos(df_filtrado):
+def exibir_principais_produtos(filtro, resumo, versao):
     """Exibe os principais produtos por saldo."""
     st.subheader("Principais Produtos por Saldo")
-    grafico_top_produtos(df_filtrado)
+    with fase("principais produtos"):
+        grafico_top_produtos(filtro, resumo, versao)
+
+def exibir_painel_desempenho():
+    """Exibe na sidebar os tempos por fase das últimas execuções, quando ativado."""
+    if not st.sidebar.checkbox("Painel de desempenho", key="painel_desempenho"):
+        return
+    medicao = st.session_state.medicao
+    with st.sidebar.expander("Tempos por fase (ms)", expanded=True):
+        tabela = medicao.tabela()
+        if tabela.empty:
+            st.caption("As medições aparecem a partir da próxima execução.")
+            return
+        st.dataframe(tabela.round(1), use_container_width=True)
+        st.json(medicao.contagens())
 
 # ==============================================================================
 # EXECUÇÃO PRINCIPAL
 # ==============================================================================
 
-st.title("📦 Sistema de Controle de Mercadorias 📦")
+def main():
+    """Monta a página: configuração, estado da sessão e execução das seções."""
+    global estoque
+    
+    # Configuração da página
+    st.set_page_config(page_title="Controle de Mercadorias", layout="wide")
+
+    # CSS personalizado (mantido igual ao original)
+    st.markdown(
+        """
+        <style>
+            .main .block-container {
+                padding: 2rem;
+                max-width: 1200px;
+                margin: auto;
+                background-color: #FFFFFF;
+            }
+            h1, h2, h3, h4 {
+                font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
+                color: #1A3C5A;
+            }
+            .css-1avcm0n {
+                font-family: 'Segoe UI', sans-serif;
+                color: #1A3C5A;
+            }
+            .stButton>button {
+                background-color: #2E7D32;
+                color: white;
+                border: none;
+                border-radius: 8px;
+                padding: 0.5rem 1rem;
+                font-weight: bold;
+            }
+            .stButton>button:hover {
+                background-color: #4CAF50;
+                cursor: pointer;
+            }
+            .css-kniuvf {
+                background-color: #F5F7FA;
+                border: 1px solid #E0E0E0;
+                border-radius: 8px;
+                padding: 1rem;
+                font-size: 1.2rem;
+            }
+            a {
+                color: #4CAF50;
+                text-decoration: none;
+            }
+            a:hover {
+                color: #2E7D32;
+            }
+            table {
+                border-collapse: collapse;
+                width: 100%;
+            }
+            th, td {
+                padding: 8px;
+                text-align: left;
+                border-bottom: 1px solid #E0E0E0;
+            }
+            th {
+                background-color: #1A3C5A;
+                color: white;
+            }
+            .form-container {
+                background-color: #F5F7FA;
+                padding: 1.5rem;
+                border-radius: 8px;
+                margin-bottom: 2rem;
+                border: 1px solid #E0E0E0;
+            }
+            .stTextInput>div>input,
+            .stNumberInput>div>input,
+            .stSelectbox>div>select,
+            .stDateInput>div>input {
+                border-radius: 4px;
+                border: 1px solid #E0E0E0;
+                background-color: #FFFFFF;
+            }
+        </style>
+        """,
+        unsafe_allow_html=True
+    )
+
+    estoque = obter_estoque()
+
+    # Inicialização do session_state
+    if "medicao" not in st.session_state:
+        st.session_state.medicao = MedicaoExecucoes()
+
+    if "form_data" not in st.session_state:
+        st.session_state.form_data = {
+            "data": date.today(),
+            "produto": "",
+            "tipo": "entrada",
+            "quantidade": 0,
+            "custo_unitario": 0.0,
+            "preco_venda": 0.0
+        }
+
+    if "confirmar_limpeza" not in st.session_state:
+        st.session_state.confirmar_limpeza = False
+
+    if "correcoes" not in st.session_state:
+        st.session_state.correcoes = deque(maxlen=LIMITE_DESFAZER)
+
+    st.title("📦 Sistema de Controle de Mercadorias 📦")
+
+    # Medição ligada pelo painel de desempenho (ou por GEREN_MEDICAO=1)
+    medicao = st.session_state.medicao
+    medicao.ativa = MEDICAO_PADRAO or st.session_state.get("painel_desempenho", False)
+    medicao.iniciar_execucao()
+
+    # Seções em fragmentos (st.fragment) são medidas por fragmento_medido, também
+    # quando reexecutadas sozinhas
+    try:
+        # Configuração da interface
+        inserir_registro_manual()
+        importar_registros_em_lote()
+        corrigir_registros()
+        with st.sidebar:
+            configurar_limpeza_dados()
+        # A versão é lida uma vez: consultas, resumo e gráficos desta execução ficam
+        # em cache sob a versão dos dados que de fato leram
+        versao = estoque.versao
+        with fase("filtros") as medida:
+            filtro = configurar_filtros(estoque)
+            # Fora da memória, o filtro nunca é carregado inteiro: resumo e exportação leem em blocos
+            df_filtrado = None
+            if not estoque.fora_da_memoria:
+                df_filtrado = consultar_movimentacoes(filtro, versao)
+                medida.registrar(linhas=len(df_filtrado))
+        with fase("resumo") as medida:
+            resumo = calcular_saldo(filtro, df_filtrado, versao)
+            medida.registrar(produtos=len(resumo.por_produto))
+
+        # Exibição dos dados
+        exibir_dados_movimentacoes()
+        exibir_resumo_estoque(filtro, resumo, versao)
+        exibir_analise_detalhada()
+        exibir_principais_produtos(filtro, resumo, versao)
+    finally:
+        medicao.concluir_execucao()
+    exibir_painel_desempenho()
 
-# Configuração da interface
-inserir_registro_manual()
-configurar_limpeza_dados()
-df_filtrado = configurar_filtros(st.session_state.df)
-produto_escolhido, agregacao = configurar_analise_detalhada()
 
-# Exibição dos dados
-exibir_dados_movimentacoes(st.session_state.df)
-exibir_resumo_estoque(df_filtrado)
-exibir_analise_detalhada(produto_escolhido, agregacao)
-exibir_principais_produtos(df_filtrado)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,912 @@
+import json
+import logging
+import os
+import sqlite3
+import uuid
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from agregados import AgregadosEstoque
+from ledger import COLUNAS, LedgerMovimentacoes, aplicar_esquema
+
+logger = logging.getLogger(__name__)
+
+# Linhas por bloco nas leituras em blocos do SQLite
+TAMANHO_BLOCO = 100_000
+
+# Versão do layout dos arquivos Parquet (2: coluna id)
+FORMATO_PARQUET = 2
+
+# Nomes das colunas no armazenamento (sem acentos nem espaços)
+COLUNAS_ARMAZENAMENTO = {
+    "Data": "data",
+    "Produto": "produto",
+    "Tipo": "tipo",
+    "Quantidade": "quantidade",
+    "Custo Unitário": "custo_unitario",
+    "Preço de Venda": "preco_venda",
+}
+COLUNAS_LIVRO = {nome: coluna for coluna, nome in COLUNAS_ARMAZENAMENTO.items()}
+
+
+@dataclass(frozen=True)
+class FiltroMovimentacoes:
+    """Predicados de consulta das movimentações. None significa "sem restrição"."""
+
+    inicio: object = None
+    fim: object = None
+    produtos: tuple = None
+    tipos: tuple = None
+
+    @property
+    def ativo(self):
+        return any(valor is not None for valor in (self.inicio, self.fim, self.produtos, self.tipos))
+
+    def historico(self):
+        """Filtro do histórico que determina o custo das saídas deste filtro.
+
+        O CMV de uma saída depende de todas as movimentações anteriores do
+        produto, inclusive as que o filtro exclui por data ou por Tipo.
+        """
+        return FiltroMovimentacoes(fim=self.fim, produtos=self.produtos)
+
+    def mascara(self, df):
+        """Máscara booleana das linhas de df (com as colunas do livro) que atendem ao filtro."""
+        mascara = np.ones(len(df), dtype=bool)
+        if self.inicio is not None:
+            mascara &= (df["Data"] >= pd.Timestamp(self.inicio)).to_numpy()
+        if self.fim is not None:
+            mascara &= (df["Data"] <= pd.Timestamp(self.fim)).to_numpy()
+        if self.produtos is not None:
+            mascara &= df["Produto"].isin(self.produtos).to_numpy()
+        if self.tipos is not None:
+            mascara &= df["Tipo"].isin(self.tipos).to_numpy()
+        return mascara
+
+
+SEM_FILTRO = FiltroMovimentacoes()
+
+
+@dataclass(frozen=True)
+class PosicaoDiario:
+    """Ponto do diário de um backend persistente.
+
+    geracao muda quando o livro é limpo ou reescrito (as demais posições deixam
+    de valer); movimentacoes é a posição das inserções (ver varrer_diario);
+    ultimo_id, o maior ID já distribuído; correcao, a última correção gravada
+    (ver varrer_correcoes).
+    """
+
+    geracao: int = 0
+    movimentacoes: int = 0
+    ultimo_id: int = 0
+    correcao: int = 0
+
+    def alcanca(self, anterior):
+        """True se o diário nesta posição contém tudo o que havia na posição anterior."""
+        return self.geracao == anterior.geracao and all(
+            getattr(self, campo) >= getattr(anterior, campo) for campo in ("movimentacoes", "ultimo_id", "correcao")
+        )
+
+
+def _correcao_para_json(registro):
+    """Registro de uma correção como valor JSON (None para registro inexistente)."""
+    if registro is None:
+        return None
+    return {
+        "Data": pd.Timestamp(registro["Data"]).date().isoformat(),
+        "Produto": registro["Produto"],
+        "Tipo": registro["Tipo"],
+        "Quantidade": int(registro["Quantidade"]),
+        "Custo Unitário": float(registro["Custo Unitário"]),
+        "Preço de Venda": float(registro["Preço de Venda"]),
+    }
+
+
+def _correcao_de_json(valor):
+    if valor is None:
+        return None
+    return {**valor, "Data": pd.Timestamp(valor["Data"])}
+
+
+def _para_livro(df):
+    """Converte um DataFrame lido do armazenamento para as colunas e o esquema do livro.
+
+    A coluna id, quando lida, vira o índice "ID" (o identificador estável do registro).
+    """
+    if "id" in df.columns:
+        df = df.set_index("id").rename_axis("ID")
+    return aplicar_esquema(df.rename(columns=COLUNAS_LIVRO))
+
+
+def _registro(df):
+    """Primeira linha de um DataFrame lido do armazenamento como registro do livro (None se vazio)."""
+    if df.empty:
+        return None
+    linha = _para_livro(df).iloc[0]
+    return {
+        "Data": linha["Data"],
+        "Produto": linha["Produto"],
+        "Tipo": linha["Tipo"],
+        "Quantidade": int(linha["Quantidade"]),
+        "Custo Unitário": float(linha["Custo Unitário"]),
+        "Preço de Venda": float(linha["Preço de Venda"]),
+    }
+
+
+def _para_armazenamento(df):
+    """Converte um DataFrame do livro para as colunas do armazenamento."""
+    df = df[COLUNAS].rename(columns=COLUNAS_ARMAZENAMENTO)
+    df["data"] = pd.to_datetime(df["data"])
+    df["produto"] = df["produto"].astype(str)
+    df["tipo"] = df["tipo"].astype(str)
+    return df
+
+
+class Backend:
+    """Base dos backends: mantém o contador de versão usado como chave de cache.
+
+    Cada registro tem um ID estável, que é o índice dos DataFrames devolvidos
+    por consultar() e varrer(); registro(id), substituir(id, registro),
+    remover(id) e restaurar(id, registro) corrigem um registro pelo ID.
+
+    Backends persistentes também funcionam como diário (journal) só de acréscimo:
+    posicao_diario() identifica o ponto atual do diário (PosicaoDiario),
+    varrer_diario(desde) entrega as movimentações gravadas depois de uma posição
+    e varrer_correcoes(desde) as correções, como (ID, antes, depois). Isso
+    permite retomar as estruturas derivadas de um checkpoint em vez de reler
+    todo o histórico; só limpar() e compactar() mudam a geração.
+    """
+
+    _versao = 0
+    # Arquivo do checkpoint das estruturas derivadas (None: backend sem persistência)
+    caminho_checkpoint = None
+
+    @property
+    def versao(self):
+        """Muda a cada escrita; dois valores iguais garantem o mesmo conteúdo."""
+        return self._versao
+
+    def _registrar_escrita(self):
+        self._versao += 1
+
+    def varrer(self, filtro=SEM_FILTRO, colunas=None, ao_progredir=None):
+        """Entrega as movimentações do filtro em blocos, em ordem de data (sempre ao menos um bloco).
+
+        ao_progredir(fracao), se informado, recebe a fração já entregue. Nos
+        backends em memória o bloco é um só.
+        """
+        colunas = COLUNAS if colunas is None else list(colunas)
+        df = self.consultar(filtro, list(dict.fromkeys(["Data", *colunas])))
+        yield df.sort_values("Data", kind="stable")[colunas]
+        if ao_progredir is not None:
+            ao_progredir(1.0)
+
+
+def _totais_diarios(df):
+    """Soma as quantidades por produto, dia e tipo."""
+    return (
+        df.groupby(["Produto", "Data", "Tipo"], observed=True, sort=False)["Quantidade"]
+        .sum()
+        .reset_index()
+    )
+
+
+# ==============================================================================
+# BACKEND EM MEMÓRIA
+# ==============================================================================
+
+class BackendMemoria(Backend):
+    """Mantém as movimentações apenas em memória, no livro colunar da sessão."""
+
+    def __init__(self):
+        self.ledger = LedgerMovimentacoes()
+
+    def __len__(self):
+        return len(self.ledger)
+
+    def adicionar(self, registro):
+        self.ledger.adicionar(registro)
+        self._registrar_escrita()
+
+    def adicionar_lote(self, df):
+        self.ledger.estender(df)
+        self._registrar_escrita()
+
+    def limpar(self):
+        self.ledger.limpar()
+        self._registrar_escrita()
+
+    def registro(self, id_registro):
+        return self.ledger.registro(id_registro)
+
+    def substituir(self, id_registro, registro):
+        self.ledger.substituir(id_registro, registro)
+        self._registrar_escrita()
+
+    def remover(self, id_registro):
+        self.ledger.remover(id_registro)
+        self._registrar_escrita()
+
+    def restaurar(self, id_registro, registro):
+        # As posições removidas continuam reservadas: restaurar é gravar no mesmo lugar
+        self.substituir(id_registro, registro)
+
+    def intervalo_datas(self):
+        return self.ledger.intervalo_datas()
+
+    def produtos(self, filtro=SEM_FILTRO):
+        return self.ledger.produtos_filtrados(filtro.inicio, filtro.fim, filtro.produtos, filtro.tipos)
+
+    def consultar(self, filtro=SEM_FILTRO, colunas=None):
+        df = self.ledger.filtrar(filtro.inicio, filtro.fim, filtro.produtos, filtro.tipos)
+        return df if colunas is None else df[list(colunas)]
+
+    def agregados(self):
+        return AgregadosEstoque.de_dataframe(self.ledger.dataframe())
+
+    def totais_diarios(self):
+        return _totais_diarios(self.ledger.dataframe())
+
+
+# ==============================================================================
+# BACKEND SQLITE
+# ==============================================================================
+
+class BackendSQLite(Backend):
+    """Armazena as movimentações em SQLite no modo WAL, com inserções transacionais."""
+
+    def __init__(self, caminho):
+        pasta = os.path.dirname(caminho)
+        if pasta:
+            os.makedirs(pasta, exist_ok=True)
+        self.caminho = caminho
+        self.caminho_checkpoint = f"{caminho}.checkpoint"
+        self.conexao = sqlite3.connect(caminho, check_same_thread=False)
+        self.conexao.execute("PRAGMA journal_mode=WAL")
+        self.conexao.execute("PRAGMA synchronous=NORMAL")
+        with self.conexao:
+            self.conexao.execute(
+                """
+                CREATE TABLE IF NOT EXISTS movimentacoes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    data TEXT NOT NULL,
+                    produto TEXT NOT NULL,
+                    tipo TEXT NOT NULL,
+                    quantidade INTEGER NOT NULL,
+                    custo_unitario REAL NOT NULL,
+                    preco_venda REAL NOT NULL
+                )
+                """
+            )
+            self.conexao.execute("CREATE INDEX IF NOT EXISTS idx_mov_data ON movimentacoes (data)")
+            self.conexao.execute("CREATE INDEX IF NOT EXISTS idx_mov_produto_data ON movimentacoes (produto, data)")
+            # Diário das correções: o registro antes e depois de cada uma (JSON; null = inexistente)
+            self.conexao.execute(
+                """
+                CREATE TABLE IF NOT EXISTS correcoes (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    id_registro INTEGER NOT NULL,
+                    antes TEXT,
+                    depois TEXT
+                )
+                """
+            )
+        # Tabelas criadas antes do AUTOINCREMENT reaproveitam o maior id removido
+        definicao = self.conexao.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'movimentacoes'"
+        ).fetchone()[0]
+        self._autoincremento = "AUTOINCREMENT" in definicao.upper()
+        logger.info(f"Armazenamento SQLite aberto em {caminho}")
+
+    def __len__(self):
+        return self.conexao.execute("SELECT COUNT(*) FROM movimentacoes").fetchone()[0]
+
+    @property
+    def versao(self):
+        # data_version muda quando outra conexão grava no mesmo arquivo
+        return self._versao, self.conexao.execute("PRAGMA data_version").fetchone()[0]
+
+    @staticmethod
+    def _valores(registro):
+        return (
+            pd.Timestamp(registro["Data"]).date().isoformat(),
+            registro["Produto"],
+            registro["Tipo"],
+            int(registro["Quantidade"]),
+            float(registro["Custo Unitário"]),
+            float(registro["Preço de Venda"]),
+        )
+
+    def adicionar(self, registro):
+        with self.conexao:
+            self.conexao.execute(
+                "INSERT INTO movimentacoes (data, produto, tipo, quantidade, custo_unitario, preco_venda) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                self._valores(registro),
+            )
+        self._registrar_escrita()
+
+    def adicionar_lote(self, df):
+        df = _para_armazenamento(df)
+        df["data"] = df["data"].dt.strftime("%Y-%m-%d")
+        with self.conexao:
+            self.conexao.executemany(
+                "INSERT INTO movimentacoes (data, produto, tipo, quantidade, custo_unitario, preco_venda) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                df.itertuples(index=False, name=None),
+            )
+        self._registrar_escrita()
+
+    def limpar(self):
+        with self.conexao:
+            self.conexao.execute("DELETE FROM movimentacoes")
+            self.conexao.execute("DELETE FROM correcoes")
+            # Os ids podem recomeçar do 1: uma nova geração invalida posições antigas do diário
+            self._nova_geracao()
+        self._registrar_escrita()
+
+    def _nova_geracao(self):
+        geracao = self.conexao.execute("PRAGMA user_version").fetchone()[0]
+        self.conexao.execute(f"PRAGMA user_version = {geracao + 1}")
+
+    def registro(self, id_registro):
+        df = pd.read_sql_query(
+            f"SELECT {', '.join(COLUNAS_ARMAZENAMENTO.values())} FROM movimentacoes WHERE id = ?",
+            self.conexao,
+            params=(int(id_registro),),
+        )
+        return _registro(df)
+
+    # Cada correção é gravada no diário de correções na mesma transação que a altera
+
+    def _registrar_correcao(self, id_registro, antes, depois):
+        self.conexao.execute(
+            "INSERT INTO correcoes (id_registro, antes, depois) VALUES (?, ?, ?)",
+            (
+                int(id_registro),
+                json.dumps(_correcao_para_json(antes), ensure_ascii=False),
+                json.dumps(_correcao_para_json(depois), ensure_ascii=False),
+            ),
+        )
+
+    def substituir(self, id_registro, registro):
+        antes = self.registro(id_registro)
+        with self.conexao:
+            self.conexao.execute(
+                "UPDATE movimentacoes SET data = ?, produto = ?, tipo = ?, quantidade = ?, "
+                "custo_unitario = ?, preco_venda = ? WHERE id = ?",
+                (*self._valores(registro), int(id_registro)),
+            )
+            self._registrar_correcao(id_registro, antes, registro)
+        self._registrar_escrita()
+
+    def remover(self, id_registro):
+        antes = self.registro(id_registro)
+        with self.conexao:
+            self.conexao.execute("DELETE FROM movimentacoes WHERE id = ?", (int(id_registro),))
+            self._registrar_correcao(id_registro, antes, None)
+            if not self._autoincremento:
+                # Sem AUTOINCREMENT o id removido pode voltar em uma inserção nova, que o diário não distinguiria
+                self._nova_geracao()
+        self._registrar_escrita()
+
+    def restaurar(self, id_registro, registro):
+        try:
+            with self.conexao:
+                self.conexao.execute(
+                    "INSERT INTO movimentacoes (id, data, produto, tipo, quantidade, custo_unitario, preco_venda) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (int(id_registro), *self._valores(registro)),
+                )
+                self._registrar_correcao(id_registro, None, registro)
+        except sqlite3.IntegrityError:
+            # Só em tabelas criadas sem AUTOINCREMENT, que reaproveitam o maior id removido
+            raise ValueError(f"O ID {id_registro} já foi reutilizado por outro registro.") from None
+        self._registrar_escrita()
+
+    def posicao_diario(self):
+        """Posição atual do diário: a das movimentações é o maior id já distribuído."""
+        geracao = self.conexao.execute("PRAGMA user_version").fetchone()[0]
+        if self._autoincremento:
+            # sqlite_sequence guarda o maior id já usado, mesmo que a linha tenha sido removida
+            linha = self.conexao.execute("SELECT seq FROM sqlite_sequence WHERE name = 'movimentacoes'").fetchone()
+            posicao = linha[0] if linha else 0
+        else:
+            posicao = self.conexao.execute("SELECT COALESCE(MAX(id), 0) FROM movimentacoes").fetchone()[0]
+        correcao = self.conexao.execute("SELECT COALESCE(MAX(seq), 0) FROM correcoes").fetchone()[0]
+        return PosicaoDiario(geracao, posicao, posicao, correcao)
+
+    def varrer_correcoes(self, desde):
+        """(ID, antes, depois) das correções gravadas depois da posição desde, na ordem em que foram feitas."""
+        cursor = self.conexao.execute(
+            "SELECT id_registro, antes, depois FROM correcoes WHERE seq > ? ORDER BY seq", (desde.correcao,)
+        )
+        for id_registro, antes, depois in cursor:
+            yield id_registro, _correcao_de_json(json.loads(antes)), _correcao_de_json(json.loads(depois))
+
+    def varrer_diario(self, desde, colunas=None):
+        """Movimentações gravadas depois da posição desde, em blocos e na ordem de gravação."""
+        colunas = COLUNAS if colunas is None else list(colunas)
+        selecao = ", ".join(COLUNAS_ARMAZENAMENTO[coluna] for coluna in colunas)
+        blocos = pd.read_sql_query(
+            f"SELECT id, {selecao} FROM movimentacoes WHERE id > ? ORDER BY id",
+            self.conexao,
+            params=(desde.movimentacoes,),
+            chunksize=TAMANHO_BLOCO,
+        )
+        for bloco in blocos:
+            yield _para_livro(bloco)[colunas]
+
+    @staticmethod
+    def _where(filtro):
+        condicoes, parametros = [], []
+        if filtro.inicio is not None:
+            condicoes.append("data >= ?")
+            parametros.append(pd.Timestamp(filtro.inicio).date().isoformat())
+        if filtro.fim is not None:
+            condicoes.append("data <= ?")
+            parametros.append(pd.Timestamp(filtro.fim).date().isoformat())
+        for coluna, valores in (("produto", filtro.produtos), ("tipo", filtro.tipos)):
+            if valores is not None:
+                condicoes.append(f"{coluna} IN ({', '.join('?' * len(valores))})" if valores else "0")
+                parametros.extend(valores)
+        return (" WHERE " + " AND ".join(condicoes) if condicoes else ""), parametros
+
+    def intervalo_datas(self):
+        inicio, fim = self.conexao.execute("SELECT MIN(data), MAX(data) FROM movimentacoes").fetchone()
+        if inicio is None:
+            return None, None
+        return pd.Timestamp(inicio).date(), pd.Timestamp(fim).date()
+
+    def produtos(self, filtro=SEM_FILTRO):
+        where, parametros = self._where(filtro)
+        linhas = self.conexao.execute(
+            f"SELECT DISTINCT produto FROM movimentacoes{where} ORDER BY produto", parametros
+        )
+        return [produto for (produto,) in linhas]
+
+    def consultar(self, filtro=SEM_FILTRO, colunas=None):
+        colunas = COLUNAS if colunas is None else list(colunas)
+        selecao = ", ".join(COLUNAS_ARMAZENAMENTO[coluna] for coluna in colunas)
+        where, parametros = self._where(filtro)
+        df = pd.read_sql_query(
+            f"SELECT id, {selecao} FROM movimentacoes{where} ORDER BY id", self.conexao, params=parametros
+        )
+        return _para_livro(df)
+
+    def varrer(self, filtro=SEM_FILTRO, colunas=None, ao_progredir=None):
+        colunas = COLUNAS if colunas is None else list(colunas)
+        selecao = ", ".join(COLUNAS_ARMAZENAMENTO[coluna] for coluna in colunas)
+        where, parametros = self._where(filtro)
+        total = max(self.conexao.execute(f"SELECT COUNT(*) FROM movimentacoes{where}", parametros).fetchone()[0], 1)
+        lidas = 0
+        blocos = pd.read_sql_query(
+            f"SELECT id, {selecao} FROM movimentacoes{where} ORDER BY data, id",
+            self.conexao,
+            params=parametros,
+            chunksize=TAMANHO_BLOCO,
+        )
+        vazio = True
+        for bloco in blocos:
+            vazio = False
+            lidas += len(bloco)
+            yield _para_livro(bloco)[colunas]
+            if ao_progredir is not None:
+                ao_progredir(min(lidas / total, 1.0))
+        if vazio:
+            yield _para_livro(pd.DataFrame(columns=[COLUNAS_ARMAZENAMENTO[coluna] for coluna in colunas]))
+
+    def agregados(self):
+        totais = pd.read_sql_query(
+            """
+            SELECT
+                produto AS "Produto",
+                SUM(CASE WHEN tipo = 'entrada' THEN quantidade ELSE 0 END) AS "Entradas",
+                SUM(CASE WHEN tipo = 'saída' THEN quantidade ELSE 0 END) AS "Saídas",
+                SUM(CASE WHEN tipo = 'entrada' THEN quantidade * custo_unitario ELSE 0 END) AS "Valor Entradas",
+                SUM(CASE WHEN tipo = 'saída' THEN quantidade * preco_venda ELSE 0 END) AS "Valor Saídas",
+                SUM(CASE WHEN tipo = 'entrada' THEN custo_unitario ELSE 0 END) AS "Soma Custo Entradas",
+                SUM(tipo = 'entrada') AS "Registros Entrada",
+                SUM(tipo = 'saída' AND preco_venda <= 0) AS "Saídas Sem Preço",
+                (
+                    SELECT e.custo_unitario FROM movimentacoes e
+                    WHERE e.produto = m.produto AND e.tipo = 'entrada'
+                    ORDER BY e.id LIMIT 1
+                ) AS "Custo Primeira Entrada"
+            FROM movimentacoes m
+            GROUP BY produto
+            """,
+            self.conexao,
+            index_col="Produto",
+        )
+        return AgregadosEstoque.de_totais(totais)
+
+    def totais_diarios(self):
+        diarios = pd.read_sql_query(
+            "SELECT produto, data, tipo, SUM(quantidade) AS quantidade "
+            "FROM movimentacoes GROUP BY produto, data, tipo",
+            self.conexao,
+        )
+        return _para_livro(diarios)
+
+
+# ==============================================================================
+# BACKEND PARQUET
+# ==============================================================================
+
+# Arquivos por partição mensal a partir dos quais a gravação compacta a partição
+LIMITE_ARQUIVOS_PARTICAO = 32
+
+
+class BackendParquet(Backend):
+    """Armazena o histórico em Parquet particionado por mês (mes=AAAA-MM).
+
+    Pensado para cargas em lote: cada chamada de adicionar_lote grava um arquivo
+    por mês afetado. Inserções unitárias também são gravadas imediatamente, e
+    compactar() reescreve cada partição em um único arquivo. Uma partição que
+    chega a LIMITE_ARQUIVOS_PARTICAO arquivos é compactada na própria gravação,
+    para que inserções manuais não multipliquem os arquivos lidos a cada consulta.
+    As agregações leem uma partição por vez (varrer), de modo que o histórico
+    pode ser bem maior que a memória disponível.
+
+    Cada arquivo recebe um número de sequência crescente no nome
+    (parte-<sequência>-<sufixo>.parquet), que é a posição do diário. Compactar
+    uma partição e limpar() mudam a geração gravada em _geracao, já que os
+    arquivos reescritos misturam posições antigas e novas. O ID de cada linha
+    fica na coluna id e acompanha a linha quando o arquivo é reescrito; o
+    último ID distribuído é gravado em _ultimo_id. As correções reescrevem o
+    arquivo com a mesma sequência e são acrescentadas, uma por linha, ao diário
+    _correcoes.
+    """
+
+    def __init__(self, diretorio):
+        import pyarrow.dataset as ds
+
+        self._ds = ds
+        self.diretorio = diretorio
+        self.caminho_checkpoint = f"{diretorio.rstrip(os.sep)}.checkpoint"
+        os.makedirs(diretorio, exist_ok=True)
+        self._sequencia = max((sequencia for sequencia, _ in self._arquivos()), default=0)
+        self._correcao = sum(1 for _ in self._linhas_correcoes())
+        if self._marcador("_formato") < FORMATO_PARQUET:
+            self._migrar()
+        logger.info(f"Armazenamento Parquet aberto em {diretorio}")
+
+    def _migrar(self):
+        """Acrescenta a coluna id aos arquivos gravados antes dela (uma única vez por diretório)."""
+        import pyarrow.parquet as pq
+
+        migrados = 0
+        for sequencia, caminho in sorted(self._arquivos()):
+            if "id" in pq.read_schema(caminho).names:
+                continue
+            df = pd.read_parquet(caminho)
+            # Arquivos sem sequência no nome recebem uma agora
+            self._reescrever(caminho, df.assign(id=self._proximos_ids(len(df))), sequencia or self._proxima_sequencia())
+            migrados += 1
+        if migrados:
+            self._nova_geracao()
+            logger.info(f"{migrados} arquivos Parquet receberam a coluna id")
+        self._gravar_marcador("_formato", FORMATO_PARQUET)
+
+    @staticmethod
+    def _sequencia_arquivo(nome):
+        # Arquivos gravados antes da numeração (parte-<uuid>.parquet) ficam na posição 0
+        partes = nome.split("-")
+        return int(partes[1]) if len(partes) == 3 and partes[1].isdigit() else 0
+
+    def _arquivos(self):
+        """(sequência, caminho) de todos os arquivos de dados."""
+        arquivos = []
+        for pasta in os.listdir(self.diretorio):
+            if not pasta.startswith("mes="):
+                continue
+            caminho = os.path.join(self.diretorio, pasta)
+            arquivos.extend(
+                (self._sequencia_arquivo(arquivo), os.path.join(caminho, arquivo)) for arquivo in os.listdir(caminho)
+            )
+        return arquivos
+
+    def _proxima_sequencia(self):
+        self._sequencia += 1
+        return self._sequencia
+
+    def _proximos_ids(self, quantidade):
+        # O contador é gravado antes dos dados: uma falha no meio deixa IDs sem uso, nunca repetidos
+        inicio = self._marcador("_ultimo_id") + 1
+        self._gravar_marcador("_ultimo_id", inicio + quantidade - 1)
+        return np.arange(inicio, inicio + quantidade, dtype=np.int64)
+
+    def _gravar(self, mes, df, sequencia):
+        """Grava df (colunas do armazenamento e id) em um novo arquivo da partição do mês."""
+        pasta = os.path.join(self.diretorio, f"mes={mes}")
+        os.makedirs(pasta, exist_ok=True)
+        df.to_parquet(os.path.join(pasta, f"parte-{sequencia:012d}-{uuid.uuid4().hex[:8]}.parquet"), index=False)
+
+    def _reescrever(self, caminho, df, sequencia):
+        """Troca o arquivo por um com o conteúdo de df, apagando a partição se ela ficar vazia."""
+        pasta = os.path.dirname(caminho)
+        if not df.empty:
+            self._gravar(os.path.basename(pasta).split("=", 1)[1], df, sequencia)
+        os.unlink(caminho)
+        if not os.listdir(pasta):
+            os.rmdir(pasta)
+
+    def _marcador(self, nome):
+        try:
+            with open(os.path.join(self.diretorio, nome), encoding="utf-8") as arquivo:
+                return int(arquivo.read())
+        except FileNotFoundError:
+            return 0
+
+    def _gravar_marcador(self, nome, valor):
+        # Prefixo "_": o pyarrow ignora o arquivo ao montar o dataset
+        with open(os.path.join(self.diretorio, nome), "w", encoding="utf-8") as arquivo:
+            arquivo.write(str(valor))
+
+    def _geracao(self):
+        return self._marcador("_geracao")
+
+    def _nova_geracao(self):
+        self._gravar_marcador("_geracao", self._geracao() + 1)
+        # Posições de correção da geração anterior não valem mais
+        self._correcao = 0
+        try:
+            os.unlink(os.path.join(self.diretorio, "_correcoes"))
+        except FileNotFoundError:
+            pass
+
+    def _linhas_correcoes(self):
+        try:
+            with open(os.path.join(self.diretorio, "_correcoes"), encoding="utf-8") as arquivo:
+                yield from (linha for linha in arquivo if linha.strip())
+        except FileNotFoundError:
+            return
+
+    def _registrar_correcao(self, id_registro, antes, depois):
+        # Gravada depois dos dados: uma correção que falhe no meio não entra no diário
+        with open(os.path.join(self.diretorio, "_correcoes"), "a", encoding="utf-8") as arquivo:
+            correcao = {"id": int(id_registro), "antes": _correcao_para_json(antes), "depois": _correcao_para_json(depois)}
+            arquivo.write(json.dumps(correcao, ensure_ascii=False) + "\n")
+        self._correcao += 1
+
+    def _dataset(self):
+        return self._ds.dataset(self.diretorio, format="parquet", partitioning="hive")
+
+    def __len__(self):
+        return self._dataset().count_rows()
+
+    def adicionar(self, registro):
+        self.adicionar_lote(pd.DataFrame([registro], columns=COLUNAS))
+
+    def adicionar_lote(self, df):
+        if df.empty:
+            return
+        df = _para_armazenamento(df)
+        for mes, parte in df.groupby(df["data"].dt.strftime("%Y-%m"), sort=False):
+            self._gravar(mes, parte.assign(id=self._proximos_ids(len(parte))), self._proxima_sequencia())
+            if len(os.listdir(os.path.join(self.diretorio, f"mes={mes}"))) >= LIMITE_ARQUIVOS_PARTICAO:
+                self._compactar_particao(mes)
+        self._registrar_escrita()
+
+    def _compactar_particao(self, mes):
+        caminho = os.path.join(self.diretorio, f"mes={mes}")
+        # Na ordem de gravação, para que a primeira entrada de cada produto continue a primeira
+        arquivos = sorted(os.listdir(caminho), key=self._sequencia_arquivo)
+        if len(arquivos) < 2:
+            return
+        df = pd.concat([pd.read_parquet(os.path.join(caminho, arquivo)) for arquivo in arquivos])
+        self._gravar(mes, df, self._sequencia_arquivo(arquivos[-1]))
+        for arquivo in arquivos:
+            os.unlink(os.path.join(caminho, arquivo))
+        self._nova_geracao()
+
+    def compactar(self):
+        """Reescreve cada partição mensal em um único arquivo."""
+        for mes in self._meses():
+            self._compactar_particao(mes)
+        self._registrar_escrita()
+
+    def limpar(self):
+        for mes in self._meses():
+            caminho = os.path.join(self.diretorio, f"mes={mes}")
+            for arquivo in os.listdir(caminho):
+                os.unlink(os.path.join(caminho, arquivo))
+            os.rmdir(caminho)
+        self._nova_geracao()
+        self._registrar_escrita()
+
+    def registro(self, id_registro):
+        if not self._meses():
+            return None
+        tabela = self._dataset().to_table(
+            columns=list(COLUNAS_ARMAZENAMENTO.values()), filter=self._ds.field("id") == int(id_registro)
+        )
+        return _registro(tabela.to_pandas())
+
+    def _arquivo_do_registro(self, id_registro, data):
+        """Caminho do arquivo da partição de data que contém o registro e o conteúdo dele."""
+        pasta = os.path.join(self.diretorio, f"mes={pd.Timestamp(data):%Y-%m}")
+        for arquivo in os.listdir(pasta):
+            caminho = os.path.join(pasta, arquivo)
+            if (pd.read_parquet(caminho, columns=["id"])["id"] == id_registro).any():
+                return caminho, pd.read_parquet(caminho)
+        raise KeyError(id_registro)
+
+    def _linha(self, id_registro, registro):
+        df = _para_armazenamento(pd.DataFrame([registro], columns=COLUNAS))
+        return df.assign(id=np.int64(id_registro))
+
+    def substituir(self, id_registro, registro):
+        atual = self.registro(id_registro)
+        caminho, df = self._arquivo_do_registro(id_registro, atual["Data"])
+        linha = self._linha(id_registro, registro)
+        mes = linha["data"].iloc[0].strftime("%Y-%m")
+        sequencia = self._sequencia_arquivo(os.path.basename(caminho))
+        mesma_linha = (df["id"] == id_registro).to_numpy()
+        if mes == pd.Timestamp(atual["Data"]).strftime("%Y-%m"):
+            # Mesmo mês: a linha é trocada no lugar, sem mudar a ordem do arquivo
+            posicao = int(mesma_linha.argmax())
+            df = pd.concat([df.iloc[:posicao], linha[df.columns], df.iloc[posicao + 1:]], ignore_index=True)
+            self._reescrever(caminho, df, sequencia)
+        else:
+            self._reescrever(caminho, df[~mesma_linha], sequencia)
+            self._gravar(mes, linha, self._proxima_sequencia())
+        self._registrar_correcao(id_registro, atual, registro)
+        self._registrar_escrita()
+
+    def remover(self, id_registro):
+        atual = self.registro(id_registro)
+        caminho, df = self._arquivo_do_registro(id_registro, atual["Data"])
+        self._reescrever(caminho, df[df["id"] != id_registro], self._sequencia_arquivo(os.path.basename(caminho)))
+        self._registrar_correcao(id_registro, atual, None)
+        self._registrar_escrita()
+
+    def restaurar(self, id_registro, registro):
+        linha = self._linha(id_registro, registro)
+        self._gravar(linha["data"].iloc[0].strftime("%Y-%m"), linha, self._proxima_sequencia())
+        self._registrar_correcao(id_registro, None, registro)
+        self._registrar_escrita()
+
+    def posicao_diario(self):
+        """Posição atual do diário: a das movimentações é a sequência do último arquivo gravado."""
+        return PosicaoDiario(self._geracao(), self._sequencia, self._marcador("_ultimo_id"), self._correcao)
+
+    def varrer_correcoes(self, desde):
+        """(ID, antes, depois) das correções gravadas depois da posição desde, na ordem em que foram feitas."""
+        for numero, linha in enumerate(self._linhas_correcoes(), start=1):
+            if numero > desde.correcao:
+                correcao = json.loads(linha)
+                yield correcao["id"], _correcao_de_json(correcao["antes"]), _correcao_de_json(correcao["depois"])
+
+    def varrer_diario(self, desde, colunas=None):
+        """Movimentações dos arquivos gravados depois da posição desde, um arquivo por vez, na ordem de gravação."""
+        colunas = COLUNAS if colunas is None else list(colunas)
+        leitura = [COLUNAS_ARMAZENAMENTO[coluna] for coluna in colunas] + ["id"]
+        for sequencia, caminho in sorted(self._arquivos()):
+            if sequencia > desde.movimentacoes:
+                yield _para_livro(pd.read_parquet(caminho, columns=leitura))[colunas]
+
+    def _expressao(self, filtro, particionado=True):
+        ds = self._ds
+        expressao = None
+        condicoes = []
+        if filtro.inicio is not None:
+            inicio = pd.Timestamp(filtro.inicio)
+            if particionado:
+                condicoes.append(ds.field("mes") >= inicio.strftime("%Y-%m"))
+            condicoes.append(ds.field("data") >= inicio)
+        if filtro.fim is not None:
+            fim = pd.Timestamp(filtro.fim)
+            if particionado:
+                condicoes.append(ds.field("mes") <= fim.strftime("%Y-%m"))
+            condicoes.append(ds.field("data") <= fim)
+        if filtro.produtos is not None:
+            condicoes.append(ds.field("produto").isin(list(filtro.produtos)))
+        if filtro.tipos is not None:
+            condicoes.append(ds.field("tipo").isin(list(filtro.tipos)))
+        for condicao in condicoes:
+            expressao = condicao if expressao is None else expressao & condicao
+        return expressao
+
+    def _ler(self, filtro, colunas):
+        if not self._meses():
+            return pd.DataFrame(columns=colunas)
+        tabela = self._dataset().to_table(columns=colunas, filter=self._expressao(filtro))
+        return tabela.to_pandas()
+
+    def _meses(self, filtro=SEM_FILTRO):
+        """Partições mensais em ordem cronológica, sem as que ficam fora do período do filtro."""
+        inicio = None if filtro.inicio is None else pd.Timestamp(filtro.inicio).strftime("%Y-%m")
+        fim = None if filtro.fim is None else pd.Timestamp(filtro.fim).strftime("%Y-%m")
+        meses = sorted(pasta.split("=", 1)[1] for pasta in os.listdir(self.diretorio) if pasta.startswith("mes="))
+        return [mes for mes in meses if (inicio is None or mes >= inicio) and (fim is None or mes <= fim)]
+
+    def _ler_mes(self, mes, filtro, colunas):
+        pasta = os.path.join(self.diretorio, f"mes={mes}")
+        dataset = self._ds.dataset(pasta, format="parquet")
+        return dataset.to_table(columns=colunas, filter=self._expressao(filtro, particionado=False)).to_pandas()
+
+    def varrer(self, filtro=SEM_FILTRO, colunas=None, ao_progredir=None):
+        """Lê uma partição mensal por vez, em ordem de data, pulando os meses fora do filtro."""
+        colunas = COLUNAS if colunas is None else list(colunas)
+        leitura = [COLUNAS_ARMAZENAMENTO[coluna] for coluna in dict.fromkeys(["Data", *colunas])] + ["id"]
+        meses = self._meses(filtro)
+        for numero, mes in enumerate(meses, start=1):
+            df = self._ler_mes(mes, filtro, leitura).sort_values("data", kind="stable")
+            yield _para_livro(df)[colunas]
+            if ao_progredir is not None:
+                ao_progredir(numero / len(meses))
+        if not meses:
+            yield _para_livro(pd.DataFrame(columns=leitura))[colunas]
+
+    def intervalo_datas(self):
+        # Basta ler a primeira e a última partição
+        meses = self._meses()
+        if not meses:
+            return None, None
+        inicio = self._ler_mes(meses[0], SEM_FILTRO, ["data"])["data"].min()
+        fim = self._ler_mes(meses[-1], SEM_FILTRO, ["data"])["data"].max()
+        return inicio.date(), fim.date()
+
+    def produtos(self, filtro=SEM_FILTRO):
+        produtos = set()
+        for bloco in self.varrer(filtro, ["Produto"]):
+            produtos.update(bloco["Produto"].unique())
+        return sorted(produtos)
+
+    def consultar(self, filtro=SEM_FILTRO, colunas=None):
+        colunas = COLUNAS if colunas is None else list(colunas)
+        df = self._ler(filtro, [COLUNAS_ARMAZENAMENTO[coluna] for coluna in colunas] + ["id"])
+        return _para_livro(df)[colunas]
+
+    def agregados(self):
+        """Soma os agregados parciais de cada partição mensal."""
+        agregados = AgregadosEstoque()
+        for bloco in self.varrer(colunas=COLUNAS[1:]):
+            agregados.adicionar_lote(bloco)
+        return agregados
+
+    def totais_diarios(self):
+        # Cada dia pertence a uma única partição: basta concatenar os totais de cada uma
+        return pd.concat(
+            [_totais_diarios(bloco) for bloco in self.varrer(colunas=["Data", "Produto", "Tipo", "Quantidade"])],
+            ignore_index=True,
+        )
+
+
+# ==============================================================================
+# SELEÇÃO DO BACKEND
+# ==============================================================================
+
+# Arquivo ou pasta de dados de cada backend persistente, dentro do diretório de dados
+DADOS_BACKENDS = {
+    "sqlite": "estoque.db",
+    "parquet": "parquet",
+}
+
+BACKENDS = {
+    "memoria": lambda caminho: BackendMemoria(),
+    "sqlite": lambda caminho: BackendSQLite(os.path.join(caminho, DADOS_BACKENDS["sqlite"])),
+    "parquet": lambda caminho: BackendParquet(os.path.join(caminho, DADOS_BACKENDS["parquet"])),
+}
+
+
+def criar_backend(tipo=None, caminho=None, criar=True):
+    """Cria o backend de armazenamento indicado (ou o configurado por variáveis de ambiente).
+
+    Com criar=False o armazenamento precisa já existir em caminho; do contrário
+    FileNotFoundError é lançado em vez de um armazenamento vazio ser criado.
+    """
+    tipo = tipo or os.environ.get("GEREN_ARMAZENAMENTO", "sqlite")
+    caminho = caminho or os.environ.get(
+        "GEREN_DADOS", os.path.join(os.path.dirname(os.path.abspath(__file__)), "dados")
+    )
+    if tipo not in BACKENDS:
+        raise ValueError(f"Armazenamento desconhecido: {tipo}. Opções: {', '.join(BACKENDS)}")
+    if not criar and tipo in DADOS_BACKENDS and not os.path.exists(os.path.join(caminho, DADOS_BACKENDS[tipo])):
+        raise FileNotFoundError(f"Nenhum armazenamento {tipo} em {caminho}")
+    return BACKENDS[tipo](caminho)
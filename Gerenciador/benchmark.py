@@ -0,0 +1,251 @@
+"""Benchmarks dos caminhos de dados do sistema, sem navegador.
+
+Exemplos:
+    python benchmark.py --linhas 1000 100000 --saida resultados.json
+    python benchmark.py --linhas 100000 --base resultados.json --limite 0.2
+
+Com --base, a execução termina com código 1 se algum benchmark ficar mais lento
+que o tempo de referência além do limite relativo.
+"""
+import argparse
+import json
+import logging
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+from agregados import AgregadosEstoque, aggregate_movimentacoes
+from armazenamento import FiltroMovimentacoes, criar_backend
+from estoque import EstoqueCompartilhado, resumir_em_blocos
+from exportacao import FORMATOS, exportar, fatiar
+from graficos import reduzir_serie
+from importacao import validar_bloco
+from rollups import RollupsTemporais
+from saldos import LinhaTempoSaldos
+from sintetico import gerar_movimentacoes
+from valoracao import ValoracaoEstoque
+
+logger = logging.getLogger(__name__)
+
+# Diferenças abaixo deste valor (em segundos) são tratadas como ruído
+TOLERANCIA_ABSOLUTA = 0.005
+# O Excel é gerado célula a célula; acima disto o benchmark é pulado
+MAX_LINHAS_EXCEL = 200_000
+
+BENCHMARKS = {}
+
+
+def benchmark(nome, max_linhas=None):
+    """Registra preparar(contexto) -> função sem argumentos cujo tempo é medido."""
+    def registrar(preparar):
+        BENCHMARKS[nome] = (preparar, max_linhas)
+        return preparar
+    return registrar
+
+
+class Contexto:
+    """Livro sintético de um tamanho e as estruturas derivadas, criadas sob demanda."""
+
+    def __init__(self, df, diretorio):
+        self.df = df
+        self.diretorio = diretorio
+        self._backends = {}
+        self._resumo = None
+
+    def backend(self, tipo):
+        if tipo not in self._backends:
+            backend = criar_backend(tipo, f"{self.diretorio}/{tipo}")
+            backend.adicionar_lote(self.df)
+            self._backends[tipo] = backend
+        return self._backends[tipo]
+
+    @property
+    def resumo(self):
+        if self._resumo is None:
+            self._resumo = AgregadosEstoque.de_dataframe(self.df).resumir()
+        return self._resumo
+
+    def filtro_tipico(self):
+        """Metade central do período e metade dos produtos, como um usuário filtraria."""
+        datas = self.df["Data"]
+        inicio = datas.iloc[len(datas) // 4].date()
+        fim = datas.iloc[3 * len(datas) // 4].date()
+        produtos = sorted(self.df["Produto"].unique())
+        return FiltroMovimentacoes(inicio=inicio, fim=fim, produtos=tuple(produtos[::2]))
+
+
+# ==============================================================================
+# BENCHMARKS
+# ==============================================================================
+
+@benchmark("calcular_saldo")
+def _calcular_saldo(contexto):
+    # Com o filtro típico, como na tela: linhas filtradas e CMV pelo histórico de cada produto
+    estoque = EstoqueCompartilhado(contexto.backend("memoria"))
+    filtro = contexto.filtro_tipico()
+    df_filtrado = estoque.consultar(filtro)
+    return lambda: estoque.resumir(filtro, df_filtrado)
+
+
+@benchmark("valoracao")
+def _valoracao(contexto):
+    return lambda: ValoracaoEstoque.de_dataframe(contexto.df).cmv()
+
+
+@benchmark("aggregate_movimentacoes")
+def _aggregate_movimentacoes(contexto):
+    return lambda: aggregate_movimentacoes(contexto.df)
+
+
+def _configurar_filtros(tipo):
+    def preparar(contexto):
+        backend = contexto.backend(tipo)
+        filtro = contexto.filtro_tipico()
+
+        def executar():
+            backend.intervalo_datas()
+            backend.produtos(FiltroMovimentacoes(inicio=filtro.inicio, fim=filtro.fim))
+            return backend.consultar(filtro)
+        return executar
+    return preparar
+
+
+for _tipo in ("memoria", "sqlite", "parquet"):
+    benchmark(f"configurar_filtros[{_tipo}]")(_configurar_filtros(_tipo))
+
+
+def _resumir_em_blocos(tipo):
+    def preparar(contexto):
+        backend = contexto.backend(tipo)
+        filtro = contexto.filtro_tipico()
+        return lambda: resumir_em_blocos(backend.varrer(filtro.historico()), filtro=filtro)
+    return preparar
+
+
+for _tipo in ("sqlite", "parquet"):
+    benchmark(f"resumir_em_blocos[{_tipo}]")(_resumir_em_blocos(_tipo))
+
+
+@benchmark("grafico_linha_evolucao")
+def _grafico_linha_evolucao(contexto):
+    rollups = RollupsTemporais.de_totais_diarios(contexto.backend("memoria").totais_diarios())
+    produto = contexto.df["Produto"].value_counts().index[0]
+
+    def executar():
+        serie = reduzir_serie(rollups.serie(produto, "Diária"))
+        return px.line(serie, x="Data", y="Quantidade", color="Tipo").to_json()
+    return executar
+
+
+@benchmark("importacao")
+def _importacao(contexto):
+    bloco = contexto.df.astype({"Produto": str, "Tipo": str})
+    return lambda: validar_bloco(bloco, AgregadosEstoque(), LinhaTempoSaldos())
+
+
+def _exportar_relatorio(formato):
+    def preparar(contexto):
+        return lambda: exportar(formato, fatiar(contexto.df), contexto.resumo.por_produto)
+    return preparar
+
+
+for _formato in FORMATOS:
+    benchmark(
+        f"exportar_relatorio[{_formato}]",
+        max_linhas=MAX_LINHAS_EXCEL if _formato == "Excel" else None,
+    )(_exportar_relatorio(_formato))
+
+
+# ==============================================================================
+# EXECUÇÃO E COMPARAÇÃO
+# ==============================================================================
+
+def medir(funcao, repeticoes):
+    """Menor tempo, em segundos, entre as repetições."""
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return min(tempos)
+
+
+def executar(linhas, produtos, dias, repeticoes, selecionados, semente=0):
+    resultados = {}
+    for n in linhas:
+        df = gerar_movimentacoes(n, produtos=produtos, dias=dias, semente=semente)
+        with tempfile.TemporaryDirectory() as diretorio:
+            contexto = Contexto(df, diretorio)
+            for nome in selecionados:
+                preparar, max_linhas = BENCHMARKS[nome]
+                chave = f"{nome}[linhas={n}]"
+                if max_linhas is not None and n > max_linhas:
+                    logger.info(f"{chave}: pulado (limite de {max_linhas} linhas)")
+                    continue
+                resultados[chave] = medir(preparar(contexto), repeticoes)
+                logger.info(f"{chave}: {resultados[chave]:.4f} s")
+    return resultados
+
+
+def comparar(resultados, base, limite):
+    """Lista as regressões (chave, tempo base, tempo atual) acima do limite relativo."""
+    regressoes = []
+    for chave, atual in resultados.items():
+        referencia = base.get(chave)
+        if referencia is None:
+            continue
+        if atual > referencia * (1 + limite) and atual - referencia > TOLERANCIA_ABSOLUTA:
+            regressoes.append((chave, referencia, atual))
+    return regressoes
+
+
+def ambiente():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "plataforma": platform.platform(),
+    }
+
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--linhas", type=int, nargs="+", default=[1_000, 100_000])
+    parser.add_argument("--produtos", type=int, default=500)
+    parser.add_argument("--dias", type=int, default=730)
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--semente", type=int, default=0)
+    parser.add_argument("--apenas", nargs="+", choices=sorted(BENCHMARKS), help="Executa só estes benchmarks")
+    parser.add_argument("--saida", help="Grava os resultados neste arquivo JSON")
+    parser.add_argument("--base", help="Compara com os resultados deste arquivo JSON")
+    parser.add_argument("--limite", type=float, default=0.2, help="Regressão relativa tolerada (0.2 = 20%%)")
+    opcoes = parser.parse_args(argumentos)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    resultados = executar(
+        opcoes.linhas, opcoes.produtos, opcoes.dias, opcoes.repeticoes,
+        opcoes.apenas or list(BENCHMARKS), opcoes.semente,
+    )
+
+    if opcoes.saida:
+        with open(opcoes.saida, "w", encoding="utf-8") as arquivo:
+            json.dump({"ambiente": ambiente(), "resultados": resultados}, arquivo, indent=2, ensure_ascii=False)
+
+    if opcoes.base:
+        with open(opcoes.base, encoding="utf-8") as arquivo:
+            base = json.load(arquivo)["resultados"]
+        regressoes = comparar(resultados, base, opcoes.limite)
+        for chave, referencia, atual in regressoes:
+            logger.error(f"Regressão em {chave}: {referencia:.4f} s -> {atual:.4f} s")
+        if regressoes:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+import logging
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+MAX_ENTRADAS = 64
+MAX_BYTES = 256 * 1024 * 1024
+
+
+def tamanho_aproximado(valor):
+    """Estimativa barata do tamanho de um resultado em bytes.
+
+    DataFrames do livro não têm as strings inspecionadas (Produto e Tipo são
+    categóricos). Figuras Plotly são medidas pelos arrays e listas dos seus
+    traços e os demais objetos, como os agregados, pelos atributos.
+    """
+    if isinstance(valor, (pd.DataFrame, pd.Series)):
+        uso = valor.memory_usage(index=True, deep=False)
+        return int(uso.sum()) if isinstance(uso, pd.Series) else int(uso)
+    if isinstance(valor, (tuple, list)):
+        return sum(tamanho_aproximado(item) for item in valor)
+    if hasattr(valor, "to_plotly_json"):
+        return _tamanho_estrutura(valor.to_plotly_json())
+    if hasattr(valor, "__dict__"):
+        return sys.getsizeof(valor) + _tamanho_estrutura(vars(valor))
+    return sys.getsizeof(valor)
+
+
+def _tamanho_estrutura(valor):
+    """Bytes dos dicionários, listas, arrays e tabelas aninhados em um resultado."""
+    if isinstance(valor, dict):
+        return sys.getsizeof(valor) + sum(
+            _tamanho_estrutura(chave) + _tamanho_estrutura(item) for chave, item in valor.items()
+        )
+    if isinstance(valor, (list, tuple)):
+        return sys.getsizeof(valor) + sum(_tamanho_estrutura(item) for item in valor)
+    if isinstance(valor, np.ndarray):
+        if valor.dtype == object:
+            return valor.nbytes + sum(sys.getsizeof(item) for item in valor.tolist())
+        return valor.nbytes
+    if isinstance(valor, (pd.DataFrame, pd.Series)):
+        uso = valor.memory_usage(index=True, deep=True)
+        return int(uso.sum()) if isinstance(uso, pd.Series) else int(uso)
+    return sys.getsizeof(valor)
+
+
+class CacheResultados:
+    """Cache LRU limitado por número de entradas e por tamanho aproximado.
+
+    As chaves devem incluir a versão do livro (backend.versao) e o filtro
+    normalizado, de modo que uma consulta em cache custa apenas um hash de tupla.
+    Escritas no livro mudam a versão e tornam as entradas antigas inalcançáveis;
+    elas saem pela política LRU ou por invalidar().
+    """
+
+    def __init__(self, max_entradas=MAX_ENTRADAS, max_bytes=MAX_BYTES):
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self._entradas = OrderedDict()
+        self._bytes = 0
+        self._trava = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+
+    def __len__(self):
+        return len(self._entradas)
+
+    def obter(self, chave, calcular):
+        """Retorna o valor em cache para a chave, calculando-o com calcular() se ausente."""
+        with self._trava:
+            if chave in self._entradas:
+                self._entradas.move_to_end(chave)
+                self.acertos += 1
+                return self._entradas[chave][0]
+            self.falhas += 1
+
+        valor = calcular()
+        tamanho = tamanho_aproximado(valor)
+        if tamanho > self.max_bytes:
+            logger.info(f"Resultado de {tamanho} bytes não armazenado em cache: {chave[0]}")
+            return valor
+
+        with self._trava:
+            if chave in self._entradas:
+                self._bytes -= self._entradas.pop(chave)[1]
+            self._entradas[chave] = (valor, tamanho)
+            self._bytes += tamanho
+            while len(self._entradas) > self.max_entradas or self._bytes > self.max_bytes:
+                _, (_, tamanho_removido) = self._entradas.popitem(last=False)
+                self._bytes -= tamanho_removido
+        return valor
+
+    def invalidar(self):
+        """Descarta todas as entradas."""
+        with self._trava:
+            self._entradas.clear()
+            self._bytes = 0
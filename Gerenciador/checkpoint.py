@@ -0,0 +1,46 @@
+import logging
+import os
+import pickle
+
+logger = logging.getLogger(__name__)
+
+# Incrementar quando mudar a forma das estruturas gravadas: checkpoints de outro
+# formato são descartados e o estado é reconstruído a partir do livro
+FORMATO = 2
+
+
+def gravar_checkpoint(caminho, estado):
+    """Grava o estado em caminho de forma atômica (arquivo temporário + os.replace).
+
+    Uma queda durante a gravação deixa o checkpoint anterior intacto.
+    """
+    temporario = f"{caminho}.tmp"
+    with open(temporario, "wb") as arquivo:
+        pickle.dump({"formato": FORMATO, **estado}, arquivo, protocol=pickle.HIGHEST_PROTOCOL)
+        arquivo.flush()
+        os.fsync(arquivo.fileno())
+    os.replace(temporario, caminho)
+
+
+def carregar_checkpoint(caminho):
+    """Estado gravado em caminho, ou None se não houver checkpoint utilizável."""
+    try:
+        with open(caminho, "rb") as arquivo:
+            estado = pickle.load(arquivo)
+    except FileNotFoundError:
+        return None
+    except Exception as erro:
+        # Arquivo truncado ou gravado por outra versão do código
+        logger.warning(f"Checkpoint ilegível em {caminho}: {erro}")
+        return None
+    if not isinstance(estado, dict) or estado.get("formato") != FORMATO:
+        logger.info(f"Checkpoint em {caminho} é de outro formato e será refeito")
+        return None
+    return estado
+
+
+def remover_checkpoint(caminho):
+    try:
+        os.unlink(caminho)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,422 @@
+import logging
+import os
+import threading
+from dataclasses import dataclass
+
+import pandas as pd
+
+from agregados import AgregadosEstoque
+from cache import CacheResultados
+from checkpoint import carregar_checkpoint, gravar_checkpoint, remover_checkpoint
+from importacao import importar_movimentacoes
+from rollups import RollupsTemporais
+from saldos import LinhaTempoSaldos
+from armazenamento import FiltroMovimentacoes, SEM_FILTRO
+from tarefas import FilaExportacoes
+from valoracao import COLUNAS_VALORACAO, ValoracaoEstoque, custos_saidas
+
+logger = logging.getLogger(__name__)
+
+# GEREN_FORA_DA_MEMORIA=1: consultas filtradas, tabela e exportação leem o livro
+# em blocos em vez de carregá-lo inteiro
+FORA_DA_MEMORIA = os.environ.get("GEREN_FORA_DA_MEMORIA", "") == "1"
+
+# Movimentações gravadas entre dois checkpoints automáticos das estruturas derivadas
+INTERVALO_CHECKPOINT = int(os.environ.get("GEREN_INTERVALO_CHECKPOINT", "50000"))
+
+
+def resumir_em_blocos(blocos, metodo="medio", filtro=SEM_FILTRO):
+    """Resumo por produto de movimentações entregues em blocos em ordem de data.
+
+    Soma agregados parciais de cada bloco e leva a valoração de um bloco ao
+    seguinte; o resultado é o mesmo de resumir o DataFrame concatenado, mas só
+    um bloco fica em memória por vez.
+
+    Com filtro, os blocos devem cobrir filtro.historico(): todo o histórico é
+    valorado, mas só as linhas do filtro entram no resumo e no CMV.
+    """
+    agregados = AgregadosEstoque()
+    valoracao = ValoracaoEstoque()
+    cmv = []
+    for bloco in blocos:
+        custos = valoracao.adicionar_lote(bloco)[metodo].reindex(bloco.index, fill_value=0.0)
+        if filtro.ativo:
+            mascara = filtro.mascara(bloco)
+            bloco, custos = bloco[mascara], custos[mascara]
+        agregados.adicionar_lote(bloco)
+        cmv.append(custos.groupby(bloco["Produto"].to_numpy()).sum())
+    if not filtro.ativo:
+        return agregados.resumir(cmv=valoracao.cmv(metodo))
+    cmv = pd.concat(cmv).groupby(level=0).sum() if cmv else None
+    return agregados.resumir(cmv=cmv)
+
+
+@dataclass(frozen=True)
+class Correcao:
+    """Edição ou remoção de um registro, com o conteúdo antes e depois (None: inexistente).
+
+    Quem corrige guarda as correções que quer poder desfazer (no app, cada
+    sessão guarda as suas); limpeza identifica o livro em que ela foi feita.
+    """
+
+    operacao: str
+    id_registro: int
+    antes: dict
+    depois: dict
+    limpeza: int
+
+
+class EstoqueCompartilhado:
+    """Livro, agregados, séries temporais, saldos por data e caches de um estoque, únicos no processo.
+
+    Todas as sessões usam a mesma instância, de modo que memória e processamento
+    crescem com o volume de dados e não com o número de usuários. Gravações e
+    leituras das estruturas mutáveis passam por uma única trava (RLock): quem
+    grava é sempre um só, e quem lê recebe DataFrames prontos, que não são
+    alterados por gravações posteriores (cada escrita gera uma nova versão do
+    livro). Os resultados em cache são indexados pela versão e compartilhados
+    entre as sessões.
+
+    As estruturas derivadas são montadas lendo o livro em blocos (varrer), e
+    com fora_da_memoria as telas também evitam carregá-lo inteiro. Em backends
+    persistentes elas vão periodicamente para um checkpoint, junto com a
+    posição do diário que cobrem; o início seguinte carrega o checkpoint e
+    reaplica só o que foi gravado depois, em tempo que não cresce com o
+    histórico.
+
+    Registros são corrigidos (editar, remover, desfazer) pelo ID do backend:
+    cada correção aplica o delta inverso aos agregados, às séries e aos saldos
+    por data, e só o produto afetado é revalidado e revalorado. As correções
+    ficam no diário do backend e são reaplicadas sobre o checkpoint, como as
+    inserções.
+    """
+
+    def __init__(self, backend, fora_da_memoria=FORA_DA_MEMORIA, intervalo_checkpoint=INTERVALO_CHECKPOINT):
+        self.backend = backend
+        self.fora_da_memoria = fora_da_memoria
+        self.intervalo_checkpoint = intervalo_checkpoint
+        self.trava = threading.RLock()
+        self.cache = CacheResultados()
+        self.exportacoes = FilaExportacoes()
+        # Movimentações gravadas depois do último checkpoint e geração do diário que ele cobre
+        self._desde_checkpoint = 0
+        self._geracao_checkpoint = None
+        # Cada limpar() invalida as correções feitas antes dele (ver Correcao)
+        self._limpezas = 0
+        with self.trava:
+            if not self._restaurar_checkpoint():
+                self._reconstruir()
+                self.salvar_checkpoint()
+
+    def _reconstruir(self):
+        """Monta as estruturas derivadas relendo todo o livro."""
+        self.agregados = self.backend.agregados()
+        self.rollups = RollupsTemporais.de_totais_diarios(self.backend.totais_diarios())
+        self.valoracao = ValoracaoEstoque()
+        self.saldos = LinhaTempoSaldos()
+        for bloco in self.backend.varrer(SEM_FILTRO, COLUNAS_VALORACAO):
+            self.valoracao.adicionar_lote(bloco)
+            self.saldos.adicionar_lote(bloco)
+
+    def _restaurar_checkpoint(self):
+        """Carrega o último checkpoint e reaplica as movimentações e correções gravadas depois dele.
+
+        Retorna False (e nada é alterado) se não houver checkpoint válido para
+        o estado atual do livro.
+        """
+        caminho = self.backend.caminho_checkpoint
+        estado = None if caminho is None else carregar_checkpoint(caminho)
+        if estado is None:
+            return False
+        posicao = estado["posicao"]
+        if not self.backend.posicao_diario().alcanca(posicao):
+            logger.info("Checkpoint descartado: o livro foi limpo ou reescrito depois dele")
+            return False
+        self._geracao_checkpoint = posicao.geracao
+        self.agregados = estado["agregados"]
+        self.rollups = estado["rollups"]
+        self.valoracao = estado["valoracao"]
+        self.saldos = estado["saldos"]
+        reaplicadas = 0
+        # IDs lidos na cauda: já entram com o conteúdo atual, corrigido ou não
+        na_cauda = set()
+        for bloco in self.backend.varrer_diario(posicao):
+            self.agregados.adicionar_lote(bloco)
+            self.rollups.adicionar_lote(bloco)
+            self.valoracao.adicionar_lote(bloco)
+            self.saldos.adicionar_lote(bloco)
+            na_cauda.update(bloco.index)
+            reaplicadas += len(bloco)
+
+        # Cada registro corrigido vai do conteúdo que tinha no checkpoint ao atual
+        corrigidos = {}
+        for id_registro, antes, depois in self.backend.varrer_correcoes(posicao):
+            corrigidos[id_registro] = (corrigidos.get(id_registro, (antes,))[0], depois)
+        for id_registro, (antes, depois) in corrigidos.items():
+            # IDs distribuídos depois do checkpoint não estavam nele
+            if id_registro > posicao.ultimo_id:
+                antes = None
+            if id_registro in na_cauda:
+                depois = None
+            self._aplicar_correcao(antes, depois)
+            self._trocar_saldos(antes, depois)
+        logger.info(
+            f"Checkpoint carregado de {caminho}: {reaplicadas} movimentações e "
+            f"{len(corrigidos)} registros corrigidos reaplicados"
+        )
+        # Uma cauda longa já vai para um novo checkpoint
+        self._registrar_gravacao(reaplicadas + len(corrigidos))
+        return True
+
+    def salvar_checkpoint(self):
+        """Grava as estruturas derivadas e a posição do diário que elas cobrem."""
+        caminho = self.backend.caminho_checkpoint
+        if caminho is None:
+            return
+        with self.trava:
+            posicao = self.backend.posicao_diario()
+            gravar_checkpoint(caminho, {
+                "posicao": posicao,
+                "agregados": self.agregados,
+                "rollups": self.rollups,
+                "valoracao": self.valoracao,
+                "saldos": self.saldos,
+            })
+            self._desde_checkpoint = 0
+            self._geracao_checkpoint = posicao.geracao
+        logger.info(f"Checkpoint gravado em {caminho} (movimentação {posicao.movimentacoes}, correção {posicao.correcao})")
+
+    @property
+    def versao(self):
+        with self.trava:
+            return self.backend.versao
+
+    def ler(self, funcao, *args, **kwargs):
+        """Executa funcao sob a trava, sem concorrer com gravações."""
+        with self.trava:
+            return funcao(*args, **kwargs)
+
+    def intervalo_datas(self):
+        with self.trava:
+            return self.backend.intervalo_datas()
+
+    def produtos(self, filtro):
+        with self.trava:
+            return self.backend.produtos(filtro)
+
+    def consultar(self, filtro):
+        """Movimentações que atendem ao filtro; o DataFrame devolvido não muda com gravações posteriores."""
+        with self.trava:
+            return self.backend.consultar(filtro)
+
+    def varrer(self, filtro=SEM_FILTRO, colunas=None, ao_progredir=None):
+        """Movimentações do filtro em blocos, travando apenas durante a leitura de cada bloco.
+
+        Gravações entre dois blocos podem aparecer nos blocos seguintes.
+        """
+        blocos = self.backend.varrer(filtro, colunas, ao_progredir)
+        while True:
+            with self.trava:
+                bloco = next(blocos, None)
+            if bloco is None:
+                return
+            yield bloco
+
+    def adicionar(self, registro):
+        """Grava um registro e atualiza agregados e séries em uma única seção crítica."""
+        with self.trava:
+            self.backend.adicionar(registro)
+            self.agregados.adicionar(registro)
+            self.rollups.adicionar(registro)
+            self.valoracao.adicionar(registro)
+            self.saldos.adicionar(registro)
+            self._registrar_gravacao(1)
+
+    def importar(self, blocos, ao_progredir=None):
+        """Importa os blocos, travando apenas durante a validação e a gravação de cada um."""
+        return importar_movimentacoes(
+            blocos,
+            self.backend,
+            self.agregados,
+            self.saldos,
+            ao_progredir,
+            ao_gravar=self._ao_gravar_lote,
+            trava=self.trava,
+        )
+
+    def _ao_gravar_lote(self, aceitos):
+        self.rollups.adicionar_lote(aceitos)
+        self.valoracao.adicionar_lote(aceitos)
+        self._registrar_gravacao(len(aceitos))
+
+    def _registrar_gravacao(self, quantidade):
+        # Chamado sob a trava, logo após a gravação. Se a gravação mudou a geração
+        # do diário (compactação automática do Parquet), o checkpoint anterior
+        # deixou de valer e um novo é gravado já
+        self._desde_checkpoint += quantidade
+        if self._desde_checkpoint >= self.intervalo_checkpoint or self._geracao_mudou():
+            self.salvar_checkpoint()
+
+    def _geracao_mudou(self):
+        if self.backend.caminho_checkpoint is None:
+            return False
+        return self.backend.posicao_diario().geracao != self._geracao_checkpoint
+
+    # ==========================================================================
+    # CORREÇÕES
+    # ==========================================================================
+
+    def registro(self, id_registro):
+        """Registro de ID id_registro (dicionário com as colunas do livro), ou None se não existir."""
+        with self.trava:
+            return self.backend.registro(id_registro)
+
+    def _registro_existente(self, id_registro):
+        registro = self.backend.registro(id_registro)
+        if registro is None:
+            raise ValueError(f"Nenhum registro com ID {id_registro}.")
+        return registro
+
+    def editar(self, id_registro, registro):
+        """Substitui o registro de ID id_registro, mantendo o ID, e retorna a Correcao feita."""
+        with self.trava:
+            antes = self._registro_existente(id_registro)
+            self._corrigir(id_registro, antes, registro)
+            # O registro como gravado, para comparar com o backend ao desfazer
+            return Correcao("edição", id_registro, antes, self.backend.registro(id_registro), self._limpezas)
+
+    def remover(self, id_registro):
+        """Remove o registro de ID id_registro e retorna a Correcao feita."""
+        with self.trava:
+            antes = self._registro_existente(id_registro)
+            self._corrigir(id_registro, antes, None)
+            return Correcao("remoção", id_registro, antes, None, self._limpezas)
+
+    def correcao_vigente(self, correcao):
+        """True se o registro continua como a correção o deixou, de modo que ela ainda pode ser desfeita."""
+        with self.trava:
+            return correcao.limpeza == self._limpezas and self.backend.registro(correcao.id_registro) == correcao.depois
+
+    def desfazer(self, correcao):
+        """Desfaz uma correção retornada por editar() ou remover().
+
+        Levanta ValueError se o registro mudou depois dela (por outra correção,
+        talvez de outra sessão) ou se desfazê-la deixaria um saldo negativo.
+        """
+        with self.trava:
+            if not self.correcao_vigente(correcao):
+                raise ValueError(
+                    f"O registro {correcao.id_registro} mudou depois desta correção, que não pode mais ser desfeita."
+                )
+            self._corrigir(correcao.id_registro, correcao.depois, correcao.antes)
+
+    def _corrigir(self, id_registro, antes, depois):
+        """Troca antes por depois (None: registro inexistente) no backend e nas estruturas derivadas.
+
+        Chamado sob a trava. Levanta ValueError, sem alterar nada, se a correção
+        mudar o Custo Unitário das entradas de um produto ou deixar negativo um
+        saldo que não era, na data do registro ou depois.
+        """
+        if depois is not None and depois["Tipo"] == "entrada":
+            produto = depois["Produto"]
+            custo_existente = self.agregados.custo_referencia(produto)
+            unica_entrada = (
+                antes is not None and antes["Tipo"] == "entrada" and antes["Produto"] == produto
+                and self.agregados.registros_entrada(produto) == 1
+            )
+            if custo_existente is not None and not unica_entrada \
+                    and round(depois["Custo Unitário"], 2) != round(custo_existente, 2):
+                raise ValueError(
+                    f"O produto '{produto}' já possui entradas com Custo Unitário R$ {custo_existente:.2f}. "
+                    f"Não é permitido registrar com um valor diferente (R$ {depois['Custo Unitário']:.2f})."
+                )
+
+        # Revalida só os produtos afetados, da data mais antiga alterada em diante
+        afetados = {}
+        for registro in (antes, depois):
+            if registro is not None:
+                data = pd.Timestamp(registro["Data"]).normalize()
+                afetados[registro["Produto"]] = min(afetados.get(registro["Produto"], data), data)
+        minimos = {produto: self.saldos.disponivel(produto, data) for produto, data in afetados.items()}
+        self._trocar_saldos(antes, depois)
+        try:
+            for produto, data in afetados.items():
+                minimo = self.saldos.disponivel(produto, data)
+                if minimo < 0 and minimo < minimos[produto]:
+                    raise ValueError(
+                        f"A correção deixaria o estoque do produto '{produto}' negativo a partir de "
+                        f"{data:%d/%m/%Y}. Menor saldo resultante: {minimo}."
+                    )
+            if antes is None:
+                self.backend.restaurar(id_registro, depois)
+            elif depois is None:
+                self.backend.remover(id_registro)
+            else:
+                self.backend.substituir(id_registro, depois)
+        except Exception:
+            self._trocar_saldos(depois, antes)
+            raise
+
+        self._aplicar_correcao(antes, depois)
+        # A correção está no diário do backend: o próximo início a reaplica sobre o checkpoint
+        self._registrar_gravacao(1)
+        logger.info(f"Registro {id_registro} corrigido")
+
+    def _aplicar_correcao(self, antes, depois):
+        """Troca antes por depois nos agregados e nas séries e marca os produtos para revaloração."""
+        if antes is not None:
+            self.agregados.remover(antes)
+            self.rollups.remover(antes)
+            self.valoracao.invalidar(antes["Produto"])
+        if depois is not None:
+            self.agregados.adicionar(depois)
+            self.rollups.adicionar(depois)
+            self.valoracao.invalidar(depois["Produto"])
+
+    def _trocar_saldos(self, antes, depois):
+        if antes is not None:
+            self.saldos.remover(antes)
+        if depois is not None:
+            self.saldos.adicionar(depois)
+
+    def cmv(self, metodo="medio"):
+        """CMV por produto, recalculando antes os produtos que receberam registros retroativos."""
+        with self.trava:
+            if self.valoracao.desatualizados:
+                produtos = tuple(sorted(self.valoracao.desatualizados))
+                filtro = FiltroMovimentacoes(produtos=produtos)
+                self.valoracao.recalcular(self.backend.consultar(filtro, COLUNAS_VALORACAO), produtos)
+            return self.valoracao.cmv(metodo)
+
+    def resumir(self, filtro, df_filtrado):
+        """Resumo por produto das movimentações filtradas, com o lucro pelo custo médio ponderado.
+
+        Sem filtro, reaproveita os agregados e a valoração incrementais. Com filtro,
+        o custo de cada saída vem do histórico completo do produto até o fim do
+        período (filtro.historico()), e não só das entradas que passam pelo filtro.
+        Sem df_filtrado (fora da memória), o histórico é resumido bloco a bloco.
+        """
+        if df_filtrado is None and filtro.ativo:
+            return resumir_em_blocos(self.varrer(filtro.historico()), filtro=filtro)
+        with self.trava:
+            if not filtro.ativo:
+                return self.agregados.resumir(cmv=self.cmv())
+            historico = self.backend.consultar(filtro.historico(), COLUNAS_VALORACAO)
+        mascara = filtro.mascara(historico)
+        cmv = custos_saidas(historico)[mascara].groupby(historico["Produto"][mascara], observed=True).sum()
+        return AgregadosEstoque.de_dataframe(df_filtrado).resumir(cmv=cmv)
+
+    def limpar(self):
+        """Remove todos os registros e descarta os resultados derivados."""
+        with self.trava:
+            self.backend.limpar()
+            self.agregados = AgregadosEstoque()
+            self.rollups = RollupsTemporais()
+            self.valoracao = ValoracaoEstoque()
+            self.saldos = LinhaTempoSaldos()
+            self.cache.invalidar()
+            if self.backend.caminho_checkpoint is not None:
+                remover_checkpoint(self.backend.caminho_checkpoint)
+            self._desde_checkpoint = 0
+            self._limpezas += 1
+        logger.info("Estoque compartilhado limpo")
@@ -0,0 +1,136 @@
+import io
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+TAMANHO_BLOCO = 50_000
+
+# Formato -> (extensão, tipo MIME)
+FORMATOS = {
+    "Excel": (".xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "CSV": (".csv", "text/csv"),
+    "Parquet": (".parquet", "application/vnd.apache.parquet"),
+}
+
+
+def fatiar(df, tamanho_bloco=TAMANHO_BLOCO, ao_progredir=None):
+    """Divide df em fatias de até tamanho_bloco linhas (sempre ao menos uma, mesmo vazia).
+
+    ao_progredir(fracao), se informado, recebe a fração de linhas já entregues.
+    """
+    total = max(len(df), 1)
+    for inicio in range(0, total, tamanho_bloco):
+        yield df.iloc[inicio:inicio + tamanho_bloco]
+        if ao_progredir is not None:
+            ao_progredir(min(inicio + tamanho_bloco, total) / total)
+
+
+def nome_relatorio(formato, momento=None):
+    """Nome do arquivo do relatório, com a data e a hora da geração."""
+    momento = momento or datetime.now()
+    return f"Relatorio_Controle_Mercadorias_{momento.strftime('%Y-%m-%d_%H-%M-%S')}{FORMATOS[formato][0]}"
+
+
+# ==============================================================================
+# ESCRITORES
+# ==============================================================================
+
+def _anexar_linhas(planilha, df, linha, cabecalho):
+    """Escreve df a partir da linha dada e devolve a próxima linha livre."""
+    if cabecalho:
+        planilha.write_row(linha, 0, list(df.columns))
+        linha += 1
+    for valores in df.itertuples(index=False, name=None):
+        planilha.write_row(linha, 0, valores)
+        linha += 1
+    return linha
+
+
+def _escrever_excel(destino, blocos, resumo):
+    """Planilhas "Dados" e "Resumo" montadas pelo xlsxwriter inteiramente em memória.
+
+    Com in_memory o xlsxwriter não cria arquivos temporários: as planilhas ficam
+    em memória até o zip ser gravado em destino.
+    """
+    import xlsxwriter
+
+    pasta = xlsxwriter.Workbook(destino, {
+        "in_memory": True,
+        "default_date_format": "dd/mm/yyyy",
+        "nan_inf_to_errors": True,
+    })
+    dados = pasta.add_worksheet("Dados")
+    linha = 0
+    for numero, bloco in enumerate(blocos):
+        linha = _anexar_linhas(dados, bloco, linha, cabecalho=numero == 0)
+    if resumo is not None:
+        _anexar_linhas(pasta.add_worksheet("Resumo"), resumo.reset_index(), 0, cabecalho=True)
+    pasta.close()
+
+
+def _escrever_csv(destino, blocos, resumo):
+    """Apenas as movimentações; o cabeçalho vai com o primeiro bloco."""
+    texto = io.TextIOWrapper(destino, encoding="utf-8-sig", newline="")
+    try:
+        for numero, bloco in enumerate(blocos):
+            bloco.to_csv(texto, index=False, header=numero == 0)
+        texto.flush()
+    finally:
+        texto.detach()
+
+
+def _esquema_parquet(tabela):
+    """Esquema do arquivo a partir do primeiro bloco, com as colunas categóricas gravadas pelos valores.
+
+    Cada bloco lido do armazenamento traz o seu próprio dicionário de categorias
+    (e um índice int8 ou int16 conforme o tamanho dele); fixar o tipo dos valores
+    mantém o esquema igual em todos os blocos.
+    """
+    import pyarrow as pa
+
+    return pa.schema([
+        campo.with_type(campo.type.value_type) if pa.types.is_dictionary(campo.type) else campo
+        for campo in tabela.schema
+    ])
+
+
+def _escrever_parquet(destino, blocos, resumo):
+    """Apenas as movimentações, com um row group por bloco."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    escritor = None
+    try:
+        for bloco in blocos:
+            tabela = pa.Table.from_pandas(bloco, preserve_index=False)
+            if escritor is None:
+                esquema = _esquema_parquet(tabela)
+                escritor = pq.ParquetWriter(destino, esquema)
+            escritor.write_table(tabela.cast(esquema))
+    finally:
+        if escritor is not None:
+            escritor.close()
+
+
+ESCRITORES = {
+    "Excel": _escrever_excel,
+    "CSV": _escrever_csv,
+    "Parquet": _escrever_parquet,
+}
+
+
+def exportar(formato, blocos, resumo=None, destino=None):
+    """Grava o relatório em destino (por padrão um BytesIO novo), bloco a bloco.
+
+    blocos é um iterável de DataFrames com as movimentações, consumido uma única
+    vez; resumo (tabela por produto) só é incluído no Excel. Retorna destino
+    posicionado no início.
+    """
+    if formato not in ESCRITORES:
+        raise ValueError(f"Formato não suportado: {formato}. Use {', '.join(ESCRITORES)}.")
+    destino = io.BytesIO() if destino is None else destino
+    ESCRITORES[formato](destino, blocos, resumo)
+    destino.seek(0)
+    logger.info(f"Relatório {formato} gerado")
+    return destino
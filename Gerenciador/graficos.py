@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+
+# Limites do que é enviado ao navegador por gráfico
+MAX_BARRAS = 20
+MAX_PONTOS = 800
+# Acima deste número de pontos as linhas usam WebGL (scattergl)
+LIMITE_WEBGL = 1000
+
+
+def reduzir_barras(df, colunas, max_barras=MAX_BARRAS):
+    """Mantém os max_barras - 1 maiores itens por soma de colunas e agrupa o restante em "Outros".
+
+    df é indexado pelo rótulo das barras; a linha "Outros" traz a soma das colunas
+    dos itens agrupados. Tabelas que já cabem no limite são devolvidas sem cópia.
+    """
+    if len(df) <= max_barras:
+        return df[colunas]
+    tamanho = df[colunas].abs().sum(axis=1).to_numpy()
+    ordem = np.argsort(-tamanho, kind="stable")
+    principais = df[colunas].iloc[ordem[:max_barras - 1]]
+    restantes = df[colunas].iloc[ordem[max_barras - 1:]]
+    outros = restantes.sum().to_frame(f"Outros ({len(restantes)})").T
+    return pd.concat([principais, outros]).rename_axis(df.index.name)
+
+
+def lttb(x, y, n_pontos):
+    """Índices dos pontos escolhidos pelo Largest-Triangle-Three-Buckets.
+
+    Preserva o primeiro e o último ponto e, em cada um dos n_pontos - 2 baldes
+    intermediários, o ponto que forma o maior triângulo com o escolhido no balde
+    anterior e a média do balde seguinte, mantendo picos e vales da série.
+    """
+    tamanho = len(x)
+    if n_pontos >= tamanho or n_pontos < 3:
+        return np.arange(tamanho)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    bordas = np.linspace(1, tamanho - 1, n_pontos - 1).astype(np.int64)
+    escolhidos = np.empty(n_pontos, dtype=np.int64)
+    escolhidos[0], escolhidos[-1] = 0, tamanho - 1
+    a = 0
+    for i in range(n_pontos - 2):
+        inicio, fim = bordas[i], bordas[i + 1]
+        if i + 2 < len(bordas):
+            media_x = x[fim:bordas[i + 2]].mean()
+            media_y = y[fim:bordas[i + 2]].mean()
+        else:
+            media_x, media_y = x[-1], y[-1]
+        area = np.abs(
+            (x[a] - media_x) * (y[inicio:fim] - y[a]) - (x[a] - x[inicio:fim]) * (media_y - y[a])
+        )
+        a = inicio + int(np.argmax(area))
+        escolhidos[i + 1] = a
+    return escolhidos
+
+
+def reduzir_serie(serie, x="Data", y="Quantidade", cor="Tipo", max_pontos=MAX_PONTOS):
+    """Reduz cada linha (um valor de cor) da série a no máximo max_pontos pontos com LTTB."""
+    if len(serie) <= max_pontos:
+        return serie
+    partes = []
+    for _, linha in serie.groupby(cor, observed=True, sort=False):
+        eixo_x = linha[x].to_numpy()
+        if np.issubdtype(eixo_x.dtype, np.datetime64):
+            eixo_x = eixo_x.view(np.int64)
+        partes.append(linha.iloc[lttb(eixo_x, linha[y].to_numpy(), max_pontos)])
+    return pd.concat(partes, ignore_index=True)
+
+
+def usar_webgl(n_pontos):
+    """Indica se o gráfico de linha deve ser desenhado com WebGL."""
+    return n_pontos > LIMITE_WEBGL
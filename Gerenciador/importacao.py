@@ -0,0 +1,227 @@
+import logging
+from contextlib import nullcontext
+
+import numpy as np
+import pandas as pd
+
+from ledger import COLUNAS, QUANTIDADE_MAXIMA
+
+logger = logging.getLogger(__name__)
+
+TAMANHO_BLOCO = 100_000
+
+
+# ==============================================================================
+# LEITURA EM BLOCOS
+# ==============================================================================
+
+def ler_csv_em_blocos(arquivo, tamanho_bloco=TAMANHO_BLOCO, sep=",", decimal="."):
+    """Lê um CSV de movimentações em blocos de até tamanho_bloco linhas."""
+    yield from pd.read_csv(
+        arquivo,
+        sep=sep,
+        decimal=decimal,
+        chunksize=tamanho_bloco,
+        dtype={"Produto": str, "Tipo": str, "Data": str},
+        keep_default_na=False,
+        na_values=[""],
+    )
+
+
+def ler_excel_em_blocos(arquivo, tamanho_bloco=TAMANHO_BLOCO):
+    """Lê a primeira planilha de um XLSX em blocos, sem carregar a pasta de trabalho inteira."""
+    from openpyxl import load_workbook
+
+    pasta = load_workbook(arquivo, read_only=True, data_only=True)
+    try:
+        linhas = pasta.worksheets[0].iter_rows(values_only=True)
+        cabecalho = [str(coluna).strip() if coluna is not None else "" for coluna in next(linhas, [])]
+        bloco = []
+        for linha in linhas:
+            bloco.append(linha)
+            if len(bloco) == tamanho_bloco:
+                yield pd.DataFrame(bloco, columns=cabecalho)
+                bloco = []
+        if bloco:
+            yield pd.DataFrame(bloco, columns=cabecalho)
+    finally:
+        pasta.close()
+
+
+def ler_em_blocos(arquivo, nome, tamanho_bloco=TAMANHO_BLOCO, **opcoes_csv):
+    """Escolhe o leitor pelo nome do arquivo (.csv ou .xlsx)."""
+    if nome.lower().endswith(".xlsx"):
+        return ler_excel_em_blocos(arquivo, tamanho_bloco)
+    if nome.lower().endswith(".csv"):
+        return ler_csv_em_blocos(arquivo, tamanho_bloco, **opcoes_csv)
+    raise ValueError(f"Formato não suportado: {nome}. Use CSV ou XLSX.")
+
+
+# ==============================================================================
+# VALIDAÇÃO VETORIZADA
+# ==============================================================================
+
+def _converter_datas(valores):
+    datas = pd.to_datetime(valores, errors="coerce", format="ISO8601")
+    faltantes = datas.isna() & valores.notna()
+    if faltantes.any():
+        datas[faltantes] = pd.to_datetime(valores[faltantes], errors="coerce", format="%d/%m/%Y")
+    return datas
+
+
+def _rejeitar_saidas_sem_estoque(produtos, dias, quantidade, sinal, aceitos, saldos):
+    """Marca como rejeitadas as saídas que o formulário recusaria, inserindo as linhas em ordem de data.
+
+    As linhas de cada produto são tomadas por dia, com as entradas antes das
+    saídas do mesmo dia, já que a linha do tempo só guarda o saldo ao fim de cada
+    dia. Como as linhas anteriores do bloco têm data igual ou menor, elas deslocam
+    por igual todos os saldos a partir da data de uma saída: a saída é possível se
+    não passar de saldos.disponivel(produto, data) mais o movimento acumulado até
+    ela. O caso comum (nenhuma violação) é resolvido com um único cumsum agrupado.
+    Só os produtos com violação são percorridos linha a linha, já que rejeitar uma
+    saída altera o disponível para as seguintes.
+    """
+    candidatos = np.flatnonzero(aceitos)
+    if not len(candidatos):
+        return aceitos
+    codigos = pd.factorize(produtos[candidatos])[0]
+    ordem = candidatos[np.lexsort((candidatos, sinal[candidatos] < 0, dias[candidatos], codigos))]
+    codigos = pd.factorize(produtos[ordem])[0]
+    movimento = quantidade[ordem] * sinal[ordem]
+    acumulado = pd.Series(movimento).groupby(codigos).cumsum().to_numpy()
+
+    disponivel = saldos.disponiveis(produtos[ordem], dias[ordem])
+    saidas = sinal[ordem] < 0
+    violacoes = saidas & (acumulado + disponivel < 0)
+    if not violacoes.any():
+        return aceitos
+
+    aceitos = aceitos.copy()
+    limites = np.r_[0, np.flatnonzero(codigos[1:] != codigos[:-1]) + 1, len(ordem)]
+    for inicio, fim in zip(limites[:-1], limites[1:]):
+        if not violacoes[inicio:fim].any():
+            continue
+        corrente = 0
+        for k in range(inicio, fim):
+            if saidas[k] and corrente + movimento[k] + disponivel[k] < 0:
+                aceitos[ordem[k]] = False
+                continue
+            corrente += movimento[k]
+    return aceitos
+
+
+def validar_bloco(bloco, agregados, saldos):
+    """Aplica ao bloco as regras do formulário de inserção, de forma vetorizada.
+
+    Os custos de referência vêm de agregados e o estoque disponível de cada
+    saída, da linha do tempo saldos (LinhaTempoSaldos), como no formulário.
+
+    Retorna (aceitos, rejeitados): aceitos com as colunas do livro prontas para
+    gravação e rejeitados com as colunas originais mais "Motivo".
+    """
+    faltantes = [coluna for coluna in COLUNAS if coluna not in bloco.columns]
+    if faltantes:
+        raise ValueError(f"Colunas ausentes no arquivo: {', '.join(faltantes)}")
+
+    produto = bloco["Produto"].fillna("").astype(str).str.lower().str.strip()
+    tipo = bloco["Tipo"].fillna("").astype(str).str.lower().str.strip().replace({"saida": "saída"})
+    data = _converter_datas(bloco["Data"])
+    quantidade = pd.to_numeric(bloco["Quantidade"], errors="coerce")
+    custo = pd.to_numeric(bloco["Custo Unitário"], errors="coerce").fillna(0.0)
+    preco = pd.to_numeric(bloco["Preço de Venda"], errors="coerce").fillna(0.0)
+    entrada = (tipo == "entrada").to_numpy()
+    saida = (tipo == "saída").to_numpy()
+
+    # Regras na mesma ordem do formulário; vale o primeiro motivo encontrado
+    motivo = pd.Series(None, index=bloco.index, dtype=object)
+    regras = [
+        (data.isna(), "Data inválida"),
+        (produto == "", "O campo 'Produto' não pode estar vazio"),
+        (~(entrada | saida), "Tipo deve ser 'entrada' ou 'saída'"),
+        (~(quantidade > 0) | (quantidade % 1 != 0), "A quantidade deve ser um inteiro maior que 0"),
+        (quantidade > QUANTIDADE_MAXIMA, f"A quantidade deve ser no máximo {QUANTIDADE_MAXIMA}"),
+        (saida & (preco <= 0), "O 'Preço de Venda' deve ser maior que 0 para saídas"),
+        (entrada & (custo <= 0), "O 'Custo Unitário' deve ser maior que 0 para entradas"),
+    ]
+    for condicao, descricao in regras:
+        motivo = motivo.mask(motivo.isna() & condicao, descricao)
+
+    # Custo Unitário único por produto: o já registrado ou, para produtos novos,
+    # o da primeira entrada válida do bloco
+    custo_2 = custo.round(2)
+    entradas_validas = motivo.isna() & entrada
+    referencia = produto.map(
+        {p: agregados.custo_referencia(p) for p in produto[entradas_validas].unique()}
+    ).astype(float)
+    primeira_no_bloco = custo_2[entradas_validas].groupby(produto[entradas_validas]).transform("first")
+    referencia = referencia.fillna(primeira_no_bloco.reindex(bloco.index)).round(2)
+    motivo = motivo.mask(
+        entradas_validas & (custo_2 != referencia),
+        "Custo Unitário diferente do já registrado para o produto",
+    )
+
+    # Estoque disponível na data de cada saída, com as linhas do bloco em ordem de data
+    produtos = produto.to_numpy(dtype=object)
+    dias = data.dt.normalize().to_numpy(dtype="datetime64[ns]")
+    sinal = np.where(entrada, 1, -1)
+    valores_qtd = quantidade.fillna(0).to_numpy(dtype=float)
+    validos = motivo.isna().to_numpy()
+    com_estoque = _rejeitar_saidas_sem_estoque(produtos, dias, valores_qtd, sinal, validos, saldos)
+    motivo = motivo.mask(validos & ~com_estoque, "Estoque insuficiente para a saída")
+
+    ok = motivo.isna()
+    aceitos = pd.DataFrame({
+        "Data": data[ok].dt.normalize(),
+        "Produto": produto[ok],
+        "Tipo": tipo[ok],
+        "Quantidade": quantidade[ok].astype(np.int64),
+        "Custo Unitário": custo[ok],
+        "Preço de Venda": preco[ok],
+    }, columns=COLUNAS)
+    rejeitados = bloco[~ok].assign(Motivo=motivo[~ok])
+    return aceitos, rejeitados
+
+
+# ==============================================================================
+# IMPORTAÇÃO
+# ==============================================================================
+
+def importar_movimentacoes(blocos, backend, agregados, saldos, ao_progredir=None, ao_gravar=None, trava=None):
+    """Valida e grava cada bloco em uma única operação em lote.
+
+    agregados e saldos (LinhaTempoSaldos) são usados na validação e atualizados
+    com as linhas aceitas de cada bloco, antes da validação do seguinte.
+
+    ao_gravar(aceitos), se informado, é chamado após a gravação de cada bloco para
+    atualizar outras estruturas derivadas do livro. A trava, se informada, é
+    mantida durante a validação e a gravação de cada bloco, mas não durante a
+    leitura do arquivo. Retorna (total_aceitos, rejeitados), onde rejeitados traz
+    a linha do arquivo (contando o cabeçalho como linha 1) e o motivo de cada
+    rejeição.
+    """
+    total_aceitos = 0
+    rejeicoes = []
+    inicio_bloco = 0
+    for numero, bloco in enumerate(blocos, start=1):
+        bloco = bloco.set_axis(pd.RangeIndex(inicio_bloco + 2, inicio_bloco + 2 + len(bloco)))
+        inicio_bloco += len(bloco)
+        with trava or nullcontext():
+            aceitos, rejeitados = validar_bloco(bloco, agregados, saldos)
+            if not aceitos.empty:
+                backend.adicionar_lote(aceitos)
+                agregados.adicionar_lote(aceitos)
+                saldos.adicionar_lote(aceitos)
+                if ao_gravar is not None:
+                    ao_gravar(aceitos)
+        total_aceitos += len(aceitos)
+        if not rejeitados.empty:
+            rejeicoes.append(rejeitados)
+        logger.info(f"Bloco {numero} importado: {len(aceitos)} aceitos, {len(rejeitados)} rejeitados")
+        if ao_progredir is not None:
+            ao_progredir(numero, inicio_bloco, total_aceitos)
+
+    if rejeicoes:
+        rejeitados = pd.concat(rejeicoes).rename_axis("Linha").reset_index()
+    else:
+        rejeitados = pd.DataFrame(columns=["Linha"] + COLUNAS + ["Motivo"])
+    return total_aceitos, rejeitados
@@ -0,0 +1,245 @@
+import numpy as np
+
+DATA_MINIMA = np.iinfo(np.int64).min
+DATA_MAXIMA = np.iinfo(np.int64).max
+
+# O nível delta recebe as linhas novas e é incorporado ao principal quando
+# passa deste tamanho (ou de 1/8 do principal), mantendo o custo amortizado baixo.
+LIMITE_DELTA = 4096
+
+
+def _limites(inicio, fim):
+    return (
+        np.int64(DATA_MINIMA if inicio is None else inicio),
+        np.int64(DATA_MAXIMA if fim is None else fim),
+    )
+
+
+def _deslocar(arrays, origem, destino, valores):
+    """Leva o elemento da posição origem para destino em cada array, deslocando os intermediários."""
+    for array, valor in zip(arrays, valores):
+        if origem < destino:
+            array[origem:destino] = array[origem + 1:destino + 1]
+        elif destino < origem:
+            array[destino + 1:origem + 1] = array[destino:origem]
+        array[destino] = valor
+
+
+def _posicao_ordenada(chaves, posicoes, chave, posicao):
+    """Índice de (chave, posicao) em arrays ordenados por chave e, nos empates, por posição."""
+    lo = np.searchsorted(chaves, chave, side="left")
+    hi = np.searchsorted(chaves, chave, side="right")
+    return int(lo + np.searchsorted(posicoes[lo:hi], posicao))
+
+
+class _NivelIndice:
+    """Posições de um trecho do livro ordenadas por data e por (produto, data)."""
+
+    def __init__(self, datas, produtos, posicoes):
+        ordem = np.argsort(datas, kind="stable")
+        self.datas = datas[ordem]
+        self.posicoes_data = posicoes[ordem]
+
+        ordem = np.lexsort((datas, produtos))
+        self.produtos = produtos[ordem]
+        self.datas_produto = datas[ordem]
+        self.posicoes_produto = posicoes[ordem]
+
+    def __len__(self):
+        return len(self.datas)
+
+    def mover(self, posicao, data_antiga, produto_antigo, data_nova, produto_novo):
+        """Reposiciona a linha posicao após uma correção, sem reordenar o nível inteiro.
+
+        Nos empates as linhas ficam em ordem de posição, como na ordenação estável.
+        """
+        origem = _posicao_ordenada(self.datas, self.posicoes_data, data_antiga, posicao)
+        destino = _posicao_ordenada(self.datas, self.posicoes_data, data_nova, posicao)
+        # destino foi calculado com a linha ainda no lugar antigo
+        destino -= destino > origem
+        _deslocar((self.datas, self.posicoes_data), origem, destino, (data_nova, posicao))
+
+        # Por produto: chave (produto, data), buscada dentro da fatia do produto
+        def indice(produto, data):
+            produto = self.produtos.dtype.type(produto)
+            lo = np.searchsorted(self.produtos, produto, side="left")
+            hi = np.searchsorted(self.produtos, produto, side="right")
+            return lo + _posicao_ordenada(self.datas_produto[lo:hi], self.posicoes_produto[lo:hi], data, posicao)
+
+        origem = indice(produto_antigo, data_antiga)
+        destino = indice(produto_novo, data_nova)
+        destino -= destino > origem
+        _deslocar(
+            (self.produtos, self.datas_produto, self.posicoes_produto),
+            origem, destino, (produto_novo, data_nova, posicao),
+        )
+
+    def por_data(self, inicio, fim):
+        inicio, fim = _limites(inicio, fim)
+        lo = np.searchsorted(self.datas, inicio, side="left")
+        hi = np.searchsorted(self.datas, fim, side="right")
+        return self.posicoes_data[lo:hi]
+
+    def por_produto(self, codigo, inicio, fim):
+        # Converte a chave para o tipo do array; senão o searchsorted converteria o array inteiro
+        codigo = self.produtos.dtype.type(codigo)
+        lo = np.searchsorted(self.produtos, codigo, side="left")
+        hi = np.searchsorted(self.produtos, codigo, side="right")
+        if inicio is None and fim is None:
+            return self.posicoes_produto[lo:hi]
+        inicio, fim = _limites(inicio, fim)
+        datas = self.datas_produto[lo:hi]
+        primeira = lo + np.searchsorted(datas, inicio, side="left")
+        ultima = lo + np.searchsorted(datas, fim, side="right")
+        return self.posicoes_produto[primeira:ultima]
+
+
+class IndiceMovimentacoes:
+    """Índices do livro: ordenação por data e posições por produto.
+
+    Intervalos de datas são resolvidos por busca binária e seleções de produtos
+    por fatias contíguas, de modo que o custo de uma consulta é proporcional ao
+    resultado. As linhas novas entram em um nível delta pequeno, reordenado a cada
+    atualização e incorporado ao nível principal quando cresce demais.
+    """
+
+    def __init__(self):
+        self.limpar()
+
+    def limpar(self):
+        self._principal = None
+        self._delta = None
+        self.cobertos = 0
+
+    def _niveis(self):
+        return [nivel for nivel in (self._principal, self._delta) if nivel is not None and len(nivel)]
+
+    def atualizar(self, total, colunas_desde):
+        """Indexa as linhas ainda não cobertas; colunas_desde(i) devolve (datas, produtos) a partir da linha i."""
+        if total == self.cobertos:
+            return
+        if total < self.cobertos:
+            self.limpar()
+
+        tamanho_principal = len(self._principal) if self._principal is not None else 0
+        if total - tamanho_principal <= max(LIMITE_DELTA, tamanho_principal // 8):
+            # Só o delta é reordenado
+            datas, produtos = colunas_desde(tamanho_principal)
+            posicoes = np.arange(tamanho_principal, total, dtype=np.int64)
+            self._delta = _NivelIndice(datas.view(np.int64), produtos, posicoes)
+        else:
+            # Delta grande demais: reconstrói o principal com todas as linhas
+            datas, produtos = colunas_desde(0)
+            self._principal = _NivelIndice(datas.view(np.int64), produtos, np.arange(total, dtype=np.int64))
+            self._delta = None
+        self.cobertos = total
+
+    def mover(self, posicao, data_antiga, produto_antigo, data_nova, produto_novo):
+        """Atualiza o índice após a correção da linha posicao (datas como int64 em ns).
+
+        Linhas ainda não indexadas não precisam de ajuste: entram com o conteúdo
+        atual na próxima atualização.
+        """
+        if posicao >= self.cobertos:
+            return
+        tamanho_principal = len(self._principal) if self._principal is not None else 0
+        nivel = self._principal if posicao < tamanho_principal else self._delta
+        nivel.mover(posicao, data_antiga, produto_antigo, data_nova, produto_novo)
+
+    def contar(self, inicio=None, fim=None):
+        """Número de linhas indexadas no intervalo, sem materializar as posições."""
+        inicio, fim = _limites(inicio, fim)
+        return sum(
+            int(np.searchsorted(nivel.datas, fim, side="right") - np.searchsorted(nivel.datas, inicio, side="left"))
+            for nivel in self._niveis()
+        )
+
+    def intervalo_datas(self, removidas=None):
+        """Menor e maior data indexadas (como int64 em ns) fora das posições removidas, ou (None, None).
+
+        Em cada ponta de um nível, no máximo len(removidas) linhas estão removidas:
+        basta verificar as len(removidas) + 1 primeiras e últimas.
+        """
+        removidas = np.empty(0, dtype=np.int64) if removidas is None else removidas
+        k = len(removidas) + 1
+        inicios, fins = [], []
+        for nivel in self._niveis():
+            ativas = ~np.isin(nivel.posicoes_data[:k], removidas)
+            if not ativas.any():
+                # O nível inteiro está removido
+                continue
+            inicios.append(nivel.datas[:k][ativas.argmax()])
+            ativas = ~np.isin(nivel.posicoes_data[-k:], removidas)
+            fins.append(nivel.datas[-k:][len(ativas) - 1 - ativas[::-1].argmax()])
+        if not inicios:
+            return None, None
+        return min(inicios), max(fins)
+
+    def posicoes(self, inicio=None, fim=None, codigos_produtos=None):
+        """Posições (em ordem de inserção) das linhas no intervalo e nos produtos dados.
+
+        Retorna None quando não há restrição, indicando o livro inteiro.
+        """
+        if codigos_produtos is None and inicio is None and fim is None:
+            return None
+        partes = []
+        for nivel in self._niveis():
+            if codigos_produtos is None:
+                partes.append(nivel.por_data(inicio, fim))
+            else:
+                partes.extend(nivel.por_produto(codigo, inicio, fim) for codigo in codigos_produtos)
+        if not partes:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(partes))
+
+
+class MascarasMovimentacoes:
+    """Máscaras booleanas sobre o livro inteiro, para seleções que cobrem boa parte dele.
+
+    Quando o filtro seleciona muitas linhas, juntar as fatias do índice de cada
+    produto e reordená-las custa mais do que avaliar uma máscara por linha. Aqui
+    cada predicado vira uma máscara vetorizada (produtos por tabela de consulta,
+    datas por comparação) e as máscaras são combinadas com operações bit a bit.
+    As máscaras por Tipo e a contagem de linhas por produto ficam em cache; o
+    objeto inteiro é descartado a cada escrita no livro.
+    """
+
+    def __init__(self, datas, produtos, tipos, total_produtos):
+        self.datas = datas
+        self.produtos = produtos
+        self.tipos = tipos
+        self.total_produtos = total_produtos
+        self._por_tipo = {}
+        self._contagem = None
+
+    def contagem_produtos(self):
+        """Número de linhas de cada código de produto (inclusive as removidas)."""
+        if self._contagem is None:
+            self._contagem = np.bincount(self.produtos, minlength=self.total_produtos)
+        return self._contagem
+
+    def tipo(self, codigo):
+        """Máscara (somente leitura) das linhas do Tipo de código dado."""
+        if codigo not in self._por_tipo:
+            mascara = self.tipos == codigo
+            mascara.flags.writeable = False
+            self._por_tipo[codigo] = mascara
+        return self._por_tipo[codigo]
+
+    def selecionar(self, inicio=None, fim=None, codigos_produtos=None, codigos_tipos=None):
+        """Máscara nova das linhas que atendem a todos os predicados dados (None = sem restrição)."""
+        mascara = np.ones(len(self.datas), dtype=bool)
+        if codigos_tipos is not None:
+            selecionados = np.zeros(len(mascara), dtype=bool)
+            for codigo in codigos_tipos:
+                selecionados |= self.tipo(codigo)
+            mascara &= selecionados
+        if codigos_produtos is not None:
+            tabela = np.zeros(self.total_produtos, dtype=bool)
+            tabela[codigos_produtos] = True
+            mascara &= tabela[self.produtos]
+        if inicio is not None:
+            mascara &= self.datas >= inicio
+        if fim is not None:
+            mascara &= self.datas <= fim
+        return mascara
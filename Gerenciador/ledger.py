@@ -0,0 +1,367 @@
+import numpy as np
+import pandas as pd
+
+from indices import IndiceMovimentacoes, MascarasMovimentacoes
+
+COLUNAS = ["Data", "Produto", "Tipo", "Quantidade", "Custo Unitário", "Preço de Venda"]
+
+# "Tipo" é gravado como código int8 (0 = entrada, 1 = saída)
+TIPOS_MOVIMENTACAO = ["entrada", "saída"]
+CODIGO_TIPO = {tipo: codigo for codigo, tipo in enumerate(TIPOS_MOVIMENTACAO)}
+
+# Esquema compacto das colunas no DataFrame do livro. Os valores monetários
+# permanecem em float64: float32 não representa centavos com exatidão acima de
+# poucos milhares de reais e o erro apareceria nos relatórios exportados.
+ESQUEMA = {
+    "Data": np.dtype("datetime64[ns]"),
+    "Produto": "category",
+    "Tipo": pd.CategoricalDtype(TIPOS_MOVIMENTACAO),
+    "Quantidade": np.dtype(np.int32),
+    "Custo Unitário": np.dtype(np.float64),
+    "Preço de Venda": np.dtype(np.float64),
+}
+
+# Tipos dos arrays nos blocos: Produto e Tipo guardam apenas os códigos
+TIPOS_BLOCO = {
+    "Data": np.dtype("datetime64[ns]"),
+    "Produto": np.dtype(np.int32),
+    "Tipo": np.dtype(np.int8),
+    "Quantidade": np.dtype(np.int32),
+    "Custo Unitário": np.dtype(np.float64),
+    "Preço de Venda": np.dtype(np.float64),
+}
+
+# Maior quantidade que cabe na coluna; o formulário e a importação recusam as maiores
+QUANTIDADE_MAXIMA = int(np.iinfo(TIPOS_BLOCO["Quantidade"]).max)
+
+CAPACIDADE_INICIAL = 1024
+CAPACIDADE_MAXIMA = 1 << 20
+
+# Seleções estimadas acima desta fração do livro são avaliadas por máscaras
+# sobre todas as linhas em vez de pelas fatias ordenadas do índice
+FRACAO_MASCARA = 1 / 4
+
+
+def converter_quantidades(valores):
+    """Quantidades no tipo da coluna; ValueError, em vez de truncar em silêncio, se alguma não couber."""
+    valores = np.asarray(valores)
+    limites = np.iinfo(TIPOS_BLOCO["Quantidade"])
+    if len(valores) and (valores.min() < limites.min or valores.max() > limites.max):
+        raise ValueError(f"Quantidade fora do intervalo aceito pelo livro (máximo {QUANTIDADE_MAXIMA}).")
+    return valores.astype(TIPOS_BLOCO["Quantidade"])
+
+
+def aplicar_esquema(df):
+    """Converte as colunas do livro presentes em df para o esquema compacto."""
+    df = df.copy()
+    if "Data" in df.columns:
+        df["Data"] = pd.to_datetime(df["Data"]).astype(ESQUEMA["Data"])
+    if "Quantidade" in df.columns:
+        df["Quantidade"] = converter_quantidades(df["Quantidade"].to_numpy())
+    return df.astype({coluna: ESQUEMA[coluna] for coluna in df.columns if coluna in ESQUEMA and coluna != "Data"})
+
+
+class DicionarioProdutos:
+    """Associa cada nome de produto a um código inteiro estável."""
+
+    def __init__(self):
+        self.nomes = []
+        self.codigos = {}
+
+    def __len__(self):
+        return len(self.nomes)
+
+    def codigo(self, produto):
+        """Retorna o código do produto, registrando-o se for novo."""
+        codigo = self.codigos.get(produto)
+        if codigo is None:
+            codigo = self.codigos[produto] = len(self.nomes)
+            self.nomes.append(produto)
+        return codigo
+
+    def codificar(self, produtos):
+        """Codifica uma coluna de produtos consultando o dicionário uma vez por valor distinto."""
+        codigos_locais, valores = pd.factorize(produtos)
+        traducao = np.array([self.codigo(produto) for produto in valores], dtype=np.int32)
+        return traducao[codigos_locais]
+
+    def categorias(self):
+        return pd.Index(self.nomes, dtype=object)
+
+
+class LedgerMovimentacoes:
+    """Livro de movimentações em blocos colunares tipados, com inserção em O(1) amortizado.
+
+    Os registros são gravados em arrays NumPy pré-alocados. Quando o bloco atual
+    enche, ele é selado e um novo bloco com o dobro da capacidade (limitado a
+    CAPACIDADE_MAXIMA) é criado, de modo que nenhuma inserção copia o livro inteiro.
+    O DataFrame só é montado quando solicitado e fica em cache até a próxima escrita.
+    Produto e Tipo são mantidos como códigos inteiros e expostos como categorias.
+
+    A posição de cada registro é o seu ID (índice "ID" do DataFrame): correções
+    gravam no próprio lugar e remoções apenas marcam a posição, de modo que os
+    IDs dos demais registros não mudam.
+    """
+
+    def __init__(self):
+        self.limpar()
+
+    def limpar(self):
+        """Remove todos os registros do livro."""
+        self.produtos = DicionarioProdutos()
+        self._indice = IndiceMovimentacoes()
+        self._blocos = []
+        self._capacidade = CAPACIDADE_INICIAL
+        self._atual = self._novo_bloco(self._capacidade)
+        self._usados = 0
+        self._total = 0
+        self._df = None
+        self._df_ativos = None
+        self._mascaras = None
+        self.removidos = set()
+        self._posicoes_removidas = np.empty(0, dtype=np.int64)
+
+    @staticmethod
+    def _novo_bloco(capacidade):
+        return {coluna: np.empty(capacidade, dtype=tipo) for coluna, tipo in TIPOS_BLOCO.items()}
+
+    def _selar_bloco(self):
+        self._blocos.append({coluna: valores[:self._usados] for coluna, valores in self._atual.items()})
+        self._capacidade = min(self._capacidade * 2, CAPACIDADE_MAXIMA)
+        self._atual = self._novo_bloco(self._capacidade)
+        self._usados = 0
+
+    def __len__(self):
+        return self._total - len(self.removidos)
+
+    @property
+    def empty(self):
+        return len(self) == 0
+
+    def adicionar(self, registro):
+        """Acrescenta um registro (dicionário com as colunas do livro)."""
+        if self._usados == self._capacidade:
+            self._selar_bloco()
+        i = self._usados
+        self._atual["Data"][i] = pd.Timestamp(registro["Data"]).to_datetime64()
+        self._atual["Produto"][i] = self.produtos.codigo(registro["Produto"])
+        self._atual["Tipo"][i] = CODIGO_TIPO[registro["Tipo"]]
+        self._atual["Quantidade"][i] = converter_quantidades([registro["Quantidade"]])[0]
+        self._atual["Custo Unitário"][i] = registro["Custo Unitário"]
+        self._atual["Preço de Venda"][i] = registro["Preço de Venda"]
+        self._usados += 1
+        self._total += 1
+        self._descartar_dataframe()
+
+    def estender(self, df):
+        """Acrescenta em lote as linhas de um DataFrame com as colunas do livro."""
+        n = len(df)
+        if n == 0:
+            return
+        if self._usados:
+            self._selar_bloco()
+        tipos = pd.Categorical(df["Tipo"], categories=TIPOS_MOVIMENTACAO)
+        self._blocos.append({
+            "Data": pd.to_datetime(df["Data"]).to_numpy(dtype=TIPOS_BLOCO["Data"]),
+            "Produto": self.produtos.codificar(df["Produto"]),
+            "Tipo": tipos.codes.astype(np.int8),
+            "Quantidade": converter_quantidades(df["Quantidade"].to_numpy()),
+            "Custo Unitário": df["Custo Unitário"].to_numpy(dtype=np.float64),
+            "Preço de Venda": df["Preço de Venda"].to_numpy(dtype=np.float64),
+        })
+        self._total += n
+        self._descartar_dataframe()
+
+    def _descartar_dataframe(self):
+        self._df = None
+        self._df_ativos = None
+        self._mascaras = None
+
+    def _localizar(self, posicao):
+        """Parte (bloco selado ou atual) que contém a posição e o deslocamento dentro dela."""
+        for parte in self._blocos:
+            tamanho = len(parte["Data"])
+            if posicao < tamanho:
+                return parte, posicao
+            posicao -= tamanho
+        return self._atual, posicao
+
+    def _valida(self, posicao):
+        return 0 <= posicao < self._total and posicao not in self.removidos
+
+    def registro(self, posicao):
+        """Registro (dicionário com as colunas do livro) do ID posicao, ou None se não existir."""
+        if not self._valida(posicao):
+            return None
+        parte, i = self._localizar(posicao)
+        return {
+            "Data": pd.Timestamp(parte["Data"][i]),
+            "Produto": self.produtos.nomes[parte["Produto"][i]],
+            "Tipo": TIPOS_MOVIMENTACAO[parte["Tipo"][i]],
+            "Quantidade": int(parte["Quantidade"][i]),
+            "Custo Unitário": float(parte["Custo Unitário"][i]),
+            "Preço de Venda": float(parte["Preço de Venda"][i]),
+        }
+
+    def substituir(self, posicao, registro):
+        """Grava registro no lugar do registro de ID posicao (também usado para restaurar um removido)."""
+        parte, i = self._localizar(posicao)
+        valores = {
+            "Data": pd.Timestamp(registro["Data"]).to_datetime64(),
+            "Produto": self.produtos.codigo(registro["Produto"]),
+            "Tipo": CODIGO_TIPO[registro["Tipo"]],
+            "Quantidade": converter_quantidades([registro["Quantidade"]])[0],
+            "Custo Unitário": registro["Custo Unitário"],
+            "Preço de Venda": registro["Preço de Venda"],
+        }
+        data_antiga, produto_antigo = parte["Data"][i], parte["Produto"][i]
+        for coluna, valor in valores.items():
+            # Blocos vindos de estender() podem compartilhar memória somente leitura com o DataFrame de origem
+            if not parte[coluna].flags.writeable:
+                parte[coluna] = parte[coluna].copy()
+            parte[coluna][i] = valor
+        if posicao in self.removidos:
+            self.removidos.discard(posicao)
+            indice = np.searchsorted(self._posicoes_removidas, posicao)
+            self._posicoes_removidas = np.delete(self._posicoes_removidas, indice)
+        # Data e produto podem ter mudado: só a linha corrigida é reposicionada nos índices
+        self._indice.mover(
+            posicao, data_antiga.view(np.int64), produto_antigo,
+            valores["Data"].view(np.int64), valores["Produto"],
+        )
+        self._descartar_dataframe()
+
+    def remover(self, posicao):
+        """Marca o registro de ID posicao como removido."""
+        if posicao in self.removidos:
+            return
+        self.removidos.add(posicao)
+        # Inserida já na ordem, sem reordenar as posições removidas a cada remoção
+        indice = np.searchsorted(self._posicoes_removidas, posicao)
+        self._posicoes_removidas = np.insert(self._posicoes_removidas, indice, posicao)
+        self._df_ativos = None
+
+    def _colunas_consolidadas(self):
+        partes = self._blocos + [{coluna: valores[:self._usados] for coluna, valores in self._atual.items()}]
+        colunas = {coluna: np.concatenate([parte[coluna] for parte in partes]) for coluna in COLUNAS}
+        # Compacta os blocos selados para que a próxima consolidação junte só duas partes
+        if len(self._blocos) > 1:
+            self._blocos = [{coluna: valores[:self._total - self._usados] for coluna, valores in colunas.items()}]
+        return colunas
+
+    def _colunas_desde(self, inicio):
+        """Datas e códigos de produto das linhas a partir de inicio, sem montar o DataFrame."""
+        partes = self._blocos + [{coluna: valores[:self._usados] for coluna, valores in self._atual.items()}]
+        datas, produtos = [], []
+        deslocamento = 0
+        for parte in partes:
+            tamanho = len(parte["Data"])
+            if deslocamento + tamanho > inicio:
+                corte = max(inicio - deslocamento, 0)
+                datas.append(parte["Data"][corte:])
+                produtos.append(parte["Produto"][corte:])
+            deslocamento += tamanho
+        if not datas:
+            return np.empty(0, dtype=TIPOS_BLOCO["Data"]), np.empty(0, dtype=TIPOS_BLOCO["Produto"])
+        return np.concatenate(datas), np.concatenate(produtos)
+
+    def _atualizar_indice(self):
+        self._indice.atualizar(self._total, self._colunas_desde)
+
+    def intervalo_datas(self):
+        """Menor e maior data do livro, obtidas das pontas do índice por data, pulando os removidos."""
+        self._atualizar_indice()
+        inicio, fim = self._indice.intervalo_datas(self._posicoes_removidas)
+        if inicio is None:
+            return None, None
+        return pd.Timestamp(inicio).date(), pd.Timestamp(fim).date()
+
+    def _selecionar(self, inicio=None, fim=None, produtos=None, tipos=None):
+        """Posições ativas, em ordem de inserção, das linhas que atendem aos predicados.
+
+        Retorna None quando não há restrição, indicando o livro inteiro. Seleções
+        pequenas são resolvidas pelos índices, com custo proporcional ao resultado;
+        seleções amplas, por máscaras combinadas sobre todas as linhas. Em ambos os
+        casos o Tipo é resolvido pelos códigos, antes de montar qualquer DataFrame.
+        """
+        if inicio is None and fim is None and produtos is None and tipos is None:
+            return None
+        self._atualizar_indice()
+        mascaras = self._mascaras_livro()
+        inicio = None if inicio is None else pd.Timestamp(inicio).value
+        fim = None if fim is None else pd.Timestamp(fim).value
+        codigos = None
+        if produtos is not None:
+            codigos = [self.produtos.codigos[produto] for produto in produtos if produto in self.produtos.codigos]
+        codigos_tipos = None
+        if tipos is not None:
+            codigos_tipos = [CODIGO_TIPO[tipo] for tipo in tipos if tipo in CODIGO_TIPO]
+
+        estimativa = self._total
+        if codigos is not None:
+            estimativa = min(estimativa, int(mascaras.contagem_produtos()[codigos].sum()))
+        if inicio is not None or fim is not None:
+            estimativa = min(estimativa, self._indice.contar(inicio, fim))
+
+        if (codigos is not None or inicio is not None or fim is not None) and estimativa <= self._total * FRACAO_MASCARA:
+            posicoes = self._indice.posicoes(inicio, fim, codigos)
+            if codigos_tipos is not None:
+                posicoes = posicoes[np.isin(mascaras.tipos[posicoes], codigos_tipos)]
+            if self.removidos:
+                posicoes = posicoes[~np.isin(posicoes, self._posicoes_removidas, assume_unique=True)]
+            return posicoes
+
+        mascara = mascaras.selecionar(inicio, fim, codigos, codigos_tipos)
+        mascara[self._posicoes_removidas] = False
+        return np.flatnonzero(mascara)
+
+    def _mascaras_livro(self):
+        if self._mascaras is None:
+            df = self._dataframe_completo()
+            self._mascaras = MascarasMovimentacoes(
+                df["Data"].to_numpy().view(np.int64),
+                df["Produto"].array.codes,
+                df["Tipo"].array.codes,
+                len(self.produtos),
+            )
+        return self._mascaras
+
+    def filtrar(self, inicio=None, fim=None, produtos=None, tipos=None):
+        """Retorna as linhas que atendem aos predicados (None significa sem restrição).
+
+        As posições são resolvidas antes e o DataFrame é montado uma única vez.
+        """
+        posicoes = self._selecionar(inicio, fim, produtos, tipos)
+        if posicoes is None:
+            return self.dataframe()
+        return self._dataframe_completo().take(posicoes)
+
+    def produtos_filtrados(self, inicio=None, fim=None, produtos=None, tipos=None):
+        """Nomes, em ordem alfabética, dos produtos com linhas que atendem aos predicados."""
+        posicoes = self._selecionar(inicio, fim, produtos, tipos)
+        codigos = self._mascaras_livro().produtos
+        if posicoes is None:
+            contagem = self._mascaras_livro().contagem_produtos()
+            if self.removidos:
+                contagem = contagem - np.bincount(codigos[self._posicoes_removidas], minlength=len(contagem))
+        else:
+            contagem = np.bincount(codigos[posicoes], minlength=len(self.produtos))
+        return sorted(self.produtos.nomes[codigo] for codigo in np.flatnonzero(contagem))
+
+    def _dataframe_completo(self):
+        # Todas as posições, inclusive as removidas: a linha i é o registro de ID i
+        if self._df is None:
+            colunas = self._colunas_consolidadas()
+            colunas["Produto"] = pd.Categorical.from_codes(colunas["Produto"], categories=self.produtos.categorias())
+            colunas["Tipo"] = pd.Categorical.from_codes(colunas["Tipo"], dtype=ESQUEMA["Tipo"])
+            self._df = pd.DataFrame(colunas, columns=COLUNAS, index=pd.RangeIndex(self._total, name="ID"))
+        return self._df
+
+    def dataframe(self):
+        """Retorna o livro como DataFrame, montado apenas quando houve escrita desde a última chamada."""
+        if not self.removidos:
+            return self._dataframe_completo()
+        if self._df_ativos is None:
+            df = self._dataframe_completo()
+            self._df_ativos = df.drop(index=self._posicoes_removidas)
+        return self._df_ativos
@@ -0,0 +1,139 @@
+import json
+import logging
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+MAX_EXECUCOES = 20
+
+# GEREN_MEDICAO=1 liga a medição desde o início, sem depender do painel
+MEDICAO_PADRAO = os.environ.get("GEREN_MEDICAO", "") == "1"
+
+
+class _FaseNula:
+    """Fase usada com a medição desligada: não mede nem registra nada."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excecao):
+        return False
+
+    def registrar(self, **atributos):
+        pass
+
+
+FASE_NULA = _FaseNula()
+
+
+class _Fase:
+    def __init__(self, execucao, nome):
+        self._execucao = execucao
+        self.nome = nome
+        self.atributos = {}
+
+    def __enter__(self):
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *excecao):
+        duracao = time.perf_counter() - self._inicio
+        self._execucao.append({"fase": self.nome, "segundos": duracao, **self.atributos})
+        return False
+
+    def registrar(self, **atributos):
+        """Anexa contagens (linhas, produtos...) à fase."""
+        self.atributos.update(atributos)
+
+
+class MedicaoExecucoes:
+    """Tempos das fases de cada execução do script, para as últimas max_execucoes execuções.
+
+    Desligada, fase() devolve sempre o mesmo objeto nulo e o custo se resume a
+    uma verificação de atributo. Ligada, cada execução concluída é registrada no
+    log como uma linha JSON. A reexecução isolada de um fragmento (st.fragment)
+    conta como uma execução própria, marcada com o nome do fragmento.
+    """
+
+    def __init__(self, max_execucoes=MAX_EXECUCOES, ativa=MEDICAO_PADRAO):
+        self.ativa = ativa
+        self.execucoes = deque(maxlen=max_execucoes)
+        self._atual = None
+
+    def iniciar_execucao(self, fragmento=None):
+        if not self.ativa:
+            self._atual = None
+            return
+        self._atual = []
+        self._inicio = time.perf_counter()
+        self._momento = datetime.now()
+        self._fragmento = fragmento
+
+    def fase(self, nome):
+        """Context manager que mede a fase nome da execução atual."""
+        if self._atual is None:
+            return FASE_NULA
+        return _Fase(self._atual, nome)
+
+    def fragmento(self, nome):
+        """Context manager que mede o fragmento nome.
+
+        Durante uma execução completa, é uma fase como as outras; quando só o
+        fragmento é reexecutado, abre e conclui uma execução própria.
+        """
+        if self._atual is not None or not self.ativa:
+            return self.fase(nome)
+        return self._execucao_fragmento(nome)
+
+    @contextmanager
+    def _execucao_fragmento(self, nome):
+        self.iniciar_execucao(fragmento=nome)
+        try:
+            with self.fase(nome) as medida:
+                yield medida
+        finally:
+            self.concluir_execucao()
+
+    def concluir_execucao(self):
+        if self._atual is None:
+            return
+        execucao = {
+            "momento": self._momento.isoformat(timespec="seconds"),
+            "total": time.perf_counter() - self._inicio,
+            "fases": self._atual,
+        }
+        if self._fragmento is not None:
+            execucao["fragmento"] = self._fragmento
+        self.execucoes.append(execucao)
+        self._atual = None
+        logger.info(json.dumps(execucao, ensure_ascii=False))
+
+    def tabela(self):
+        """Tempos em milissegundos por execução (linhas, mais recente primeiro) e fase (colunas)."""
+        linhas = []
+        for execucao in reversed(self.execucoes):
+            rotulo = execucao["momento"]
+            if "fragmento" in execucao:
+                rotulo = f"{rotulo} (fragmento: {execucao['fragmento']})"
+            linha = {"Execução": rotulo, "Total": execucao["total"] * 1000}
+            for fase in execucao["fases"]:
+                linha[fase["fase"]] = linha.get(fase["fase"], 0.0) + fase["segundos"] * 1000
+            linhas.append(linha)
+        return pd.DataFrame(linhas).set_index("Execução") if linhas else pd.DataFrame()
+
+    def contagens(self):
+        """Atributos registrados pelas fases da última execução."""
+        if not self.execucoes:
+            return {}
+        return {
+            f"{fase['fase']}: {chave}": valor
+            for fase in self.execucoes[-1]["fases"]
+            for chave, valor in fase.items()
+            if chave not in ("fase", "segundos")
+        }
@@ -0,0 +1,139 @@
+"""Geração em lote dos relatórios de várias lojas, sem servidor web.
+
+Cada loja é um arquivo de movimentações (CSV ou XLSX, validado como na
+importação do app) ou um diretório de dados de um backend (GEREN_DADOS). As
+lojas são processadas em paralelo, uma por processo, e cada uma é lida em
+blocos (uma partição mensal por vez no Parquet), sem carregar o livro inteiro.
+
+Exemplo:
+    python relatorios.py loja1.csv loja2.xlsx dados/loja3 --saida relatorios --formatos Excel CSV
+"""
+import argparse
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from agregados import AgregadosEstoque
+from armazenamento import BackendMemoria, criar_backend
+from exportacao import FORMATOS, exportar, nome_relatorio
+from importacao import importar_movimentacoes, ler_em_blocos
+from saldos import LinhaTempoSaldos
+from valoracao import COLUNAS_VALORACAO, ValoracaoEstoque
+
+logger = logging.getLogger(__name__)
+
+
+def nome_loja(origem):
+    """Nome da loja: o do arquivo sem extensão ou o do diretório."""
+    return os.path.splitext(os.path.basename(os.path.normpath(origem)))[0]
+
+
+def carregar_loja(origem, tipo=None, opcoes_csv=None):
+    """Abre o livro da loja e retorna (backend, agregados, rejeitados).
+
+    Arquivos são importados para um backend em memória com as regras do
+    formulário; rejeitados traz as linhas recusadas (None para diretórios).
+    """
+    if os.path.isfile(origem):
+        backend = BackendMemoria()
+        agregados = AgregadosEstoque()
+        opcoes = {} if origem.lower().endswith(".xlsx") else (opcoes_csv or {})
+        _, rejeitados = importar_movimentacoes(
+            ler_em_blocos(origem, origem, **opcoes), backend, agregados, LinhaTempoSaldos()
+        )
+        return backend, agregados, rejeitados
+    if not os.path.isdir(origem):
+        raise FileNotFoundError(f"Loja não encontrada: {origem}")
+    # Um diretório sem dados do backend é um erro, não uma loja vazia
+    backend = criar_backend(tipo, origem, criar=False)
+    return backend, backend.agregados(), None
+
+
+def processar_loja(origem, saida, tipo=None, formatos=("Excel",), opcoes_csv=None):
+    """Gera o resumo por produto e os relatórios de uma loja em saida/<loja>/.
+
+    Retorna um dicionário com o nome da loja, o número de movimentações, os
+    totais globais e os arquivos gravados.
+    """
+    loja = nome_loja(origem)
+    backend, agregados, rejeitados = carregar_loja(origem, tipo, opcoes_csv)
+    valoracao = ValoracaoEstoque.de_blocos(backend.varrer(colunas=COLUNAS_VALORACAO))
+    resumo = agregados.resumir(cmv=valoracao.cmv())
+
+    pasta = os.path.join(saida, loja)
+    os.makedirs(pasta, exist_ok=True)
+    arquivos = [os.path.join(pasta, "resumo.csv")]
+    resumo.por_produto.to_csv(arquivos[0])
+    for formato in formatos:
+        arquivos.append(os.path.join(pasta, nome_relatorio(formato)))
+        try:
+            with open(arquivos[-1], "wb") as arquivo:
+                exportar(formato, backend.varrer(), resumo.por_produto, destino=arquivo)
+        except Exception:
+            # Um relatório incompleto não deve ficar na pasta como se tivesse sido gerado
+            os.unlink(arquivos.pop())
+            raise
+    if rejeitados is not None and not rejeitados.empty:
+        arquivos.append(os.path.join(pasta, "rejeicoes.csv"))
+        rejeitados.to_csv(arquivos[-1], index=False)
+
+    return {
+        "Loja": loja,
+        "Movimentações": len(backend),
+        "Rejeitadas": 0 if rejeitados is None else len(rejeitados),
+        **{coluna: float(valor) for coluna, valor in resumo.totais.items()},
+        "Arquivos": arquivos,
+    }
+
+
+def processar_lojas(origens, saida, tipo=None, formatos=("Excel",), opcoes_csv=None, processos=None):
+    """Processa as lojas em paralelo; retorna (resultados, falhas) com falhas em {origem: erro}."""
+    resultados, falhas = [], {}
+    with ProcessPoolExecutor(max_workers=processos) as executor:
+        futuros = {
+            executor.submit(processar_loja, origem, saida, tipo, tuple(formatos), opcoes_csv): origem
+            for origem in origens
+        }
+        for futuro in as_completed(futuros):
+            origem = futuros[futuro]
+            try:
+                resultados.append(futuro.result())
+                logger.info(f"Loja {nome_loja(origem)} concluída")
+            except Exception as e:
+                falhas[origem] = str(e)
+                logger.error(f"Erro ao processar a loja {origem}: {str(e)}")
+    return sorted(resultados, key=lambda resultado: resultado["Loja"]), falhas
+
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("lojas", nargs="+", help="Arquivos CSV/XLSX ou diretórios de dados das lojas")
+    parser.add_argument("--saida", default="relatorios", help="Diretório dos relatórios")
+    parser.add_argument("--formatos", nargs="+", default=["Excel"], choices=list(FORMATOS))
+    parser.add_argument("--armazenamento", choices=["sqlite", "parquet"], default="sqlite",
+                        help="Backend dos diretórios de dados")
+    parser.add_argument("--processos", type=int, default=None, help="Número de processos (padrão: CPUs)")
+    parser.add_argument("--sep", default=",", help="Separador dos CSVs")
+    parser.add_argument("--decimal", default=".", help="Separador decimal dos CSVs")
+    opcoes = parser.parse_args(argumentos)
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    resultados, falhas = processar_lojas(
+        opcoes.lojas,
+        opcoes.saida,
+        tipo=opcoes.armazenamento,
+        formatos=opcoes.formatos,
+        opcoes_csv={"sep": opcoes.sep, "decimal": opcoes.decimal},
+        processos=opcoes.processos,
+    )
+    if resultados:
+        tabela = pd.DataFrame(resultados).drop(columns="Arquivos").set_index("Loja")
+        print(tabela.to_string(float_format=lambda valor: f"{valor:,.2f}"))
+    return 1 if falhas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+from collections import defaultdict
+
+import pandas as pd
+
+AGREGACOES = ["Diária", "Semanal", "Mensal"]
+
+
+def inicio_periodo(datas, agregacao):
+    """Data de início do período de cada data: o próprio dia, a segunda-feira da semana ou o dia 1 do mês."""
+    datas = pd.to_datetime(pd.Series(datas)).dt.normalize()
+    if agregacao == "Semanal":
+        return datas - pd.to_timedelta(datas.dt.weekday, unit="D")
+    if agregacao == "Mensal":
+        return datas.dt.to_period("M").dt.start_time
+    return datas
+
+
+def _inicio_periodo_data(data, agregacao):
+    if agregacao == "Semanal":
+        return data - pd.Timedelta(days=data.weekday())
+    if agregacao == "Mensal":
+        return data.replace(day=1)
+    return data
+
+
+def _nova_serie():
+    return defaultdict(int)
+
+
+class RollupsTemporais:
+    """Quantidades movimentadas por produto, período e tipo, nas agregações diária, semanal e mensal.
+
+    Cada novo registro atualiza as três séries do produto em O(1), de modo que o
+    gráfico de evolução apenas lê a série pronta.
+    """
+
+    def __init__(self):
+        # (produto, agregação) -> {(início do período, tipo): quantidade}
+        # Fábrica nomeada (e não lambda) para que as séries possam ir para o checkpoint
+        self._series = defaultdict(_nova_serie)
+
+    @classmethod
+    def de_totais_diarios(cls, diarios):
+        """Constrói as séries a partir dos totais diários (colunas Produto, Data, Tipo e Quantidade)."""
+        rollups = cls()
+        rollups.adicionar_lote(diarios)
+        return rollups
+
+    def adicionar(self, registro):
+        """Soma a quantidade do registro ao período correspondente em cada agregação."""
+        data = pd.Timestamp(registro["Data"]).normalize()
+        for agregacao in AGREGACOES:
+            periodo = _inicio_periodo_data(data, agregacao)
+            self._series[(registro["Produto"], agregacao)][(periodo, registro["Tipo"])] += registro["Quantidade"]
+
+    def remover(self, registro):
+        """Desfaz adicionar(registro), descartando os períodos que ficam sem quantidade."""
+        data = pd.Timestamp(registro["Data"]).normalize()
+        for agregacao in AGREGACOES:
+            chave_serie = (registro["Produto"], agregacao)
+            pontos = self._series[chave_serie]
+            chave = (_inicio_periodo_data(data, agregacao), registro["Tipo"])
+            pontos[chave] -= registro["Quantidade"]
+            if not pontos[chave]:
+                del pontos[chave]
+            if not pontos:
+                del self._series[chave_serie]
+
+    def adicionar_lote(self, df):
+        """Incorpora um lote de movimentações, agrupando-o por período antes de somar."""
+        if df.empty:
+            return
+        for agregacao in AGREGACOES:
+            totais = (
+                df.assign(Periodo=inicio_periodo(df["Data"], agregacao).to_numpy())
+                .groupby(["Produto", "Periodo", "Tipo"], observed=True, sort=False)["Quantidade"]
+                .sum()
+            )
+            for (produto, periodo, tipo), quantidade in totais.items():
+                self._series[(produto, agregacao)][(periodo, tipo)] += quantidade
+
+    def serie(self, produto, agregacao="Diária"):
+        """Retorna a série do produto com a quantidade com sinal (saídas negativas), ordenada por data."""
+        pontos = self._series.get((produto, agregacao), {})
+        serie = pd.DataFrame(
+            [(periodo, tipo, quantidade if tipo == "entrada" else -quantidade)
+             for (periodo, tipo), quantidade in pontos.items()],
+            columns=["Data", "Tipo", "Quantidade"],
+        )
+        return serie.sort_values(["Data", "Tipo"], ignore_index=True)
@@ -0,0 +1,206 @@
+import numpy as np
+import pandas as pd
+
+SEM_LIMITE = np.iinfo(np.int64).max
+CAPACIDADE_INICIAL = 16
+
+
+class _LinhaProduto:
+    """Saldos de um produto ao fim de cada dia com movimento, com árvore de mínimos.
+
+    datas[i] é o i-ésimo dia com movimento e saldos[i] o saldo ao fim dele. A
+    árvore de segmentos sobre saldos responde ao mínimo de qualquer sufixo em
+    O(log n). Movimentos no último dia ou depois dele são incorporados em
+    O(log n) (ou O(k + log n) para k dias de uma vez); os retroativos deslocam
+    os saldos seguintes e reconstroem a árvore com operações vetorizadas.
+    """
+
+    def __init__(self):
+        self._reconstruir(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+
+    def _reconstruir(self, datas, saldos, capacidade=CAPACIDADE_INICIAL):
+        self.n = len(datas)
+        while capacidade < self.n:
+            capacidade *= 2
+        self.capacidade = capacidade
+        self.datas = np.empty(capacidade, dtype=np.int64)
+        self.saldos = np.empty(capacidade, dtype=np.int64)
+        self.datas[:self.n] = datas
+        self.saldos[:self.n] = saldos
+        # Folhas em [capacidade, 2 * capacidade); o nó i é o mínimo de 2i e 2i + 1
+        self.arvore = np.full(2 * capacidade, SEM_LIMITE, dtype=np.int64)
+        self._atualizar_folhas(0, saldos)
+
+    def _atualizar_folhas(self, inicio, valores):
+        """Grava valores nas folhas a partir de inicio e recalcula só os nós acima delas."""
+        inicio += self.capacidade
+        fim = inicio + len(valores)
+        self.arvore[inicio:fim] = valores
+        while inicio > 1:
+            inicio, fim = inicio // 2, (fim - 1) // 2 + 1
+            self.arvore[inicio:fim] = np.minimum(
+                self.arvore[2 * inicio:2 * fim:2], self.arvore[2 * inicio + 1:2 * fim:2]
+            )
+
+    def _minimo(self, inicio, fim):
+        resultado = SEM_LIMITE
+        inicio += self.capacidade
+        fim += self.capacidade
+        while inicio < fim:
+            if inicio & 1:
+                resultado = min(resultado, self.arvore[inicio])
+                inicio += 1
+            if fim & 1:
+                fim -= 1
+                resultado = min(resultado, self.arvore[fim])
+            inicio //= 2
+            fim //= 2
+        return int(resultado)
+
+    def _posicao(self, data):
+        # Número de dias com movimento até data, inclusive
+        return int(np.searchsorted(self.datas[:self.n], data, side="right"))
+
+    def _acrescentar(self, datas, saldos):
+        if self.n + len(datas) > self.capacidade:
+            self._reconstruir(
+                np.r_[self.datas[:self.n], datas], np.r_[self.saldos[:self.n], saldos], 2 * self.capacidade
+            )
+            return
+        self.datas[self.n:self.n + len(datas)] = datas
+        self.saldos[self.n:self.n + len(datas)] = saldos
+        self._atualizar_folhas(self.n, saldos)
+        self.n += len(datas)
+
+    def adicionar(self, data, movimento):
+        posicao = self._posicao(data)
+        if posicao and self.datas[posicao - 1] == data:
+            # Dia já presente: desloca o saldo dele e o dos dias seguintes
+            self.saldos[posicao - 1:self.n] += movimento
+            self._atualizar_folhas(posicao - 1, self.saldos[posicao - 1:self.n])
+        elif posicao == self.n:
+            anterior = self.saldos[self.n - 1] if self.n else 0
+            self._acrescentar(np.array([data]), np.array([anterior + movimento]))
+        else:
+            anterior = self.saldos[posicao - 1] if posicao else 0
+            saldos = self.saldos[:self.n].copy()
+            saldos[posicao:] += movimento
+            self._reconstruir(
+                np.insert(self.datas[:self.n], posicao, data),
+                np.insert(saldos, posicao, anterior + movimento),
+                self.capacidade,
+            )
+
+    def estender(self, datas, movimentos):
+        """Incorpora movimentos líquidos por dia (datas crescentes e sem repetição)."""
+        if not self.n or datas[0] > self.datas[self.n - 1]:
+            anterior = self.saldos[self.n - 1] if self.n else 0
+            self._acrescentar(datas, anterior + np.cumsum(movimentos))
+            return
+        todas, inversa = np.unique(np.r_[self.datas[:self.n], datas], return_inverse=True)
+        deltas = np.r_[np.diff(self.saldos[:self.n], prepend=0), movimentos]
+        self._reconstruir(todas, np.cumsum(np.bincount(inversa, weights=deltas)).astype(np.int64), self.capacidade)
+
+    def saldo_em(self, data):
+        posicao = self._posicao(data)
+        return int(self.saldos[posicao - 1]) if posicao else 0
+
+    def minimo_apos(self, data):
+        """Menor saldo ao fim dos dias posteriores a data (None se não houver)."""
+        posicao = self._posicao(data)
+        if posicao == self.n:
+            return None
+        return self._minimo(posicao, self.n)
+
+    def disponiveis(self, datas):
+        """min(saldo_em, minimo_apos) de várias datas de uma vez, com os mínimos de sufixo vetorizados."""
+        saldos = self.saldos[:self.n]
+        posicoes = np.searchsorted(self.datas[:self.n], datas, side="right")
+        sufixos = np.r_[np.minimum.accumulate(saldos[::-1])[::-1], SEM_LIMITE]
+        return np.minimum(np.r_[0, saldos][posicoes], sufixos[posicoes])
+
+
+class LinhaTempoSaldos:
+    """Saldo de cada produto ao fim de cada dia, para validar saídas retroativas.
+
+    saldo_em(produto, data) e minimo_apos(produto, data) são buscas binárias
+    mais uma consulta à árvore de mínimos; uma saída de q unidades em data é
+    possível se q não passar de disponivel(produto, data), o menor entre o saldo
+    na data e os saldos de todos os dias seguintes. Como os registros só têm
+    data, movimentos do mesmo dia são somados, e a memória cresce com o número
+    de dias com movimento de cada produto, não com o de registros.
+    """
+
+    def __init__(self):
+        self._produtos = {}
+
+    @classmethod
+    def de_dataframe(cls, df):
+        linha = cls()
+        linha.adicionar_lote(df)
+        return linha
+
+    @staticmethod
+    def _data(data):
+        return pd.Timestamp(data).normalize().value
+
+    def adicionar(self, registro, sinal=1):
+        movimento = registro["Quantidade"] if registro["Tipo"] == "entrada" else -registro["Quantidade"]
+        linha = self._produtos.setdefault(registro["Produto"], _LinhaProduto())
+        linha.adicionar(self._data(registro["Data"]), sinal * int(movimento))
+
+    def remover(self, registro):
+        """Desfaz adicionar(registro): desloca os saldos da data do registro em diante."""
+        self.adicionar(registro, sinal=-1)
+
+    def adicionar_lote(self, df):
+        """Incorpora um lote somando antes os movimentos por produto e dia."""
+        if df.empty:
+            return
+        quantidade = df["Quantidade"].to_numpy(dtype=np.int64)
+        diarios = (
+            pd.DataFrame({
+                "Produto": df["Produto"].to_numpy(dtype=object),
+                "Data": pd.to_datetime(df["Data"]).dt.normalize().to_numpy(dtype="datetime64[ns]").view(np.int64),
+                "Movimento": np.where((df["Tipo"] == "entrada").to_numpy(), quantidade, -quantidade),
+            })
+            .groupby(["Produto", "Data"], sort=True)["Movimento"]
+            .sum()
+        )
+        produtos = diarios.index.get_level_values("Produto").to_numpy()
+        datas = diarios.index.get_level_values("Data").to_numpy(dtype=np.int64)
+        movimentos = diarios.to_numpy(dtype=np.int64)
+        limites = np.r_[0, np.flatnonzero(produtos[1:] != produtos[:-1]) + 1, len(produtos)]
+        for inicio, fim in zip(limites[:-1], limites[1:]):
+            linha = self._produtos.setdefault(produtos[inicio], _LinhaProduto())
+            linha.estender(datas[inicio:fim], movimentos[inicio:fim])
+
+    def saldo_em(self, produto, data):
+        """Saldo do produto ao final do dia data."""
+        linha = self._produtos.get(produto)
+        return 0 if linha is None else linha.saldo_em(self._data(data))
+
+    def minimo_apos(self, produto, data):
+        """Menor saldo do produto nos dias posteriores a data (None se não houver movimentos)."""
+        linha = self._produtos.get(produto)
+        return None if linha is None else linha.minimo_apos(self._data(data))
+
+    def disponivel(self, produto, data):
+        """Maior quantidade que pode sair em data sem deixar nenhum saldo, na data ou depois, negativo."""
+        saldo = self.saldo_em(produto, data)
+        minimo = self.minimo_apos(produto, data)
+        return saldo if minimo is None else min(saldo, minimo)
+
+    def disponiveis(self, produtos, datas):
+        """disponivel(produtos[i], datas[i]) para cada i, como array, agrupando as consultas por produto."""
+        produtos = np.asarray(produtos, dtype=object)
+        datas = pd.DatetimeIndex(datas).normalize().asi8
+        resultado = np.zeros(len(datas), dtype=np.int64)
+        codigos, nomes = pd.factorize(produtos)
+        ordem = np.argsort(codigos, kind="stable")
+        limites = np.r_[0, np.flatnonzero(np.diff(codigos[ordem])) + 1, len(ordem)]
+        for inicio, fim in zip(limites[:-1], limites[1:]):
+            linha = self._produtos.get(nomes[codigos[ordem[inicio]]])
+            if linha is not None:
+                resultado[ordem[inicio:fim]] = linha.disponiveis(datas[ordem[inicio:fim]])
+        return resultado
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+
+from ledger import COLUNAS, aplicar_esquema
+
+
+def gerar_movimentacoes(linhas, produtos=100, dias=365, inicio="2024-01-01", semente=0):
+    """Gera um livro sintético determinístico com as colunas e o esquema do livro.
+
+    A popularidade dos produtos segue uma distribuição de Zipf (poucos produtos
+    concentram a maior parte das linhas), cerca de 60% das linhas são entradas e
+    cada produto tem um Custo Unitário fixo, como exige o formulário. Também como
+    no formulário, nenhuma saída deixa o saldo do produto negativo: a primeira
+    movimentação de cada produto é uma entrada grande o bastante para cobrir as
+    saídas seguintes. As datas cobrem dias dias a partir de inicio, em ordem
+    crescente. A mesma semente produz sempre o mesmo livro.
+    """
+    rng = np.random.default_rng(semente)
+    pesos = 1.0 / np.arange(1, produtos + 1)
+    codigos = rng.choice(produtos, size=linhas, p=pesos / pesos.sum())
+    nomes = np.array([f"produto-{i:05d}" for i in range(produtos)], dtype=object)
+    custos = rng.uniform(1.0, 100.0, produtos).round(2)
+
+    entrada = rng.random(linhas) < 0.6
+    # As linhas já estão em ordem de data: a primeira de cada produto é a mais antiga
+    primeiras = np.unique(codigos, return_index=True)[1]
+    entrada[primeiras] = True
+    custo = custos[codigos]
+    preco = np.where(entrada, 0.0, (custo * rng.uniform(1.1, 1.6, linhas)).round(2))
+    deslocamentos = np.sort(rng.integers(0, dias * 86_400, linhas))
+    quantidade = rng.integers(1, 50, linhas)
+    saldo = pd.Series(np.where(entrada, quantidade, -quantidade)).groupby(codigos).cumsum()
+    quantidade[primeiras] += (-saldo.groupby(codigos).min()).clip(lower=0).to_numpy()
+
+    df = pd.DataFrame({
+        "Data": pd.Timestamp(inicio) + pd.to_timedelta(deslocamentos, unit="s"),
+        "Produto": nomes[codigos],
+        "Tipo": np.where(entrada, "entrada", "saída"),
+        "Quantidade": quantidade,
+        "Custo Unitário": custo,
+        "Preço de Venda": preco,
+    }, columns=COLUNAS)
+    return aplicar_esquema(df)
@@ -0,0 +1,77 @@
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+MAX_TRABALHADORES = 2
+MAX_RESULTADOS = 8
+
+
+class TarefaExportacao:
+    """Geração de um relatório em andamento ou concluída, com o progresso de 0 a 1."""
+
+    def __init__(self, nome_arquivo):
+        self.nome_arquivo = nome_arquivo
+        self.progresso = 0.0
+        self.futuro = None
+
+    def atualizar_progresso(self, fracao):
+        self.progresso = fracao
+
+    @property
+    def concluida(self):
+        return self.futuro.done()
+
+    @property
+    def falhou(self):
+        return self.futuro.done() and self.futuro.exception() is not None
+
+    def resultado(self):
+        """Bytes do relatório; relança a exceção da geração, se houver."""
+        return self.futuro.result()
+
+
+class FilaExportacoes:
+    """Gera relatórios em threads de fundo e guarda os últimos resultados.
+
+    As tarefas são indexadas por uma chave com a versão do livro, o filtro e o
+    formato: pedir de novo o mesmo relatório devolve a tarefa existente, em
+    andamento ou já concluída, sem gerá-lo outra vez. Tarefas que falharam são
+    substituídas no próximo pedido.
+    """
+
+    def __init__(self, max_trabalhadores=MAX_TRABALHADORES, max_resultados=MAX_RESULTADOS):
+        self.max_resultados = max_resultados
+        self._executor = ThreadPoolExecutor(max_workers=max_trabalhadores, thread_name_prefix="exportacao")
+        self._tarefas = OrderedDict()
+        self._trava = threading.Lock()
+
+    def obter(self, chave):
+        """Retorna a tarefa da chave, ou None se o relatório ainda não foi pedido."""
+        with self._trava:
+            tarefa = self._tarefas.get(chave)
+            if tarefa is not None:
+                self._tarefas.move_to_end(chave)
+            return tarefa
+
+    def submeter(self, chave, gerar, nome_arquivo):
+        """Agenda gerar(ao_progredir) -> bytes, a menos que a chave já tenha uma tarefa válida."""
+        with self._trava:
+            tarefa = self._tarefas.get(chave)
+            if tarefa is not None and not tarefa.falhou:
+                self._tarefas.move_to_end(chave)
+                return tarefa
+            tarefa = TarefaExportacao(nome_arquivo)
+            tarefa.futuro = self._executor.submit(gerar, tarefa.atualizar_progresso)
+            self._tarefas[chave] = tarefa
+            self._descartar_excedentes()
+        logger.info(f"Relatório agendado: {nome_arquivo}")
+        return tarefa
+
+    def _descartar_excedentes(self):
+        # Descarta as tarefas concluídas mais antigas; as em andamento são mantidas
+        excedente = len(self._tarefas) - self.max_resultados
+        for chave in [chave for chave, tarefa in self._tarefas.items() if tarefa.concluida][:max(excedente, 0)]:
+            del self._tarefas[chave]
@@ -0,0 +1,50 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+# Os módulos do Gerenciador são importados pelo nome, como o app faz ao rodar da própria pasta
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def reconstrucoes(monkeypatch):
+    """EstoqueCompartilhados que releram o livro inteiro em vez de partir do checkpoint."""
+    from estoque import EstoqueCompartilhado
+    chamadas = []
+    original = EstoqueCompartilhado._reconstruir
+
+    def reconstruir(self):
+        chamadas.append(self)
+        original(self)
+    monkeypatch.setattr(EstoqueCompartilhado, "_reconstruir", reconstruir)
+    return chamadas
+
+
+@pytest.fixture
+def estado_estoque():
+    """Função que resume as estruturas derivadas de um EstoqueCompartilhado, para comparar dois deles."""
+    def estado(estoque):
+        produtos = estoque.agregados.produtos()
+        datas = pd.date_range("2023-12-20", periods=40, freq="7D")
+        return {
+            "resumo": estoque.agregados.resumir(cmv=estoque.cmv()).por_produto.sort_index(),
+            "fifo": estoque.cmv("fifo").sort_index(),
+            "series": {produto: estoque.rollups.serie(produto, "Semanal") for produto in produtos},
+            "saldos": {(produto, data): estoque.saldos.disponivel(produto, data) for produto in produtos for data in datas},
+        }
+    return estado
+
+
+@pytest.fixture
+def comparar_estoques(estado_estoque):
+    def comparar(obtido, esperado):
+        obtido, esperado = estado_estoque(obtido), estado_estoque(esperado)
+        pd.testing.assert_frame_equal(obtido["resumo"], esperado["resumo"], rtol=1e-9, atol=1e-6)
+        pd.testing.assert_series_equal(obtido["fifo"], esperado["fifo"], rtol=1e-9, atol=1e-6)
+        assert obtido["series"].keys() == esperado["series"].keys()
+        for produto, serie in esperado["series"].items():
+            pd.testing.assert_frame_equal(obtido["series"][produto], serie)
+        assert obtido["saldos"] == esperado["saldos"]
+    return comparar
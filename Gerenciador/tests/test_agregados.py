@@ -0,0 +1,48 @@
+import pandas as pd
+
+from agregados import AgregadosEstoque
+
+MOVIMENTACOES = pd.DataFrame({
+    "Data": pd.to_datetime(["2024-01-01", "2024-01-02", "2024-01-03", "2024-01-04", "2024-01-05"]),
+    "Produto": ["a", "b", "a", "a", "b"],
+    "Tipo": ["entrada", "entrada", "saída", "entrada", "saída"],
+    "Quantidade": [10, 5, 4, 2, 5],
+    "Custo Unitário": [2.0, 3.0, 0.0, 4.0, 0.0],
+    "Preço de Venda": [0.0, 0.0, 5.0, 0.0, 0.0],
+})
+
+
+def test_adicionar_registro_a_registro_equivale_a_de_dataframe():
+    incremental = AgregadosEstoque()
+    for registro in MOVIMENTACOES.to_dict("records"):
+        incremental.adicionar(registro)
+    completo = AgregadosEstoque.de_dataframe(MOVIMENTACOES)
+
+    pd.testing.assert_frame_equal(incremental.resumo(), completo.resumo(), check_dtype=False)
+    assert incremental.resumir().totais == completo.resumir().totais
+
+
+def test_totais_por_produto():
+    agregados = AgregadosEstoque.de_dataframe(MOVIMENTACOES)
+    assert agregados.produtos() == ["a", "b"]
+    assert agregados.saldo("a") == 8
+    assert agregados.saldo("b") == 0
+    assert agregados.custo_referencia("a") == 2.0
+    assert agregados.custo_medio("a") == 3.0
+    assert agregados.lucro("a") == 4 * 5.0 - 4 * 3.0
+    assert "c" not in agregados and agregados.saldo("c") == 0
+
+
+def test_resumir_compartilha_a_tabela_por_produto():
+    resumo = AgregadosEstoque.de_dataframe(MOVIMENTACOES).resumir()
+    por_produto = resumo.por_produto
+
+    assert list(por_produto.index) == ["a", "b"]
+    assert por_produto["Saldo Atual"].tolist() == [8, 0]
+    assert resumo.totais == {
+        coluna: por_produto[coluna].sum() for coluna in ["Entradas", "Saídas", "Valor Entradas", "Valor Saídas", "Lucro"]
+    }
+    assert resumo.totais["Lucro"] == 4 * 5.0 - 4 * 3.0 - 5 * 3.0
+    assert resumo.saidas_sem_preco == 1
+    assert list(resumo.principais(1).index) == ["a"]
+    assert AgregadosEstoque().resumir().empty
@@ -0,0 +1,19 @@
+import os
+
+from streamlit.testing.v1 import AppTest
+
+import app
+
+CAMINHO_APP = os.path.join(os.path.dirname(os.path.dirname(__file__)), "app.py")
+
+
+def test_importa_sem_executar_a_interface():
+    # Importar o módulo não deve abrir o armazenamento nem desenhar nada
+    assert callable(app.main)
+
+
+def test_interface_com_livro_vazio(monkeypatch, tmp_path):
+    monkeypatch.setenv("GEREN_ARMAZENAMENTO", "memoria")
+    monkeypatch.setenv("GEREN_DADOS", str(tmp_path))
+    teste = AppTest.from_file(CAMINHO_APP, default_timeout=30).run()
+    assert not teste.exception
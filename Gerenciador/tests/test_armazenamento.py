@@ -0,0 +1,112 @@
+import os
+
+import pandas as pd
+import pytest
+
+import armazenamento
+from agregados import AgregadosEstoque
+from armazenamento import FiltroMovimentacoes, criar_backend
+from ledger import aplicar_esquema
+
+MOVIMENTACOES = pd.DataFrame({
+    "Data": pd.to_datetime(["2024-01-05", "2024-01-20", "2024-02-03", "2024-03-10", "2024-03-11", "2024-04-02"]),
+    "Produto": ["a", "b", "a", "c", "a", "b"],
+    "Tipo": ["entrada", "entrada", "saída", "entrada", "entrada", "saída"],
+    "Quantidade": [10, 5, 4, 7, 2, 3],
+    "Custo Unitário": [2.0, 3.0, 0.0, 1.5, 4.0, 0.0],
+    "Preço de Venda": [0.0, 0.0, 5.0, 0.0, 0.0, 6.0],
+})
+
+FILTROS = [
+    FiltroMovimentacoes(),
+    FiltroMovimentacoes(inicio=pd.Timestamp("2024-01-20").date(), fim=pd.Timestamp("2024-03-10").date()),
+    FiltroMovimentacoes(produtos=("a", "c")),
+    FiltroMovimentacoes(inicio=pd.Timestamp("2024-02-01").date(), tipos=("entrada",)),
+]
+
+
+@pytest.fixture(params=["memoria", "sqlite", "parquet"])
+def backend(request, tmp_path):
+    backend = criar_backend(request.param, str(tmp_path))
+    backend.adicionar_lote(MOVIMENTACOES.iloc[:4])
+    for registro in MOVIMENTACOES.iloc[4:].to_dict("records"):
+        backend.adicionar(registro)
+    return backend
+
+
+def _esperado(filtro):
+    mascara = pd.Series(True, index=MOVIMENTACOES.index)
+    if filtro.inicio is not None:
+        mascara &= MOVIMENTACOES["Data"] >= pd.Timestamp(filtro.inicio)
+    if filtro.fim is not None:
+        mascara &= MOVIMENTACOES["Data"] <= pd.Timestamp(filtro.fim)
+    if filtro.produtos is not None:
+        mascara &= MOVIMENTACOES["Produto"].isin(filtro.produtos)
+    if filtro.tipos is not None:
+        mascara &= MOVIMENTACOES["Tipo"].isin(filtro.tipos)
+    return MOVIMENTACOES[mascara]
+
+
+def _comparavel(df):
+    ordem = ["Data", "Produto", "Tipo"]
+    return df.astype({"Produto": str, "Tipo": str}).sort_values(ordem).reset_index(drop=True)
+
+
+@pytest.mark.parametrize("filtro", FILTROS)
+def test_consulta_filtrada_igual_em_todos_os_backends(backend, filtro):
+    obtido = backend.consultar(filtro)
+    # Todos os backends devolvem o esquema compacto do livro
+    assert obtido.dtypes.astype(str).to_dict() == aplicar_esquema(MOVIMENTACOES).dtypes.astype(str).to_dict()
+    pd.testing.assert_frame_equal(_comparavel(obtido), _comparavel(_esperado(filtro)), check_dtype=False)
+    assert backend.produtos(filtro) == sorted(_esperado(filtro)["Produto"].unique())
+
+
+@pytest.mark.parametrize("filtro", FILTROS)
+def test_varrer_entrega_o_filtro_em_ordem_de_data(backend, filtro):
+    blocos = [bloco for bloco in backend.varrer(filtro) if len(bloco)]
+    obtido = pd.concat(blocos, ignore_index=True) if blocos else backend.consultar(filtro)
+    assert obtido["Data"].is_monotonic_increasing
+    pd.testing.assert_frame_equal(_comparavel(obtido), _comparavel(_esperado(filtro)), check_dtype=False)
+
+
+def test_agregados_e_intervalo_iguais_em_todos_os_backends(backend):
+    esperado = AgregadosEstoque.de_dataframe(MOVIMENTACOES)
+    pd.testing.assert_frame_equal(
+        backend.agregados().resumo().sort_index(), esperado.resumo().sort_index(), check_dtype=False
+    )
+    assert len(backend) == len(MOVIMENTACOES)
+    assert backend.intervalo_datas() == (pd.Timestamp("2024-01-05").date(), pd.Timestamp("2024-04-02").date())
+
+
+def test_sqlite_leva_o_filtro_para_o_where(tmp_path):
+    backend = criar_backend("sqlite", str(tmp_path))
+    backend.adicionar_lote(MOVIMENTACOES)
+    consultas = []
+    backend.conexao.set_trace_callback(consultas.append)
+    backend.consultar(FILTROS[3])
+
+    (consulta,) = [sql for sql in consultas if sql.lstrip().startswith("SELECT")]
+    assert "WHERE data >= '2024-02-01' AND tipo IN ('entrada')" in consulta
+
+
+def test_parquet_poda_particoes_e_filtra_no_dataset(tmp_path):
+    backend = criar_backend("parquet", str(tmp_path))
+    backend.adicionar_lote(MOVIMENTACOES)
+    filtro = FILTROS[1]
+    expressao = backend._expressao(filtro)
+
+    fragmentos = backend._dataset().get_fragments(filter=expressao)
+    meses = sorted(os.path.basename(os.path.dirname(fragmento.path)) for fragmento in fragmentos)
+    assert meses == ["mes=2024-01", "mes=2024-02", "mes=2024-03"]
+    assert backend._dataset().to_table(filter=expressao).num_rows == len(_esperado(filtro))
+
+
+def test_parquet_compacta_particao_com_muitos_arquivos(tmp_path, monkeypatch):
+    monkeypatch.setattr(armazenamento, "LIMITE_ARQUIVOS_PARTICAO", 4)
+    backend = criar_backend("parquet", str(tmp_path))
+    registro = MOVIMENTACOES.iloc[0].to_dict()
+    for _ in range(10):
+        backend.adicionar(registro)
+
+    assert len(os.listdir(os.path.join(backend.diretorio, "mes=2024-01"))) < 4
+    assert len(backend) == 10
@@ -0,0 +1,26 @@
+import json
+
+import benchmark
+
+ARGUMENTOS = ["--linhas", "300", "--produtos", "20", "--repeticoes", "1"]
+
+
+def test_execucao_pequena(tmp_path):
+    saida = tmp_path / "resultados.json"
+    assert benchmark.main(ARGUMENTOS + ["--saida", str(saida)]) == 0
+
+    resultados = json.loads(saida.read_text(encoding="utf-8"))["resultados"]
+    assert set(resultados) == {f"{nome}[linhas=300]" for nome in benchmark.BENCHMARKS}
+
+    # Contra uma base muito mais rápida a execução termina com código 1
+    base = tmp_path / "base.json"
+    base.write_text(json.dumps({"resultados": {chave: 0.0 for chave in resultados}}), encoding="utf-8")
+    apenas = ["--apenas", "calcular_saldo", "exportar_relatorio[Excel]"]
+    assert benchmark.main(ARGUMENTOS + apenas + ["--base", str(base), "--limite", "0"]) == 1
+
+
+def test_comparar_ignora_ruido_e_chaves_novas():
+    base = {"lento": 0.5, "ruido": 0.0001}
+    atual = {"lento": 1.0, "ruido": 0.001, "novo": 9.0}
+    assert benchmark.comparar(atual, base, 0.2) == [("lento", 0.5, 1.0)]
+    assert benchmark.comparar(atual, base, 1.5) == []
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+from agregados import AgregadosEstoque
+from cache import CacheResultados, tamanho_aproximado
+
+
+def _pontos(n):
+    return pd.DataFrame({"Data": pd.date_range("2024-01-01", periods=n), "Quantidade": np.arange(n)})
+
+
+def _agregados(produtos):
+    agregados = AgregadosEstoque()
+    for i in range(produtos):
+        agregados.adicionar({
+            "Produto": f"produto {i}", "Tipo": "entrada", "Quantidade": 1, "Custo Unitário": 1.0, "Preço de Venda": 0.0,
+        })
+    return agregados
+
+
+def test_cache_lru_por_entradas():
+    cache = CacheResultados(max_entradas=2)
+    calculos = []
+    for chave in ["a", "b", "a", "c", "a", "b"]:
+        cache.obter((chave,), lambda: calculos.append(chave) or chave)
+    # "b" sai quando "c" entra, já que "a" foi usado por último
+    assert calculos == ["a", "b", "c", "b"]
+    assert (cache.acertos, cache.falhas) == (2, 4)
+
+
+def test_agregados_medidos_pelos_produtos():
+    agregados = _agregados(2000)
+    # Ao menos um dicionário de totais por produto
+    assert tamanho_aproximado(agregados) >= 2000 * 200
+
+
+def test_figura_medida_pelos_tracos():
+    figura = px.line(_pontos(5000), x="Data", y="Quantidade")
+    # Ao menos os arrays de datas e quantidades
+    assert tamanho_aproximado(figura) >= 2 * 5000 * 8
+
+
+def test_cache_limitado_pelo_tamanho_das_figuras():
+    pontos = _pontos(5000)
+    cache = CacheResultados(max_bytes=3 * tamanho_aproximado(px.line(pontos, x="Data", y="Quantidade")))
+    for i in range(10):
+        cache.obter(("figura", i), lambda: px.line(pontos, x="Data", y="Quantidade"))
+    assert len(cache) == 3
+
+
+def test_resumo_medido_pelos_nomes_dos_produtos():
+    agregados = _agregados(2000)
+    resumo = agregados.resumir()
+    assert tamanho_aproximado(resumo) >= resumo.por_produto.memory_usage(index=True, deep=True).sum()
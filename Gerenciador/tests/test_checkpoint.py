@@ -0,0 +1,143 @@
+import os
+
+import pytest
+
+from armazenamento import LIMITE_ARQUIVOS_PARTICAO, criar_backend
+from estoque import EstoqueCompartilhado
+from sintetico import gerar_movimentacoes
+
+BACKENDS = ["sqlite", "parquet"]
+
+
+@pytest.fixture
+def livro():
+    return gerar_movimentacoes(4000, produtos=12, dias=200, semente=5).astype({"Produto": str, "Tipo": str})
+
+
+def reabrir(tipo, caminho):
+    return EstoqueCompartilhado(criar_backend(tipo, caminho), intervalo_checkpoint=10**9)
+
+
+def reconstruido(tipo, caminho):
+    backend = criar_backend(tipo, caminho)
+    os.unlink(backend.caminho_checkpoint)
+    return EstoqueCompartilhado(backend, intervalo_checkpoint=10**9)
+
+
+@pytest.mark.parametrize("tipo", BACKENDS)
+def test_reabrir_sem_cauda(tipo, tmp_path, livro, reconstrucoes, comparar_estoques):
+    caminho = str(tmp_path / "livro")
+    estoque = reabrir(tipo, caminho)
+    estoque.importar([livro])
+    estoque.salvar_checkpoint()
+
+    reaberto = reabrir(tipo, caminho)
+    assert reaberto not in reconstrucoes
+    comparar_estoques(reaberto, estoque)
+
+
+@pytest.mark.parametrize("tipo", BACKENDS)
+def test_reabrir_reaplica_a_cauda(tipo, tmp_path, livro, reconstrucoes, comparar_estoques):
+    caminho = str(tmp_path / "livro")
+    estoque = reabrir(tipo, caminho)
+    estoque.importar([livro.iloc[:2500]])
+    estoque.salvar_checkpoint()
+    # Cauda com gravações avulsas e um lote importado
+    for registro in livro.iloc[2500:2510].to_dict("records"):
+        estoque.adicionar(registro)
+    estoque.importar([livro.iloc[2510:]])
+
+    reaberto = reabrir(tipo, caminho)
+    assert reaberto not in reconstrucoes
+    comparar_estoques(reaberto, estoque)
+    comparar_estoques(reaberto, reconstruido(tipo, caminho))
+
+
+@pytest.mark.parametrize("tipo", BACKENDS)
+def test_checkpoint_automatico(tipo, tmp_path, livro, reconstrucoes, comparar_estoques):
+    caminho = str(tmp_path / "livro")
+    estoque = EstoqueCompartilhado(criar_backend(tipo, caminho), intervalo_checkpoint=1000)
+    for inicio in range(0, len(livro), 700):
+        estoque.importar([livro.iloc[inicio:inicio + 700]])
+
+    reaberto = reabrir(tipo, caminho)
+    assert reaberto not in reconstrucoes
+    comparar_estoques(reaberto, reconstruido(tipo, caminho))
+
+
+@pytest.mark.parametrize("tipo", BACKENDS)
+def test_limpar_descarta_checkpoint(tipo, tmp_path, livro, reconstrucoes):
+    caminho = str(tmp_path / "livro")
+    estoque = reabrir(tipo, caminho)
+    estoque.importar([livro])
+    estoque.salvar_checkpoint()
+    estoque.limpar()
+
+    reaberto = reabrir(tipo, caminho)
+    assert len(reaberto.agregados) == 0
+    assert reaberto.cmv().empty
+
+
+@pytest.mark.parametrize("tipo", BACKENDS)
+def test_checkpoint_de_livro_reescrito(tipo, tmp_path, livro, reconstrucoes, comparar_estoques):
+    """Um checkpoint guardado de antes de o livro ser limpo não vale para o livro novo."""
+    caminho = str(tmp_path / "livro")
+    backend = criar_backend(tipo, caminho)
+    estoque = EstoqueCompartilhado(backend, intervalo_checkpoint=10**9)
+    estoque.importar([livro.iloc[:2000]])
+    estoque.salvar_checkpoint()
+    with open(backend.caminho_checkpoint, "rb") as arquivo:
+        antigo = arquivo.read()
+    estoque.limpar()
+    estoque.importar([livro.iloc[2000:]])
+    with open(backend.caminho_checkpoint, "wb") as arquivo:
+        arquivo.write(antigo)
+
+    reaberto = reabrir(tipo, caminho)
+    assert reaberto in reconstrucoes
+    comparar_estoques(reaberto, estoque)
+
+
+def test_compactar_parquet(tmp_path, livro, reconstrucoes, comparar_estoques):
+    caminho = str(tmp_path / "livro")
+    estoque = reabrir("parquet", caminho)
+    for inicio in range(0, len(livro), 500):
+        estoque.importar([livro.iloc[inicio:inicio + 500]])
+    estoque.salvar_checkpoint()
+    estoque.backend.compactar()
+
+    reaberto = reabrir("parquet", caminho)
+    assert reaberto in reconstrucoes
+    comparar_estoques(reaberto, estoque)
+
+
+def test_compactacao_automatica_regrava_o_checkpoint(tmp_path, livro, reconstrucoes, comparar_estoques):
+    """Gravações avulsas que compactam a partição mudam a geração; o checkpoint é refeito na hora."""
+    caminho = str(tmp_path / "livro")
+    estoque = reabrir("parquet", caminho)
+    estoque.importar([livro.iloc[:2000]])
+    estoque.salvar_checkpoint()
+    geracao = estoque.backend.posicao_diario().geracao
+    registro = livro.iloc[0].to_dict()
+    for _ in range(LIMITE_ARQUIVOS_PARTICAO):
+        estoque.adicionar(registro)
+    assert estoque.backend.posicao_diario().geracao > geracao
+
+    reaberto = reabrir("parquet", caminho)
+    assert reaberto not in reconstrucoes
+    comparar_estoques(reaberto, estoque)
+    comparar_estoques(reaberto, reconstruido("parquet", caminho))
+
+
+@pytest.mark.parametrize("tipo", BACKENDS)
+def test_checkpoint_ilegivel(tipo, tmp_path, livro, reconstrucoes, comparar_estoques):
+    caminho = str(tmp_path / "livro")
+    estoque = reabrir(tipo, caminho)
+    estoque.importar([livro])
+    estoque.salvar_checkpoint()
+    with open(estoque.backend.caminho_checkpoint, "r+b") as arquivo:
+        arquivo.truncate(100)
+
+    reaberto = reabrir(tipo, caminho)
+    assert reaberto in reconstrucoes
+    comparar_estoques(reaberto, estoque)
@@ -0,0 +1,271 @@
+import os
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from armazenamento import FiltroMovimentacoes, criar_backend
+from estoque import EstoqueCompartilhado
+from ledger import LedgerMovimentacoes
+from sintetico import gerar_movimentacoes
+
+BACKENDS = ["memoria", "sqlite", "parquet"]
+
+
+@pytest.fixture
+def livro():
+    return gerar_movimentacoes(3000, produtos=20, dias=200, semente=3).astype({"Produto": str, "Tipo": str})
+
+
+def corrigir_ao_acaso(estoque, ids, produtos, semente, vezes=40):
+    """Edições e remoções aleatórias; retorna as aceitas (Correcao), ignorando as que o estoque recusa."""
+    rnd = random.Random(semente)
+    aceitas = []
+    for _ in range(vezes):
+        id_registro = rnd.choice(ids)
+        registro = estoque.registro(id_registro)
+        if registro is None:
+            continue
+        try:
+            if rnd.random() < 0.4:
+                aceitas.append(estoque.remover(id_registro))
+            else:
+                novo = dict(
+                    registro,
+                    Quantidade=max(1, registro["Quantidade"] + rnd.randint(-5, 5)),
+                    Data=registro["Data"].normalize() + pd.Timedelta(days=rnd.randint(-40, 40)),
+                )
+                if rnd.random() < 0.3:
+                    novo["Produto"] = rnd.choice(produtos)
+                aceitas.append(estoque.editar(id_registro, novo))
+        except ValueError:
+            pass
+    return aceitas
+
+
+def reconstruido(backend):
+    if backend.caminho_checkpoint is not None:
+        os.unlink(backend.caminho_checkpoint)
+    return EstoqueCompartilhado(backend, intervalo_checkpoint=10**9)
+
+
+# ==================== IDs dos registros ====================
+
+@pytest.mark.parametrize("tipo", BACKENDS)
+def test_ids_estaveis(tipo, tmp_path, livro):
+    backend = criar_backend(tipo, str(tmp_path / "livro"))
+    backend.adicionar_lote(livro.iloc[:2000])
+    backend.adicionar(livro.iloc[2000].to_dict())
+    backend.adicionar_lote(livro.iloc[2001:])
+    df = backend.consultar()
+    assert df.index.name == "ID" and df.index.is_unique and len(df) == len(livro)
+    ids = list(df.index)
+
+    alvo = ids[50]
+    original = backend.registro(alvo)
+    assert original["Quantidade"] == df.loc[alvo, "Quantidade"]
+    novo = dict(original, Quantidade=original["Quantidade"] + 7, Data=original["Data"] + pd.Timedelta(days=45))
+    backend.substituir(alvo, novo)
+    assert backend.registro(alvo)["Quantidade"] == novo["Quantidade"]
+
+    removido = ids[10]
+    antes = backend.registro(removido)
+    backend.remover(removido)
+    assert backend.registro(removido) is None
+    assert len(backend) == len(livro) - 1
+    assert removido not in backend.consultar().index
+    assert removido not in backend.consultar(FiltroMovimentacoes(produtos=(antes["Produto"],))).index
+
+    # Registros novos não reaproveitam o ID removido
+    backend.adicionar(livro.iloc[0].to_dict())
+    novos = set(backend.consultar().index) - set(ids)
+    assert len(novos) == 1 and novos.pop() > max(ids)
+
+    backend.restaurar(removido, antes)
+    assert backend.registro(removido) == antes
+    assert set(ids) <= set(pd.concat(list(backend.varrer())).index)
+    if tipo == "parquet":
+        backend.compactar()
+        assert backend.registro(alvo)["Quantidade"] == novo["Quantidade"]
+        assert set(ids) <= set(backend.consultar().index)
+
+
+def conferir_filtros(ledger, produtos, rnd):
+    completo = ledger.dataframe()
+    for _ in range(10):
+        inicio = pd.Timestamp("2024-01-01") + pd.Timedelta(days=rnd.randrange(200))
+        fim = inicio + pd.Timedelta(days=rnd.choice([1, 5, 30]))
+        escolhidos = rnd.sample(produtos, rnd.choice([1, 2]))
+        obtido = ledger.filtrar(inicio, fim, escolhidos)
+        esperado = completo[
+            (completo["Data"] >= inicio) & (completo["Data"] <= fim) & completo["Produto"].isin(escolhidos)
+        ]
+        assert np.array_equal(np.sort(obtido.index.to_numpy()), esperado.index.to_numpy())
+
+
+def test_indices_do_ledger_apos_substituir():
+    """As edições reposicionam a linha nos índices por data e produto sem refazê-los."""
+    # Grande o bastante para que as linhas acrescentadas fiquem no nível delta do índice
+    livro = gerar_movimentacoes(12000, produtos=20, dias=200, semente=3).astype({"Produto": str, "Tipo": str})
+    ledger = LedgerMovimentacoes()
+    ledger.estender(livro)
+    produtos = sorted(livro["Produto"].unique())
+    rnd = random.Random(7)
+    # Os índices são montados na primeira consulta; as edições seguintes os corrigem
+    conferir_filtros(ledger, produtos, rnd)
+    for rodada in range(300):
+        posicao = rnd.randrange(len(ledger) + len(ledger.removidos))
+        registro = ledger.registro(posicao)
+        if registro is None:
+            continue
+        registro["Data"] += pd.Timedelta(days=rnd.randint(-60, 60), hours=rnd.randint(0, 23))
+        if rnd.random() < 0.5:
+            registro["Produto"] = rnd.choice(produtos)
+        ledger.substituir(posicao, registro)
+        if rnd.random() < 0.1:
+            ledger.remover(rnd.randrange(len(livro)))
+        if rnd.random() < 0.05:
+            ledger.adicionar(registro)
+        if rodada % 50 == 0:
+            conferir_filtros(ledger, produtos, rnd)
+    conferir_filtros(ledger, produtos, rnd)
+
+
+def test_intervalo_datas_do_ledger_com_removidos(livro):
+    """Remoções nas pontas mudam o intervalo de datas, lido do índice sem montar o DataFrame."""
+    ledger = LedgerMovimentacoes()
+    ledger.estender(livro.iloc[:2000])
+    ledger.estender(livro.iloc[2000:])
+    rnd = random.Random(11)
+    ordem = livro.sort_values("Data", kind="stable").index.tolist()
+    removidos = ordem[:30] + ordem[-30:] + rnd.sample(ordem, 200)
+    for posicao in removidos:
+        ledger.remover(posicao)
+        ativos = livro["Data"].drop(index=list(ledger.removidos))
+        assert ledger.intervalo_datas() == (ativos.min().date(), ativos.max().date())
+        assert ledger._df_ativos is None
+    ledger.substituir(ordem[0], livro.loc[ordem[0]].to_dict())
+    ativos = livro["Data"].drop(index=list(ledger.removidos))
+    assert ledger.intervalo_datas() == (ativos.min().date(), ativos.max().date())
+    assert np.array_equal(ledger._posicoes_removidas, np.sort(list(ledger.removidos)))
+    for posicao in list(ledger.removidos):
+        ledger.remover(posicao)
+    for posicao in range(len(livro)):
+        ledger.remover(posicao)
+    assert ledger.intervalo_datas() == (None, None)
+
+
+# ==================== Correções no estoque compartilhado ====================
+
+@pytest.mark.parametrize("tipo", BACKENDS)
+def test_corrigir_e_desfazer(tipo, tmp_path, livro, comparar_estoques):
+    backend = criar_backend(tipo, str(tmp_path / "livro"))
+    backend.adicionar_lote(livro)
+    estoque = EstoqueCompartilhado(backend, intervalo_checkpoint=10**9)
+    ids = list(backend.consultar().index)
+    correcoes = corrigir_ao_acaso(estoque, ids, sorted(livro["Produto"].unique()), semente=1)
+    assert len(correcoes) > 10
+    # Da mais recente para a mais antiga, como no app
+    for correcao in reversed(correcoes[-8:]):
+        estoque.desfazer(correcao)
+    comparar_estoques(estoque, reconstruido(backend))
+
+
+def test_desfazer_restaura_o_registro(tmp_path, livro, comparar_estoques):
+    backend = criar_backend("sqlite", str(tmp_path / "livro"))
+    backend.adicionar_lote(livro)
+    estoque = EstoqueCompartilhado(backend, intervalo_checkpoint=10**9)
+    inicial = reconstruido(criar_backend("sqlite", str(tmp_path / "livro")))
+    id_registro = int(backend.consultar().index[100])
+    original = estoque.registro(id_registro)
+    edicao = estoque.editar(id_registro, dict(original, **{"Preço de Venda": original["Preço de Venda"] + 1}))
+    remocao = estoque.remover(id_registro)
+    assert (edicao.operacao, remocao.operacao) == ("edição", "remoção")
+    # Fora de ordem: o registro já não está como a edição o deixou
+    assert not estoque.correcao_vigente(edicao)
+    with pytest.raises(ValueError):
+        estoque.desfazer(edicao)
+    estoque.desfazer(remocao)
+    estoque.desfazer(edicao)
+    assert estoque.registro(id_registro) == original
+    comparar_estoques(estoque, inicial)
+
+
+def test_desfazer_correcao_alterada_por_outra_sessao(livro):
+    """Cada sessão guarda as próprias correções; a de uma não desfaz por cima da outra."""
+    estoque = EstoqueCompartilhado(criar_backend("memoria"), intervalo_checkpoint=10**9)
+    estoque.importar([livro])
+    id_registro = int(estoque.backend.consultar().index[100])
+    original = estoque.registro(id_registro)
+    da_sessao_a = estoque.editar(id_registro, dict(original, **{"Preço de Venda": original["Preço de Venda"] + 1}))
+    da_sessao_b = estoque.editar(id_registro, dict(original, **{"Preço de Venda": original["Preço de Venda"] + 2}))
+
+    assert estoque.correcao_vigente(da_sessao_b) and not estoque.correcao_vigente(da_sessao_a)
+    with pytest.raises(ValueError):
+        estoque.desfazer(da_sessao_a)
+    assert estoque.registro(id_registro)["Preço de Venda"] == original["Preço de Venda"] + 2
+    estoque.desfazer(da_sessao_b)
+    assert estoque.registro(id_registro)["Preço de Venda"] == original["Preço de Venda"] + 1
+
+
+def test_limpar_invalida_correcoes(livro):
+    estoque = EstoqueCompartilhado(criar_backend("memoria"), intervalo_checkpoint=10**9)
+    estoque.importar([livro])
+    df = estoque.backend.consultar()
+    remocao = estoque.remover(int(df.index[df["Tipo"] == "saída"][0]))
+    estoque.limpar()
+
+    assert not estoque.correcao_vigente(remocao)
+    with pytest.raises(ValueError):
+        estoque.desfazer(remocao)
+    assert len(estoque.agregados) == 0
+
+
+@pytest.mark.parametrize("tipo", BACKENDS)
+def test_correcao_recusada_nao_altera_nada(tipo, tmp_path, livro, comparar_estoques):
+    backend = criar_backend(tipo, str(tmp_path / "livro"))
+    backend.adicionar_lote(livro)
+    estoque = EstoqueCompartilhado(backend, intervalo_checkpoint=10**9)
+    df = backend.consultar()
+    id_registro = df.index[df["Tipo"] == "saída"][0]
+    registro = estoque.registro(id_registro)
+    with pytest.raises(ValueError):
+        estoque.editar(id_registro, dict(registro, Quantidade=10**6))
+    assert estoque.registro(id_registro) == registro
+    comparar_estoques(estoque, reconstruido(backend))
+
+
+# ==================== Correções reaplicadas do diário ====================
+
+@pytest.mark.parametrize("tipo", ["sqlite", "parquet"])
+def test_correcoes_reaplicadas_ao_reabrir(tipo, tmp_path, livro, reconstrucoes, comparar_estoques):
+    caminho = str(tmp_path / "livro")
+    estoque = EstoqueCompartilhado(criar_backend(tipo, caminho), intervalo_checkpoint=10**9)
+    estoque.importar([livro.iloc[:2500]])
+    estoque.salvar_checkpoint()
+    estoque.importar([livro.iloc[2500:]])
+    # Corrige registros de antes e de depois do checkpoint, e desfaz parte das correções
+    ids = list(estoque.backend.consultar().index)
+    correcoes = corrigir_ao_acaso(estoque, ids, sorted(livro["Produto"].unique()), semente=2)
+    assert len(correcoes) > 10
+    for correcao in reversed(correcoes[-5:]):
+        estoque.desfazer(correcao)
+
+    reaberto = EstoqueCompartilhado(criar_backend(tipo, caminho), intervalo_checkpoint=10**9)
+    assert reaberto not in reconstrucoes
+    comparar_estoques(reaberto, estoque)
+    comparar_estoques(reaberto, reconstruido(criar_backend(tipo, caminho)))
+
+
+@pytest.mark.parametrize("tipo", ["sqlite", "parquet"])
+def test_correcao_nao_regrava_checkpoint(tipo, tmp_path, livro):
+    caminho = str(tmp_path / "livro")
+    estoque = EstoqueCompartilhado(criar_backend(tipo, caminho), intervalo_checkpoint=10**9)
+    estoque.importar([livro])
+    estoque.salvar_checkpoint()
+    gravado = os.stat(estoque.backend.caminho_checkpoint).st_mtime_ns
+    id_registro = int(estoque.backend.consultar().index[0])
+    registro = estoque.registro(id_registro)
+    estoque.desfazer(estoque.editar(id_registro, dict(registro, **{"Preço de Venda": registro["Preço de Venda"] + 1})))
+    assert os.stat(estoque.backend.caminho_checkpoint).st_mtime_ns == gravado
@@ -0,0 +1,100 @@
+import io
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from exportacao import FORMATOS, exportar, fatiar, nome_relatorio
+from ledger import aplicar_esquema
+
+
+@pytest.fixture
+def movimentacoes():
+    rng = np.random.default_rng(0)
+    n = 1000
+    saida = rng.random(n) < 0.4
+    return aplicar_esquema(pd.DataFrame({
+        "Data": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 200, n), unit="D"),
+        "Produto": rng.choice(["arroz", "feijão", "café"], n),
+        "Tipo": np.where(saida, "saída", "entrada"),
+        "Quantidade": rng.integers(1, 50, n),
+        "Custo Unitário": np.where(saida, 0.0, 2.5),
+        "Preço de Venda": np.where(saida, 4.75, 0.0),
+    }))
+
+
+@pytest.fixture
+def resumo(movimentacoes):
+    return movimentacoes.groupby("Produto", observed=True)[["Quantidade"]].sum()
+
+
+def _ler(formato, conteudo):
+    if formato == "Excel":
+        return pd.read_excel(conteudo, sheet_name=None)
+    if formato == "CSV":
+        return {"Dados": pd.read_csv(conteudo, encoding="utf-8-sig")}
+    return {"Dados": pd.read_parquet(conteudo)}
+
+
+@pytest.mark.parametrize("formato", list(FORMATOS))
+def test_um_bloco_igual_a_varios_blocos(formato, movimentacoes, resumo):
+    inteiro = exportar(formato, [movimentacoes], resumo)
+    fatiado = exportar(formato, fatiar(movimentacoes, 70), resumo)
+
+    if formato == "Excel":
+        # O zip guarda a hora da gravação; o conteúdo das planilhas é que deve coincidir
+        esperado, obtido = _ler(formato, inteiro), _ler(formato, fatiado)
+        assert esperado.keys() == obtido.keys() == {"Dados", "Resumo"}
+        for planilha in esperado:
+            pd.testing.assert_frame_equal(obtido[planilha], esperado[planilha])
+    elif formato == "CSV":
+        assert fatiado.getvalue() == inteiro.getvalue()
+    else:
+        assert pq.ParquetFile(fatiado).metadata.num_row_groups == 15
+        pd.testing.assert_frame_equal(_ler(formato, fatiado)["Dados"], _ler(formato, inteiro)["Dados"])
+
+
+@pytest.mark.parametrize("formato", list(FORMATOS))
+def test_conteudo_exportado(formato, movimentacoes, resumo):
+    dados = _ler(formato, exportar(formato, fatiar(movimentacoes, 300), resumo))["Dados"]
+
+    assert list(dados.columns) == list(movimentacoes.columns)
+    assert len(dados) == len(movimentacoes)
+    assert pd.to_datetime(dados["Data"]).tolist() == movimentacoes["Data"].tolist()
+    assert dados["Produto"].astype(str).tolist() == movimentacoes["Produto"].astype(str).tolist()
+    assert dados["Preço de Venda"].tolist() == movimentacoes["Preço de Venda"].tolist()
+
+
+@pytest.mark.parametrize("formato", list(FORMATOS))
+def test_exportacao_sem_arquivos_temporarios(formato, movimentacoes, resumo, monkeypatch, tmp_path):
+    # Qualquer arquivo temporário falharia: a pasta configurada não existe
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path / "inexistente"))
+    destino = exportar(formato, fatiar(movimentacoes, 300), resumo)
+    assert destino.tell() == 0 and len(destino.getvalue()) > 0
+
+
+def test_livro_vazio(movimentacoes):
+    vazio = movimentacoes.iloc[:0]
+    assert len(list(fatiar(vazio))) == 1
+    dados = pd.read_csv(exportar("CSV", fatiar(vazio)), encoding="utf-8-sig")
+    assert dados.empty and list(dados.columns) == list(movimentacoes.columns)
+
+
+def test_formato_desconhecido(movimentacoes):
+    with pytest.raises(ValueError):
+        exportar("ODS", [movimentacoes])
+    assert nome_relatorio("Parquet", pd.Timestamp("2024-05-06 07:08:09")) == (
+        "Relatorio_Controle_Mercadorias_2024-05-06_07-08-09.parquet"
+    )
+
+
+def test_parquet_com_dicionario_diferente_em_cada_bloco(movimentacoes):
+    # Cada bloco lido do armazenamento traz o próprio dicionário de Produto; o segundo precisa de índice int16
+    muitos = movimentacoes.assign(Produto=[f"produto {i}" for i in range(len(movimentacoes))])
+    blocos = [movimentacoes.iloc[:100], aplicar_esquema(muitos.iloc[100:])]
+    lido = pd.read_parquet(exportar("Parquet", iter(blocos), None))
+    esperado = pd.concat([bloco.astype({"Produto": str}) for bloco in blocos], ignore_index=True)
+    assert lido["Produto"].astype(str).tolist() == esperado["Produto"].tolist()
+    assert len(lido) == len(movimentacoes)
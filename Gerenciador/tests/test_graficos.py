@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+from graficos import LIMITE_WEBGL, lttb, reduzir_barras, reduzir_serie, usar_webgl
+
+
+def _lttb_referencia(x, y, n_pontos):
+    """LTTB ponto a ponto, como na descrição original do algoritmo."""
+    bordas = np.linspace(1, len(x) - 1, n_pontos - 1).astype(int)
+    escolhidos = [0]
+    for i in range(n_pontos - 2):
+        proximo = range(bordas[i + 1], bordas[i + 2]) if i + 2 < len(bordas) else [len(x) - 1]
+        media_x = np.mean([x[j] for j in proximo])
+        media_y = np.mean([y[j] for j in proximo])
+        a = escolhidos[-1]
+        areas = [
+            abs((x[a] - media_x) * (y[j] - y[a]) - (x[a] - x[j]) * (media_y - y[a]))
+            for j in range(bordas[i], bordas[i + 1])
+        ]
+        escolhidos.append(bordas[i] + int(np.argmax(areas)))
+    return escolhidos + [len(x) - 1]
+
+
+def test_lttb_igual_a_referencia():
+    rng = np.random.default_rng(0)
+    x = np.sort(rng.choice(100_000, 5000, replace=False)).astype(float)
+    y = np.cumsum(rng.normal(size=5000))
+    escolhidos = lttb(x, y, 300)
+    assert escolhidos.tolist() == _lttb_referencia(x, y, 300)
+    assert len(escolhidos) == 300 and np.all(np.diff(escolhidos) > 0)
+
+
+def test_lttb_mantem_picos():
+    y = np.zeros(10_000)
+    y[[1234, 5678]] = [50.0, -80.0]
+    escolhidos = lttb(np.arange(10_000), y, 100)
+    assert {0, 1234, 5678, 9999} <= set(escolhidos.tolist())
+
+
+def test_lttb_serie_curta_sem_reducao():
+    assert lttb(np.arange(10), np.arange(10), 50).tolist() == list(range(10))
+
+
+def test_reduzir_serie_por_tipo():
+    datas = pd.date_range("2020-01-01", periods=3000)
+    serie = pd.concat([
+        pd.DataFrame({"Data": datas, "Tipo": "entrada", "Quantidade": np.arange(3000)}),
+        pd.DataFrame({"Data": datas, "Tipo": "saída", "Quantidade": -np.arange(3000)}),
+    ], ignore_index=True)
+    reduzida = reduzir_serie(serie, max_pontos=200)
+    assert reduzida.groupby("Tipo").size().to_dict() == {"entrada": 200, "saída": 200}
+    assert reduzida.groupby("Tipo")["Data"].agg(["min", "max"]).eq([datas[0], datas[-1]]).all().all()
+    pd.testing.assert_frame_equal(reduzir_serie(serie.iloc[:100], max_pontos=200), serie.iloc[:100])
+
+
+def test_reduzir_barras_agrupa_o_restante_em_outros():
+    resumo = pd.DataFrame(
+        {"Entradas": np.arange(50) * 10, "Saídas": -np.arange(50)},
+        index=pd.Index([f"produto {i}" for i in range(50)], name="Produto"),
+    )
+    barras = reduzir_barras(resumo, ["Entradas", "Saídas"], max_barras=6)
+
+    assert list(barras.index) == [f"produto {i}" for i in range(49, 44, -1)] + ["Outros (45)"]
+    assert barras.index.name == "Produto"
+    # Nenhuma quantidade se perde no agrupamento
+    pd.testing.assert_series_equal(barras.sum(), resumo.sum())
+
+
+def test_reduzir_barras_dentro_do_limite():
+    resumo = pd.DataFrame({"Entradas": [1, 2], "Saídas": [0, 1], "Lucro": [0.0, 0.0]}, index=["a", "b"])
+    pd.testing.assert_frame_equal(reduzir_barras(resumo, ["Entradas", "Saídas"]), resumo[["Entradas", "Saídas"]])
+
+
+def test_webgl_acima_do_limite():
+    assert not usar_webgl(LIMITE_WEBGL) and usar_webgl(LIMITE_WEBGL + 1)
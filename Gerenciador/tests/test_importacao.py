@@ -0,0 +1,138 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from agregados import AgregadosEstoque
+from armazenamento import BackendMemoria
+from importacao import importar_movimentacoes, ler_csv_em_blocos, validar_bloco
+from ledger import QUANTIDADE_MAXIMA
+from saldos import LinhaTempoSaldos
+
+
+def saldos_ao_fim_do_dia(df):
+    """Saldo de cada produto ao fim de cada dia com movimentações."""
+    movimento = df["Quantidade"].where(df["Tipo"] == "entrada", -df["Quantidade"])
+    por_dia = movimento.groupby([df["Produto"], df["Data"].dt.normalize()], observed=True).sum()
+    return por_dia.groupby(level=0, observed=True).cumsum()
+
+
+def aceitos_pelo_formulario(df, saldos):
+    """Referência: as linhas inseridas uma a uma pelo formulário, em ordem de data.
+
+    No mesmo dia as entradas vêm antes das saídas, já que só o saldo ao fim do
+    dia é guardado. Retorna os rótulos das linhas aceitas.
+    """
+    ordem = df.assign(Dia=df["Data"].dt.normalize(), Saida=df["Tipo"] == "saída")
+    ordem = ordem.sort_values(["Dia", "Saida"], kind="stable")
+    aceitos = []
+    for rotulo, linha in ordem.iterrows():
+        registro = linha[["Data", "Produto", "Tipo", "Quantidade"]].to_dict()
+        if registro["Tipo"] == "saída" and registro["Quantidade"] > saldos.disponivel(registro["Produto"], registro["Data"]):
+            continue
+        saldos.adicionar(registro)
+        aceitos.append(rotulo)
+    return sorted(aceitos)
+
+
+@pytest.fixture(params=[0, 1])
+def bloco(request):
+    """Movimentações em ordem aleatória de data, com parte das saídas grandes demais para o estoque."""
+    rng = np.random.default_rng(request.param)
+    n = 2000
+    produtos = rng.integers(0, 8, n)
+    saida = rng.random(n) < 0.45
+    quantidade = rng.integers(1, 30, n) * np.where(saida & (rng.random(n) < 0.2), 6, 1)
+    return pd.DataFrame({
+        "Data": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 90 * 24, n), unit="h"),
+        "Produto": [f"produto {p}" for p in produtos],
+        "Tipo": np.where(saida, "saída", "entrada"),
+        "Quantidade": quantidade,
+        "Custo Unitário": np.where(saida, 0.0, 1.0 + produtos),
+        "Preço de Venda": np.where(saida, 3.0 + produtos, 0.0),
+    })
+
+
+def test_saidas_validadas_em_ordem_de_data(bloco):
+    aceitos, rejeitados = validar_bloco(bloco, AgregadosEstoque(), LinhaTempoSaldos())
+    assert sorted(aceitos.index) == aceitos_pelo_formulario(bloco, LinhaTempoSaldos())
+    assert len(rejeitados) and set(rejeitados["Motivo"]) == {"Estoque insuficiente para a saída"}
+    assert (saldos_ao_fim_do_dia(aceitos) >= 0).all()
+
+
+def test_bloco_retroativo(bloco):
+    """Saídas com data anterior ao livro existente não podem consumir o estoque que ele já usa."""
+    existente = bloco[bloco["Data"] >= "2024-02-15"]
+    existente = existente[existente["Tipo"] == "entrada"]
+    existente = pd.concat([existente, existente.assign(Tipo="saída", Quantidade=existente["Quantidade"] // 2)])
+    agregados = AgregadosEstoque()
+    agregados.adicionar_lote(existente)
+    retroativo = bloco[bloco["Data"] < "2024-02-15"]
+
+    aceitos, _ = validar_bloco(retroativo, agregados, LinhaTempoSaldos.de_dataframe(existente))
+    assert sorted(aceitos.index) == aceitos_pelo_formulario(retroativo, LinhaTempoSaldos.de_dataframe(existente))
+    assert (saldos_ao_fim_do_dia(pd.concat([existente, aceitos])) >= 0).all()
+
+
+def test_regras_do_formulario():
+    bloco = pd.DataFrame({
+        "Data": ["2024-01-01", "31/01/2024", "ontem", "2024-01-02", "2024-01-02", "2024-01-03", "2024-01-03", "2024-01-04"],
+        "Produto": ["A ", "a", "a", "", "a", "a", "b", "a"],
+        "Tipo": ["entrada", "saida", "entrada", "entrada", "devolução", "entrada", "saída", "entrada"],
+        "Quantidade": [10, 3, 1, 1, 1, 2.5, 1, 1],
+        "Custo Unitário": [2.0, 0.0, 2.0, 2.0, 2.0, 2.0, 0.0, 3.0],
+        "Preço de Venda": [0.0, 5.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],
+    })
+    aceitos, rejeitados = validar_bloco(bloco, AgregadosEstoque(), LinhaTempoSaldos())
+
+    assert aceitos["Produto"].tolist() == ["a", "a"]
+    assert aceitos["Tipo"].tolist() == ["entrada", "saída"]
+    assert aceitos["Data"].tolist() == [pd.Timestamp("2024-01-01"), pd.Timestamp("2024-01-31")]
+    assert rejeitados["Motivo"].tolist() == [
+        "Data inválida",
+        "O campo 'Produto' não pode estar vazio",
+        "Tipo deve ser 'entrada' ou 'saída'",
+        "A quantidade deve ser um inteiro maior que 0",
+        "O 'Preço de Venda' deve ser maior que 0 para saídas",
+        "Custo Unitário diferente do já registrado para o produto",
+    ]
+
+
+def test_datas_gravadas_sem_hora():
+    """Como no SQLite e no formulário, só o dia da movimentação é guardado."""
+    bloco = pd.DataFrame({
+        "Data": ["2024-01-01T15:30:00", "2024-01-02 08:00"], "Produto": ["a", "a"], "Tipo": ["entrada", "entrada"],
+        "Quantidade": [1, 1], "Custo Unitário": [1.0, 1.0], "Preço de Venda": [0.0, 0.0],
+    })
+    aceitos, _ = validar_bloco(bloco, AgregadosEstoque(), LinhaTempoSaldos())
+    assert aceitos["Data"].tolist() == [pd.Timestamp("2024-01-01"), pd.Timestamp("2024-01-02")]
+
+
+def test_quantidade_acima_da_coluna():
+    registro = {
+        "Data": "2024-01-01", "Produto": "a", "Tipo": "entrada",
+        "Quantidade": QUANTIDADE_MAXIMA, "Custo Unitário": 1.0, "Preço de Venda": 0.0,
+    }
+    bloco = pd.DataFrame([registro, dict(registro, Quantidade=QUANTIDADE_MAXIMA + 1)])
+    aceitos, rejeitados = validar_bloco(bloco, AgregadosEstoque(), LinhaTempoSaldos())
+    assert aceitos["Quantidade"].tolist() == [QUANTIDADE_MAXIMA]
+    assert rejeitados["Motivo"].str.startswith("A quantidade deve ser no máximo").all()
+
+
+def test_importar_csv_em_blocos(bloco):
+    arquivo = io.StringIO(bloco.to_csv(index=False))
+    backend = BackendMemoria()
+    agregados = AgregadosEstoque()
+    saldos = LinhaTempoSaldos()
+    total, rejeitados = importar_movimentacoes(
+        ler_csv_em_blocos(arquivo, tamanho_bloco=700), backend, agregados, saldos
+    )
+
+    assert total == len(backend) and total + len(rejeitados) == len(bloco)
+    # Linha do arquivo contando o cabeçalho como linha 1
+    assert (rejeitados["Quantidade"].to_numpy() == bloco["Quantidade"].to_numpy()[rejeitados["Linha"] - 2]).all()
+    pd.testing.assert_frame_equal(
+        agregados.resumo(), AgregadosEstoque.de_dataframe(backend.consultar()).resumo(), check_dtype=False
+    )
+    assert (saldos_ao_fim_do_dia(backend.consultar()) >= 0).all()
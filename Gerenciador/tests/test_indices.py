@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from indices import LIMITE_DELTA
+from ledger import LedgerMovimentacoes
+
+PRODUTOS = [f"produto {i}" for i in range(40)]
+
+
+def _movimentacoes(n, semente):
+    rng = np.random.default_rng(semente)
+    saida = rng.random(n) < 0.4
+    return pd.DataFrame({
+        "Data": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 365, n), unit="D"),
+        "Produto": rng.choice(PRODUTOS, n),
+        "Tipo": np.where(saida, "saída", "entrada"),
+        "Quantidade": rng.integers(1, 50, n),
+        "Custo Unitário": np.where(saida, 0.0, 2.0),
+        "Preço de Venda": np.where(saida, 3.0, 0.0),
+    })
+
+
+def _filtros(semente, quantidade=30):
+    rng = np.random.default_rng(semente)
+    filtros = [{}, {"produtos": ("inexistente",)}, {"inicio": pd.Timestamp("2030-01-01")}]
+    for _ in range(quantidade):
+        filtro = {}
+        if rng.random() < 0.6:
+            dias = np.sort(rng.integers(-10, 375, 2))
+            filtro["inicio"] = pd.Timestamp("2024-01-01") + pd.Timedelta(days=int(dias[0]))
+            if rng.random() < 0.7:
+                filtro["fim"] = pd.Timestamp("2024-01-01") + pd.Timedelta(days=int(dias[1]))
+        if rng.random() < 0.6:
+            filtro["produtos"] = tuple(rng.choice(PRODUTOS, rng.integers(1, 6), replace=False))
+        if rng.random() < 0.3:
+            filtro["tipos"] = ("saída",)
+        filtros.append(filtro)
+    return filtros
+
+
+def _forca_bruta(df, inicio=None, fim=None, produtos=None, tipos=None):
+    """Referência: a mesma seleção por varredura completa do DataFrame."""
+    mascara = np.ones(len(df), dtype=bool)
+    if inicio is not None:
+        mascara &= df["Data"] >= inicio
+    if fim is not None:
+        mascara &= df["Data"] <= fim
+    if produtos is not None:
+        mascara &= df["Produto"].isin(produtos)
+    if tipos is not None:
+        mascara &= df["Tipo"].isin(tipos)
+    return df[mascara]
+
+
+def _conferir(ledger, filtros):
+    df = ledger.dataframe()
+    for filtro in filtros:
+        pd.testing.assert_frame_equal(ledger.filtrar(**filtro), _forca_bruta(df, **filtro))
+
+
+@pytest.mark.parametrize("semente", [0, 1])
+def test_indice_igual_a_varredura_completa(semente):
+    ledger = LedgerMovimentacoes()
+    ledger.estender(_movimentacoes(5000, semente))
+    _conferir(ledger, _filtros(semente))
+
+
+@pytest.mark.parametrize("semente", [0, 1])
+def test_nivel_delta_incorporado_ao_principal(semente):
+    """Consultas entre inserções passam pelo delta, pela reconstrução do principal e pelos dois juntos."""
+    ledger = LedgerMovimentacoes()
+    movimentacoes = _movimentacoes(3 * LIMITE_DELTA, semente)
+    filtros = _filtros(semente, quantidade=10)
+    ledger.estender(movimentacoes.iloc[:LIMITE_DELTA // 2])
+    _conferir(ledger, filtros)
+    for registro in movimentacoes.iloc[LIMITE_DELTA // 2:LIMITE_DELTA // 2 + 200].to_dict("records"):
+        ledger.adicionar(registro)
+    _conferir(ledger, filtros)
+    ledger.estender(movimentacoes.iloc[LIMITE_DELTA // 2 + 200:2 * LIMITE_DELTA])
+    _conferir(ledger, filtros)
+    ledger.estender(movimentacoes.iloc[2 * LIMITE_DELTA:])
+    _conferir(ledger, filtros)
+
+    datas = ledger.dataframe()["Data"]
+    assert ledger.intervalo_datas() == (datas.min().date(), datas.max().date())
+
+
+def _conferir_produtos(ledger, filtros):
+    df = ledger.dataframe()
+    for filtro in filtros:
+        esperado = sorted(set(_forca_bruta(df, **filtro)["Produto"].astype(str)))
+        assert ledger.produtos_filtrados(**filtro) == esperado
+
+
+# FRACAO_MASCARA = 0 leva toda seleção com data ou produto às máscaras; 1, aos índices
+@pytest.mark.parametrize("fracao", [0, 1], ids=["mascaras", "indices"])
+@pytest.mark.parametrize("semente", [0, 1])
+def test_caminhos_de_selecao_iguais_a_varredura_completa(monkeypatch, semente, fracao):
+    monkeypatch.setattr("ledger.FRACAO_MASCARA", fracao)
+    ledger = LedgerMovimentacoes()
+    movimentacoes = _movimentacoes(5000, semente)
+    ledger.estender(movimentacoes)
+    filtros = _filtros(semente) + [
+        {"tipos": ("entrada",)},
+        {"tipos": ("saída",), "produtos": tuple(PRODUTOS[:3])},
+        {"tipos": ("entrada", "saída"), "fim": pd.Timestamp("2024-06-30")},
+    ]
+    _conferir(ledger, filtros)
+    _conferir_produtos(ledger, filtros)
+
+    # Escritas depois das máscaras montadas: as máscaras e as contagens por produto
+    # não podem devolver linhas removidas nem o conteúdo anterior das editadas
+    rng = np.random.default_rng(semente)
+    for posicao in rng.choice(len(movimentacoes), 300, replace=False):
+        ledger.remover(int(posicao))
+    for posicao in rng.choice(len(movimentacoes), 100, replace=False):
+        registro = dict(movimentacoes.iloc[int(posicao)])
+        registro["Produto"] = PRODUTOS[-1] if registro["Produto"] != PRODUTOS[-1] else PRODUTOS[0]
+        registro["Tipo"] = "entrada" if registro["Tipo"] == "saída" else "saída"
+        ledger.substituir(int(posicao), registro)
+    ledger.estender(_movimentacoes(200, semente + 10))
+    # Todas as linhas de um produto removidas: ele sai da lista de produtos
+    df = ledger.dataframe()
+    for posicao in df.index[df["Produto"] == PRODUTOS[1]]:
+        ledger.remover(int(posicao))
+    _conferir(ledger, filtros)
+    _conferir_produtos(ledger, filtros)
+    assert PRODUTOS[1] not in ledger.produtos_filtrados()
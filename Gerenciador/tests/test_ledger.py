@@ -0,0 +1,69 @@
+import pandas as pd
+import pytest
+
+from ledger import CAPACIDADE_INICIAL, QUANTIDADE_MAXIMA, LedgerMovimentacoes, aplicar_esquema
+
+
+def _registros(n):
+    return pd.DataFrame({
+        "Data": pd.date_range("2024-01-01", periods=n, freq="h"),
+        "Produto": [f"p{i % 7}" for i in range(n)],
+        "Tipo": ["entrada" if i % 3 else "saída" for i in range(n)],
+        "Quantidade": [i % 50 + 1 for i in range(n)],
+        "Custo Unitário": [float(i % 11) for i in range(n)],
+        "Preço de Venda": [float(i % 13) for i in range(n)],
+    })
+
+
+def test_insercoes_atravessando_blocos_preservam_a_ordem():
+    esperado = _registros(3 * CAPACIDADE_INICIAL + 5)
+    ledger = LedgerMovimentacoes()
+    for registro in esperado.iloc[:2 * CAPACIDADE_INICIAL].to_dict("records"):
+        ledger.adicionar(registro)
+    ledger.dataframe()
+    ledger.estender(esperado.iloc[2 * CAPACIDADE_INICIAL:3 * CAPACIDADE_INICIAL])
+    for registro in esperado.iloc[3 * CAPACIDADE_INICIAL:].to_dict("records"):
+        ledger.adicionar(registro)
+
+    assert len(ledger) == len(esperado)
+    pd.testing.assert_frame_equal(ledger.dataframe(), aplicar_esquema(esperado).rename_axis("ID"))
+
+
+def test_dataframe_em_cache_ate_a_proxima_escrita():
+    ledger = LedgerMovimentacoes()
+    registros = _registros(2)
+    ledger.adicionar(registros.iloc[0].to_dict())
+    df = ledger.dataframe()
+    assert ledger.dataframe() is df
+
+    ledger.adicionar(registros.iloc[1].to_dict())
+    assert len(ledger.dataframe()) == 2
+
+    ledger.limpar()
+    assert ledger.empty and ledger.dataframe().empty
+
+
+REGISTRO = {
+    "Data": pd.Timestamp("2024-01-01"), "Produto": "a", "Tipo": "entrada",
+    "Quantidade": QUANTIDADE_MAXIMA + 1, "Custo Unitário": 1.0, "Preço de Venda": 0.0,
+}
+
+
+@pytest.mark.parametrize("gravar", [
+    lambda ledger: ledger.adicionar(REGISTRO),
+    lambda ledger: ledger.estender(pd.DataFrame([REGISTRO])),
+    lambda ledger: aplicar_esquema(pd.DataFrame([REGISTRO])),
+])
+def test_quantidade_fora_da_coluna_nao_e_truncada(gravar):
+    ledger = LedgerMovimentacoes()
+    with pytest.raises(ValueError):
+        gravar(ledger)
+    assert ledger.empty
+
+
+def test_substituir_com_quantidade_fora_da_coluna():
+    ledger = LedgerMovimentacoes()
+    ledger.adicionar(dict(REGISTRO, Quantidade=QUANTIDADE_MAXIMA))
+    with pytest.raises(ValueError):
+        ledger.substituir(0, REGISTRO)
+    assert ledger.registro(0)["Quantidade"] == QUANTIDADE_MAXIMA
@@ -0,0 +1,86 @@
+import logging
+
+from medicao import FASE_NULA, MedicaoExecucoes
+
+
+def test_desligada_nao_registra():
+    medicao = MedicaoExecucoes(ativa=False)
+    medicao.iniciar_execucao()
+    with medicao.fase("consulta") as fase:
+        fase.registrar(linhas=10)
+    medicao.concluir_execucao()
+
+    assert medicao.fase("consulta") is FASE_NULA
+    assert not medicao.execucoes and medicao.tabela().empty and medicao.contagens() == {}
+
+
+def test_fases_somadas_por_execucao(caplog):
+    medicao = MedicaoExecucoes(max_execucoes=2, ativa=True)
+    for numero in range(3):
+        medicao.iniciar_execucao()
+        with medicao.fase("consulta") as fase:
+            fase.registrar(linhas=numero)
+        with medicao.fase("gráficos"):
+            pass
+        with medicao.fase("consulta"):
+            pass
+        with caplog.at_level(logging.INFO, logger="medicao"):
+            medicao.concluir_execucao()
+
+    tabela = medicao.tabela()
+    assert len(tabela) == 2 and list(tabela.columns) == ["Total", "consulta", "gráficos"]
+    assert (tabela["Total"] >= tabela["consulta"] + tabela["gráficos"]).all()
+    assert medicao.contagens() == {"consulta: linhas": 2}
+    # Cada execução concluída vira uma linha JSON no log
+    assert sum('"fases"' in mensagem for mensagem in caplog.messages) == 3
+
+
+def test_fase_fora_de_execucao_e_nula():
+    medicao = MedicaoExecucoes(ativa=True)
+    assert medicao.fase("consulta") is FASE_NULA
+    medicao.concluir_execucao()
+    assert not medicao.execucoes
+
+
+def test_fragmento_dentro_da_execucao_e_uma_fase():
+    medicao = MedicaoExecucoes(ativa=True)
+    medicao.iniciar_execucao()
+    with medicao.fragmento("exportação"):
+        with medicao.fase("consulta"):
+            pass
+    medicao.concluir_execucao()
+
+    assert len(medicao.execucoes) == 1 and "fragmento" not in medicao.execucoes[0]
+    assert [fase["fase"] for fase in medicao.execucoes[0]["fases"]] == ["consulta", "exportação"]
+
+
+def test_fragmento_reexecutado_sozinho_vira_execucao_propria():
+    medicao = MedicaoExecucoes(ativa=True)
+    with medicao.fragmento("tabela de movimentações"):
+        with medicao.fase("consulta") as fase:
+            fase.registrar(linhas=5)
+
+    execucao, = medicao.execucoes
+    assert execucao["fragmento"] == "tabela de movimentações"
+    assert [fase["fase"] for fase in execucao["fases"]] == ["consulta", "tabela de movimentações"]
+    assert medicao.tabela().index[0].endswith("(fragmento: tabela de movimentações)")
+    assert medicao.contagens() == {"consulta: linhas": 5}
+    # Concluída a reexecução do fragmento, não fica execução aberta
+    assert medicao.fase("consulta") is FASE_NULA
+
+
+def test_fragmento_com_erro_conclui_a_execucao():
+    medicao = MedicaoExecucoes(ativa=True)
+    try:
+        with medicao.fragmento("importação"):
+            raise RuntimeError("falha")
+    except RuntimeError:
+        pass
+
+    assert len(medicao.execucoes) == 1 and medicao.fase("consulta") is FASE_NULA
+
+
+def test_fragmento_desligado_e_nulo():
+    medicao = MedicaoExecucoes(ativa=False)
+    assert medicao.fragmento("exportação") is FASE_NULA
+    assert not medicao.execucoes
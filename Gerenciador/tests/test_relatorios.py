@@ -0,0 +1,68 @@
+import os
+
+import pandas as pd
+import pytest
+
+import relatorios
+from agregados import AgregadosEstoque
+from armazenamento import criar_backend
+from sintetico import gerar_movimentacoes
+
+
+@pytest.fixture
+def livros():
+    return {
+        "loja1": gerar_movimentacoes(800, produtos=15, dias=60, semente=1),
+        "loja2": gerar_movimentacoes(600, produtos=15, dias=60, semente=2),
+        "loja3": gerar_movimentacoes(500, produtos=10, dias=60, semente=3),
+    }
+
+
+@pytest.fixture
+def lojas(tmp_path, livros):
+    """Duas lojas em CSV, uma com dados em SQLite e um diretório sem dados."""
+    origens = {}
+    for loja in ("loja1", "loja2"):
+        origens[loja] = str(tmp_path / f"{loja}.csv")
+        livros[loja].to_csv(origens[loja], index=False)
+    origens["loja3"] = str(tmp_path / "loja3")
+    criar_backend("sqlite", origens["loja3"]).adicionar_lote(livros["loja3"])
+    origens["vazia"] = str(tmp_path / "vazia")
+    os.makedirs(origens["vazia"])
+    return origens
+
+
+def test_lojas_em_paralelo(lojas, livros, tmp_path):
+    origens = [lojas["loja1"], lojas["loja2"], lojas["loja3"]]
+    resultados, falhas = relatorios.processar_lojas(
+        origens, str(tmp_path / "relatorios"), formatos=("CSV", "Parquet"), processos=2
+    )
+
+    assert not falhas
+    assert [resultado["Loja"] for resultado in resultados] == ["loja1", "loja2", "loja3"]
+    for resultado in resultados:
+        livro = livros[resultado["Loja"]]
+        esperado = AgregadosEstoque.de_dataframe(livro).resumir()
+        assert resultado["Movimentações"] == len(livro) and resultado["Rejeitadas"] == 0
+        assert resultado["Valor Entradas"] == pytest.approx(esperado.totais["Valor Entradas"])
+        # resumo.csv, CSV e Parquet
+        assert len(resultado["Arquivos"]) == 3 and all(os.path.exists(arquivo) for arquivo in resultado["Arquivos"])
+        assert len(pd.read_parquet(resultado["Arquivos"][2])) == len(livro)
+
+
+def test_cli_acusa_diretorio_sem_dados(lojas, tmp_path, capsys):
+    saida = tmp_path / "relatorios"
+    codigo = relatorios.main([lojas["loja1"], lojas["vazia"], "--saida", str(saida), "--formatos", "CSV"])
+
+    assert codigo == 1
+    assert "loja1" in capsys.readouterr().out
+    assert sorted(os.listdir(saida)) == ["loja1"]
+    # O diretório sem dados não ganha um armazenamento vazio
+    assert os.listdir(lojas["vazia"]) == []
+
+
+def test_criar_backend_sem_criar(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        criar_backend("parquet", str(tmp_path), criar=False)
+    criar_backend("parquet", str(tmp_path))
+    assert criar_backend("parquet", str(tmp_path), criar=False) is not None
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from rollups import AGREGACOES, RollupsTemporais, inicio_periodo
+
+
+@pytest.fixture
+def movimentacoes():
+    rng = np.random.default_rng(0)
+    n = 3000
+    return pd.DataFrame({
+        "Data": pd.Timestamp("2023-12-01") + pd.to_timedelta(rng.integers(0, 120 * 24, n), unit="h"),
+        "Produto": rng.choice(["a", "b", "c"], n),
+        "Tipo": rng.choice(["entrada", "saída"], n),
+        "Quantidade": rng.integers(1, 40, n),
+    })
+
+
+def _serie_esperada(df, produto, agregacao):
+    """Referência: a série recalculada do zero com um groupby sobre as movimentações do produto."""
+    df = df[df["Produto"] == produto]
+    serie = (
+        df.assign(Data=inicio_periodo(df["Data"], agregacao).to_numpy())
+        .assign(Quantidade=np.where(df["Tipo"] == "entrada", df["Quantidade"], -df["Quantidade"]))
+        .groupby(["Data", "Tipo"], as_index=False)["Quantidade"]
+        .sum()
+    )
+    return serie.sort_values(["Data", "Tipo"], ignore_index=True)
+
+
+@pytest.mark.parametrize("agregacao", AGREGACOES)
+def test_incremental_igual_ao_recalculo(movimentacoes, agregacao):
+    por_registro = RollupsTemporais()
+    for registro in movimentacoes.iloc[:500].to_dict("records"):
+        por_registro.adicionar(registro)
+    por_registro.adicionar_lote(movimentacoes.iloc[500:])
+    em_lote = RollupsTemporais.de_totais_diarios(movimentacoes)
+
+    for produto in ["a", "b", "c"]:
+        esperada = _serie_esperada(movimentacoes, produto, agregacao)
+        pd.testing.assert_frame_equal(por_registro.serie(produto, agregacao), esperada, check_dtype=False)
+        pd.testing.assert_frame_equal(em_lote.serie(produto, agregacao), esperada, check_dtype=False)
+
+
+def test_inicio_dos_periodos():
+    datas = pd.Series(pd.to_datetime(["2024-01-03 18:00", "2024-01-07 00:00", "2024-01-08 00:00", "2024-02-29 00:00"]))
+    assert inicio_periodo(datas, "Diária").dt.strftime("%Y-%m-%d").tolist() == [
+        "2024-01-03", "2024-01-07", "2024-01-08", "2024-02-29"
+    ]
+    assert inicio_periodo(datas, "Semanal").dt.strftime("%Y-%m-%d").tolist() == [
+        "2024-01-01", "2024-01-01", "2024-01-08", "2024-02-26"
+    ]
+    assert inicio_periodo(datas, "Mensal").dt.strftime("%Y-%m-%d").tolist() == [
+        "2024-01-01", "2024-01-01", "2024-01-01", "2024-02-01"
+    ]
+
+
+def test_produto_sem_movimentacoes():
+    serie = RollupsTemporais().serie("a", "Mensal")
+    assert serie.empty and list(serie.columns) == ["Data", "Tipo", "Quantidade"]
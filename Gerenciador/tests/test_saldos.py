@@ -0,0 +1,65 @@
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from saldos import LinhaTempoSaldos
+from sintetico import gerar_movimentacoes
+
+
+def saldos_por_dia(df, produto):
+    """Referência: saldo do produto ao fim de cada dia, por soma acumulada."""
+    linhas = df[df["Produto"] == produto]
+    movimento = np.where(linhas["Tipo"] == "entrada", linhas["Quantidade"], -linhas["Quantidade"])
+    return pd.Series(movimento, index=pd.to_datetime(linhas["Data"]).dt.normalize()).groupby(level=0).sum().cumsum()
+
+
+def disponivel(df, produto, data):
+    saldos = saldos_por_dia(df, produto)
+    data = pd.Timestamp(data)
+    anteriores = saldos[saldos.index <= data]
+    saldo = int(anteriores.iloc[-1]) if len(anteriores) else 0
+    posteriores = saldos[saldos.index > data]
+    return saldo if posteriores.empty else min(saldo, int(posteriores.min()))
+
+
+@pytest.fixture
+def livro():
+    return gerar_movimentacoes(1200, produtos=6, dias=60, semente=4).astype({"Produto": str, "Tipo": str})
+
+
+def conferir(linha, df, rnd):
+    for produto in sorted(df["Produto"].unique()):
+        for _ in range(15):
+            data = pd.Timestamp("2023-12-25") + pd.Timedelta(days=rnd.randrange(80))
+            assert linha.disponivel(produto, data) == disponivel(df, produto, data), (produto, data)
+            referencia = saldos_por_dia(df, produto)
+            anteriores = referencia[referencia.index <= data]
+            assert linha.saldo_em(produto, data) == (int(anteriores.iloc[-1]) if len(anteriores) else 0)
+
+
+def test_lote_fora_de_ordem(livro):
+    # Blocos embaralhados forçam a incorporação retroativa
+    linha = LinhaTempoSaldos()
+    embaralhado = livro.sample(frac=1, random_state=0)
+    for inicio in range(0, len(embaralhado), 170):
+        linha.adicionar_lote(embaralhado.iloc[inicio:inicio + 170])
+    conferir(linha, livro, random.Random(0))
+    # Um saldo por produto e dia com movimento, não por registro
+    dias = livro.groupby("Produto")["Data"].apply(lambda datas: datas.dt.normalize().nunique())
+    assert {produto: linha._produtos[produto].n for produto in dias.index} == dias.to_dict()
+
+
+def test_registro_a_registro_retroativo(livro):
+    linha = LinhaTempoSaldos()
+    for registro in livro.sample(frac=1, random_state=1).to_dict("records"):
+        linha.adicionar(registro)
+    conferir(linha, livro, random.Random(1))
+
+
+def test_produto_sem_movimento():
+    linha = LinhaTempoSaldos()
+    assert linha.saldo_em("x", "2024-01-01") == 0
+    assert linha.minimo_apos("x", "2024-01-01") is None
+    assert linha.disponivel("x", "2024-01-01") == 0
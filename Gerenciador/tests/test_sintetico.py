@@ -0,0 +1,23 @@
+import pandas as pd
+
+from ledger import ESQUEMA
+from sintetico import gerar_movimentacoes
+
+
+def test_mesma_semente_mesmo_livro():
+    pd.testing.assert_frame_equal(gerar_movimentacoes(2000, semente=3), gerar_movimentacoes(2000, semente=3))
+    assert not gerar_movimentacoes(2000, semente=3).equals(gerar_movimentacoes(2000, semente=4))
+
+
+def test_livro_valido_para_o_formulario():
+    df = gerar_movimentacoes(20_000, produtos=300, dias=90)
+
+    assert df.dtypes.astype(str).to_dict() == pd.Series(ESQUEMA).astype(str).to_dict()
+    assert df["Data"].is_monotonic_increasing
+    assert df["Data"].min() >= pd.Timestamp("2024-01-01") and df["Data"].max() < pd.Timestamp("2024-03-31")
+    # Um Custo Unitário por produto e preço em todas as saídas
+    assert (df.groupby("Produto", observed=True)["Custo Unitário"].nunique() == 1).all()
+    assert (df.loc[df["Tipo"] == "saída", "Preço de Venda"] > 0).all()
+    # Nenhuma saída deixa o saldo do produto negativo
+    movimento = df["Quantidade"].where(df["Tipo"] == "entrada", -df["Quantidade"])
+    assert movimento.groupby(df["Produto"], observed=True).cumsum().min() >= 0
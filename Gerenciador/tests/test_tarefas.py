@@ -0,0 +1,56 @@
+import threading
+
+import pytest
+
+from tarefas import FilaExportacoes
+
+
+def test_mesma_chave_reaproveita_a_tarefa():
+    fila = FilaExportacoes()
+    liberar = threading.Event()
+    geracoes = []
+
+    def gerar(ao_progredir):
+        geracoes.append(1)
+        ao_progredir(0.5)
+        liberar.wait(10)
+        ao_progredir(1.0)
+        return b"relatorio"
+
+    tarefa = fila.submeter("chave", gerar, "relatorio.csv")
+    assert fila.submeter("chave", gerar, "relatorio.csv") is tarefa
+    assert fila.obter("chave") is tarefa and fila.obter("outra") is None
+    assert not tarefa.concluida
+    liberar.set()
+    assert tarefa.resultado() == b"relatorio"
+    assert tarefa.concluida and tarefa.progresso == 1.0
+    assert fila.submeter("chave", gerar, "relatorio.csv") is tarefa
+    assert len(geracoes) == 1
+
+
+def test_tarefa_com_falha_e_substituida():
+    fila = FilaExportacoes()
+
+    def falhar(ao_progredir):
+        raise RuntimeError("disco cheio")
+
+    tarefa = fila.submeter("chave", falhar, "relatorio.csv")
+    with pytest.raises(RuntimeError):
+        tarefa.resultado()
+    assert tarefa.falhou
+
+    nova = fila.submeter("chave", lambda ao_progredir: b"ok", "relatorio.csv")
+    assert nova is not tarefa and nova.resultado() == b"ok"
+
+
+def test_descarta_concluidas_mais_antigas_e_mantem_as_em_andamento():
+    fila = FilaExportacoes(max_trabalhadores=2, max_resultados=2)
+    liberar = threading.Event()
+    lenta = fila.submeter("lenta", lambda ao_progredir: liberar.wait(10) and b"lenta", "lenta.csv")
+    for numero in range(4):
+        fila.submeter(numero, lambda ao_progredir, numero=numero: bytes([numero]), f"{numero}.csv").resultado()
+
+    assert fila.obter("lenta") is lenta
+    assert [fila.obter(numero) is not None for numero in range(4)] == [False, False, False, True]
+    liberar.set()
+    assert lenta.resultado() == b"lenta"
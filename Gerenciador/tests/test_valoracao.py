@@ -0,0 +1,158 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from armazenamento import FiltroMovimentacoes, criar_backend
+from estoque import EstoqueCompartilhado
+from sintetico import gerar_movimentacoes
+from valoracao import ValoracaoEstoque, custos_saidas
+
+
+def valorar_linha_a_linha(df):
+    """Referência: CMV por produto percorrendo as linhas uma a uma, em ordem de data."""
+    estados = {}
+    for linha in df.sort_values("Data", kind="stable").to_dict("records"):
+        produto, quantidade, custo = linha["Produto"], linha["Quantidade"], linha["Custo Unitário"]
+        estado = estados.setdefault(produto, {
+            "saldo": 0, "custo_medio": 0.0, "camadas": [], "deficit": 0, "ultimo_custo": 0.0,
+            "medio": 0.0, "fifo": 0.0,
+        })
+        if linha["Tipo"] == "entrada":
+            saldo = max(estado["saldo"], 0)
+            estado["custo_medio"] = (saldo * estado["custo_medio"] + quantidade * custo) / (saldo + quantidade)
+            estado["saldo"] += quantidade
+            cobertas = min(quantidade, estado["deficit"])
+            estado["deficit"] -= cobertas
+            if quantidade > cobertas:
+                estado["camadas"].append([quantidade - cobertas, custo])
+            estado["ultimo_custo"] = custo
+            continue
+        estado["medio"] += quantidade * estado["custo_medio"]
+        estado["saldo"] -= quantidade
+        restante = quantidade
+        while restante and estado["camadas"]:
+            consumo = min(restante, estado["camadas"][0][0])
+            estado["fifo"] += consumo * estado["camadas"][0][1]
+            estado["camadas"][0][0] -= consumo
+            restante -= consumo
+            if not estado["camadas"][0][0]:
+                estado["camadas"].pop(0)
+        estado["fifo"] += restante * estado["ultimo_custo"]
+        estado["deficit"] += restante
+    return {
+        metodo: pd.Series({produto: estado[metodo] for produto, estado in estados.items()}, dtype=np.float64)
+        for metodo in ("medio", "fifo")
+    }
+
+
+def movimentacao(data, produto, tipo, quantidade, custo=0.0):
+    return {
+        "Data": pd.Timestamp(data), "Produto": produto, "Tipo": tipo,
+        "Quantidade": quantidade, "Custo Unitário": custo, "Preço de Venda": 0.0,
+    }
+
+
+@pytest.fixture
+def vendida_alem_do_estoque():
+    # A segunda saída vende 5 unidades além do estoque, antes da entrada a 20
+    return pd.DataFrame([
+        movimentacao("2024-01-01", "a", "entrada", 5, 10.0),
+        movimentacao("2024-01-02", "a", "saída", 3),
+        movimentacao("2024-01-03", "a", "saída", 7),
+        movimentacao("2024-01-04", "a", "entrada", 10, 20.0),
+        movimentacao("2024-01-05", "a", "saída", 4),
+    ])
+
+
+@pytest.fixture(params=[0, 1, 2])
+def livro(request):
+    df = gerar_movimentacoes(1500, produtos=15, dias=120, semente=request.param)
+    df = df.astype({"Produto": str, "Tipo": str})
+    # O gerador não vende além do estoque; livros antigos podem ter vendido
+    saidas = df.index[df["Tipo"] == "saída"]
+    df.loc[saidas[::5], "Quantidade"] *= 8
+    return df
+
+
+def comparar(obtido, esperado):
+    pd.testing.assert_series_equal(
+        obtido.sort_index(), esperado.sort_index(), check_names=False, rtol=1e-9, atol=1e-6
+    )
+
+
+def test_saida_alem_do_estoque_custa_a_ultima_entrada(vendida_alem_do_estoque):
+    valoracao = ValoracaoEstoque.de_dataframe(vendida_alem_do_estoque)
+    # 3·10 + (2·10 + 5·10 de déficit) + 4·20; a entrada a 20 cobre o déficit primeiro
+    assert valoracao.cmv("fifo")["a"] == pytest.approx(180.0)
+    assert valoracao.valor_estoque("fifo")["a"] == pytest.approx(20.0)
+    assert valoracao.valor_estoque("medio")["a"] == pytest.approx(20.0)
+
+
+@pytest.mark.parametrize("metodo", ["medio", "fifo"])
+def test_lote_igual_a_referencia(livro, metodo):
+    comparar(ValoracaoEstoque.de_dataframe(livro).cmv(metodo), valorar_linha_a_linha(livro)[metodo])
+
+
+@pytest.mark.parametrize("metodo", ["medio", "fifo"])
+@pytest.mark.parametrize("tamanho", [5, 97, 1000])
+def test_blocos_iguais_a_referencia(livro, metodo, tamanho):
+    ordenado = livro.sort_values("Data", kind="stable")
+    blocos = (ordenado.iloc[inicio:inicio + tamanho] for inicio in range(0, len(ordenado), tamanho))
+    comparar(ValoracaoEstoque.de_blocos(blocos).cmv(metodo), valorar_linha_a_linha(livro)[metodo])
+
+
+@pytest.mark.parametrize("metodo", ["medio", "fifo"])
+def test_registro_a_registro_igual_a_referencia(livro, metodo):
+    valoracao = ValoracaoEstoque()
+    for registro in livro.sort_values("Data", kind="stable").to_dict("records"):
+        valoracao.adicionar(registro)
+    comparar(valoracao.cmv(metodo), valorar_linha_a_linha(livro)[metodo])
+
+
+@pytest.mark.parametrize("metodo", ["medio", "fifo"])
+def test_registros_e_lotes_intercalados(livro, metodo):
+    ordenado = livro.sort_values("Data", kind="stable")
+    valoracao = ValoracaoEstoque()
+    for inicio in range(0, len(ordenado), 400):
+        bloco = ordenado.iloc[inicio:inicio + 400]
+        valoracao.adicionar_lote(bloco.iloc[:200])
+        for registro in bloco.iloc[200:].to_dict("records"):
+            valoracao.adicionar(registro)
+    comparar(valoracao.cmv(metodo), valorar_linha_a_linha(livro)[metodo])
+
+
+@pytest.mark.parametrize("metodo", ["medio", "fifo"])
+def test_custos_saidas_por_linha(livro, metodo):
+    custos = custos_saidas(livro, metodo)
+    assert (custos[livro["Tipo"] == "entrada"] == 0).all()
+    comparar(custos.groupby(livro["Produto"]).sum(), valorar_linha_a_linha(livro)[metodo])
+    # adicionar_lote devolve os mesmos custos, linha a linha
+    por_linha = ValoracaoEstoque().adicionar_lote(livro)[metodo]
+    np.testing.assert_allclose(por_linha.to_numpy(), custos.to_numpy(), rtol=1e-9, atol=1e-6)
+
+
+def test_retroativo_e_recalculado(livro):
+    ordenado = livro.sort_values("Data", kind="stable")
+    valoracao = ValoracaoEstoque.de_dataframe(ordenado.iloc[100:])
+    valoracao.adicionar_lote(ordenado.iloc[:100])
+    assert valoracao.desatualizados
+    valoracao.recalcular(livro[livro["Produto"].isin(valoracao.desatualizados)])
+    comparar(valoracao.cmv("fifo"), valorar_linha_a_linha(livro)["fifo"])
+
+
+@pytest.mark.parametrize("tipos", [None, ("saída",)])
+def test_resumo_filtrado_custeia_pelo_historico(livro, tipos):
+    backend = criar_backend("memoria")
+    backend.adicionar_lote(livro)
+    estoque = EstoqueCompartilhado(backend)
+    produtos = tuple(sorted(livro["Produto"].unique())[::2])
+    filtro = FiltroMovimentacoes(inicio=date(2024, 2, 15), fim=date(2024, 3, 31), produtos=produtos, tipos=tipos)
+
+    resumo = estoque.resumir(filtro, estoque.consultar(filtro)).por_produto
+    # CMV de cada saída do período pelo livro inteiro, não só pelas entradas que passam pelo filtro
+    mascara = filtro.mascara(livro)
+    cmv = custos_saidas(livro)[mascara].groupby(livro["Produto"][mascara]).sum()
+    assert (cmv > 0).all()
+    comparar(resumo["Valor Saídas"] - resumo["Lucro"], cmv.reindex(resumo.index, fill_value=0.0))
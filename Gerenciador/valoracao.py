@@ -0,0 +1,352 @@
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+METODOS = ("medio", "fifo")
+COLUNAS_VALORACAO = ["Data", "Produto", "Tipo", "Quantidade", "Custo Unitário"]
+
+
+def _novo_produto():
+    return {
+        "saldo": 0,
+        "custo_medio": 0.0,
+        "camadas": deque(),
+        "ultimo_custo": 0.0,
+        "cmv_medio": 0.0,
+        "cmv_fifo": 0.0,
+        "ultima_data": None,
+    }
+
+
+def _varredura_afim(alfa, beta):
+    """Resolve x[i] = alfa[i] * x[i-1] + beta[i] (com x[-1] = 0) para todos os i.
+
+    Usa uma varredura de prefixo por duplicação: log2(n) passadas vetorizadas,
+    sem divisões, de modo que zeros em alfa (estoque zerado) apenas reiniciam a
+    recorrência.
+    """
+    a = np.asarray(alfa, dtype=np.float64).copy()
+    b = np.asarray(beta, dtype=np.float64).copy()
+    passo = 1
+    while passo < len(a):
+        b[passo:] = a[passo:] * b[:-passo] + b[passo:]
+        a[passo:] = a[passo:] * a[:-passo]
+        passo *= 2
+    return b
+
+
+def _inicios_grupos(codigos):
+    """Posição da primeira linha do grupo de cada linha (codigos ordenados)."""
+    inicio = np.ones(len(codigos), dtype=bool)
+    inicio[1:] = codigos[1:] != codigos[:-1]
+    return np.maximum.accumulate(np.where(inicio, np.arange(len(codigos)), 0))
+
+
+def _custo_medio_movel(codigos, entrada, quantidade, custo):
+    """Custo médio ponderado perpétuo vigente após cada linha e CMV de cada saída.
+
+    As linhas devem estar ordenadas por produto e, dentro dele, por data. Em uma
+    entrada o custo médio passa a (S·A + q·c) / (S + q); uma saída baixa q
+    unidades ao custo médio vigente, sem alterá-lo.
+    """
+    sinal = np.where(entrada, quantidade, -quantidade)
+    saldo_depois = pd.Series(sinal).groupby(codigos).cumsum().to_numpy()
+    saldo_antes = np.maximum(saldo_depois - sinal, 0)
+
+    linhas_entrada = np.flatnonzero(entrada)
+    q = quantidade[linhas_entrada]
+    c = custo[linhas_entrada]
+    total = saldo_antes[linhas_entrada] + q
+    # Total zero só ocorre nas entradas sintéticas de estado (saldo anterior nulo):
+    # o custo médio passa a ser o custo delas
+    custo_medio_entradas = _varredura_afim(
+        np.divide(saldo_antes[linhas_entrada], total, out=np.zeros(len(q)), where=total != 0),
+        np.divide(q * c, total, out=c.astype(np.float64), where=total != 0),
+    )
+
+    # Custo médio vigente em cada linha: o da última entrada do mesmo produto
+    ultima = np.maximum.accumulate(np.where(entrada, np.arange(len(codigos)), -1))
+    valida = (ultima >= 0) & (ultima >= _inicios_grupos(codigos))
+    custo_medio = np.zeros(len(codigos))
+    posicao = np.searchsorted(linhas_entrada, ultima[valida])
+    custo_medio[valida] = custo_medio_entradas[posicao]
+
+    cmv = np.where(entrada, 0.0, quantidade * custo_medio)
+    return custo_medio, cmv, saldo_depois
+
+
+def _ultimo_custo_entrada(codigos, entrada, custo):
+    """Custo da última entrada do mesmo produto até cada linha (0 se ainda não houve entrada)."""
+    ultima = np.maximum.accumulate(np.where(entrada, np.arange(len(codigos)), -1))
+    return np.where(ultima >= _inicios_grupos(codigos), custo[np.maximum(ultima, 0)], 0.0)
+
+
+def _fifo(codigos, entrada, quantidade, custo):
+    """CMV de cada saída pelo método FIFO e quantidade restante de cada entrada.
+
+    Com as entradas de todos os produtos enfileiradas em uma única reta de
+    unidades (C(u) = custo acumulado das u primeiras unidades), uma saída que
+    consome as unidades (u0, u1] do seu produto custa C(u1) - C(u0), obtido por
+    interpolação. Uma saída só consome unidades de entradas anteriores a ela;
+    as vendidas além do estoque custam o da última entrada (como no custo médio,
+    que cobra o custo vigente) e ficam como déficit, coberto pelas entradas
+    seguintes sem novo custo. As linhas devem estar ordenadas por produto e data.
+    """
+    qtd_entrada = np.where(entrada, quantidade, 0)
+    unidades = np.cumsum(qtd_entrada)
+    valores = np.cumsum(np.where(entrada, quantidade * custo, 0.0))
+    eixo_u = np.concatenate([[0], unidades[entrada]])
+    eixo_c = np.concatenate([[0.0], valores[entrada]])
+
+    inicios = _inicios_grupos(codigos)
+    deslocamento = unidades[inicios] - qtd_entrada[inicios]
+    # Unidades que entraram no produto até cada linha, inclusive
+    entradas_ate = unidades - deslocamento
+
+    qtd_saida = np.where(entrada, 0, quantidade)
+    saidas_depois = pd.Series(qtd_saida).groupby(codigos).cumsum().to_numpy()
+    saidas_antes = saidas_depois - qtd_saida
+    u1 = deslocamento + np.minimum(saidas_depois, entradas_ate)
+    u0 = deslocamento + np.minimum(saidas_antes, entradas_ate)
+    excedente = np.maximum(saidas_depois - entradas_ate, 0) - np.maximum(saidas_antes - entradas_ate, 0)
+    cmv = np.where(
+        entrada,
+        0.0,
+        np.interp(u1, eixo_u, eixo_c) - np.interp(u0, eixo_u, eixo_c)
+        + excedente * _ultimo_custo_entrada(codigos, entrada, custo),
+    )
+
+    # Unidades de cada entrada ainda não consumidas ao final
+    ultimo = np.r_[inicios[1:] != inicios[:-1], True]
+    saidas_total = np.repeat(saidas_depois[ultimo], np.diff(np.r_[0, np.flatnonzero(ultimo) + 1]))
+    restante = np.clip(entradas_ate - saidas_total, 0, qtd_entrada)
+    return cmv, np.where(entrada, restante, 0)
+
+
+class ValoracaoEstoque:
+    """Valoração do estoque por custo médio ponderado perpétuo e por FIFO.
+
+    Os lotes são processados com passadas vetorizadas em ordem de data, partindo
+    do estado de cada produto (saldo, custo médio e camadas FIFO), que entra na
+    passada como movimentações sintéticas. Registros com data anterior à última já
+    processada do produto não podem ser encaixados incrementalmente: o produto
+    fica em desatualizados até ser recalculado com recalcular().
+    """
+
+    def __init__(self):
+        self._produtos = {}
+        self.desatualizados = set()
+
+    @classmethod
+    def de_dataframe(cls, df):
+        valoracao = cls()
+        valoracao.adicionar_lote(df)
+        return valoracao
+
+    @classmethod
+    def de_blocos(cls, blocos):
+        """Constrói a valoração a partir de blocos em ordem de data, um por vez em memória."""
+        valoracao = cls()
+        for bloco in blocos:
+            valoracao.adicionar_lote(bloco)
+        return valoracao
+
+    def adicionar(self, registro):
+        """Incorpora um registro em O(1) (amortizado, no FIFO) se ele vier em ordem de data."""
+        produto = registro["Produto"]
+        if produto in self.desatualizados:
+            return
+        data = pd.Timestamp(registro["Data"])
+        estado = self._produtos.setdefault(produto, _novo_produto())
+        if estado["ultima_data"] is not None and data < estado["ultima_data"]:
+            self.desatualizados.add(produto)
+            return
+        estado["ultima_data"] = data
+        quantidade = registro["Quantidade"]
+        if registro["Tipo"] == "entrada":
+            custo = registro["Custo Unitário"]
+            saldo = max(estado["saldo"], 0)
+            estado["custo_medio"] = (saldo * estado["custo_medio"] + quantidade * custo) / (saldo + quantidade)
+            # As primeiras unidades cobrem o déficit de saídas além do estoque, já custeadas
+            deficit = max(-estado["saldo"], 0)
+            if quantidade > deficit:
+                estado["camadas"].append([quantidade - deficit, custo])
+            estado["ultimo_custo"] = custo
+            estado["saldo"] += quantidade
+            return
+        estado["cmv_medio"] += quantidade * estado["custo_medio"]
+        estado["saldo"] -= quantidade
+        restante = quantidade
+        camadas = estado["camadas"]
+        while restante > 0 and camadas:
+            consumo = min(restante, camadas[0][0])
+            estado["cmv_fifo"] += consumo * camadas[0][1]
+            camadas[0][0] -= consumo
+            restante -= consumo
+            if camadas[0][0] == 0:
+                camadas.popleft()
+        estado["cmv_fifo"] += restante * estado["ultimo_custo"]
+
+    def adicionar_lote(self, df):
+        """Incorpora um lote de movimentações com duas passadas vetorizadas (médio e FIFO).
+
+        Retorna o CMV de cada linha incorporada (colunas "medio" e "fifo", 0 nas
+        entradas), alinhado ao índice de df; linhas de produtos desatualizados ficam de fora.
+        """
+        custos = pd.DataFrame({metodo: pd.Series(dtype=np.float64) for metodo in METODOS})
+        if df.empty:
+            return custos
+        df = df[COLUNAS_VALORACAO]
+        datas = pd.to_datetime(df["Data"])
+        # Produtos com registros anteriores ao estado atual são recalculados depois
+        minimas = datas.groupby(df["Produto"].to_numpy()).min()
+        fora_de_ordem = {
+            produto for produto, minima in minimas.items()
+            if produto in self._produtos and self._produtos[produto]["ultima_data"] is not None
+            and minima < self._produtos[produto]["ultima_data"]
+        }
+        self.desatualizados |= fora_de_ordem
+        manter = ~df["Produto"].isin(self.desatualizados).to_numpy()
+        if not manter.all():
+            df, datas = df[manter], datas[manter]
+        if df.empty:
+            return custos
+
+        produtos_lote = pd.unique(df["Produto"].to_numpy())
+        # Estado anterior como movimentações sintéticas (produto, quantidade, custo, entrada) no início de cada produto
+        prefixo_medio, prefixo_fifo = [], []
+        for produto in produtos_lote:
+            estado = self._produtos.get(produto)
+            if estado is None:
+                continue
+            # Mesmo com saldo nulo ou negativo, o estado define o custo das próximas saídas
+            prefixo_medio.append((produto, estado["saldo"], estado["custo_medio"], True))
+            # FIFO: o último custo (entrada vazia), as camadas e o déficit (saída já custeada)
+            prefixo_fifo.append((produto, 0, estado["ultimo_custo"], True))
+            prefixo_fifo.extend((produto, quantidade, custo, True) for quantidade, custo in estado["camadas"])
+            if estado["saldo"] < 0:
+                prefixo_fifo.append((produto, -estado["saldo"], 0.0, False))
+
+        codigos_lote, nomes = pd.factorize(df["Produto"].to_numpy())
+        entrada_lote = (df["Tipo"] == "entrada").to_numpy()
+        quantidade_lote = df["Quantidade"].to_numpy(dtype=np.int64)
+        custo_lote = df["Custo Unitário"].to_numpy(dtype=np.float64)
+        datas_lote = datas.to_numpy(dtype="datetime64[ns]").view(np.int64)
+        posicao = {produto: i for i, produto in enumerate(nomes)}
+
+        def passada(prefixo):
+            n_prefixo = len(prefixo)
+            codigos = np.concatenate([[posicao[p] for p, _, _, _ in prefixo], codigos_lote]).astype(np.int64)
+            entrada = np.concatenate([np.array([e for _, _, _, e in prefixo], dtype=bool), entrada_lote])
+            quantidade = np.concatenate([[q for _, q, _, _ in prefixo], quantidade_lote]).astype(np.int64)
+            custo = np.concatenate([[c for _, _, c, _ in prefixo], custo_lote]).astype(np.float64)
+            # Prefixo primeiro; depois data e ordem de chegada
+            prioridade = np.r_[np.zeros(n_prefixo, dtype=np.int8), np.ones(len(df), dtype=np.int8)]
+            datas_todas = np.r_[np.zeros(n_prefixo, dtype=np.int64), datas_lote]
+            ordem = np.lexsort((np.arange(len(codigos)), datas_todas, prioridade, codigos))
+            return codigos[ordem], entrada[ordem], quantidade[ordem], custo[ordem], ordem - n_prefixo
+
+        def por_linha(cmv, linha):
+            # CMV da passada (ordenada) de volta à ordem das linhas do lote
+            resultado = np.zeros(len(df))
+            resultado[linha[linha >= 0]] = cmv[linha >= 0]
+            return resultado
+
+        codigos, entrada, quantidade, custo, linha = passada(prefixo_medio)
+        do_lote = linha >= 0
+        custo_medio, cmv_medio, _ = _custo_medio_movel(codigos, entrada, quantidade, custo)
+        ultimo = np.r_[codigos[1:] != codigos[:-1], True]
+        cmv_medio_produto = np.bincount(codigos, weights=cmv_medio * do_lote, minlength=len(nomes))
+        custo_medio_final = dict(zip(codigos[ultimo], custo_medio[ultimo]))
+
+        codigos_f, entrada_f, quantidade_f, custo_f, linha_f = passada(prefixo_fifo)
+        do_lote_f = linha_f >= 0
+        cmv_fifo, restante = _fifo(codigos_f, entrada_f, quantidade_f, custo_f)
+        cmv_fifo_produto = np.bincount(codigos_f, weights=cmv_fifo * do_lote_f, minlength=len(nomes))
+        ultimo_f = np.r_[codigos_f[1:] != codigos_f[:-1], True]
+        ultimo_custo_final = dict(zip(
+            codigos_f[ultimo_f], _ultimo_custo_entrada(codigos_f, entrada_f, custo_f)[ultimo_f]
+        ))
+        sinal = np.where(entrada_lote, quantidade_lote, -quantidade_lote)
+        saldo_lote = np.bincount(codigos_lote, weights=sinal, minlength=len(nomes))
+        ultima_data_lote = pd.Series(datas.to_numpy()).groupby(codigos_lote).max()
+        camadas = {}
+        com_restante = np.flatnonzero(restante > 0)
+        for codigo, q, c in zip(codigos_f[com_restante], restante[com_restante], custo_f[com_restante]):
+            camadas.setdefault(codigo, deque()).append([int(q), float(c)])
+
+        for codigo, produto in enumerate(nomes):
+            estado = self._produtos.setdefault(produto, _novo_produto())
+            estado["saldo"] += int(saldo_lote[codigo])
+            estado["custo_medio"] = float(custo_medio_final.get(codigo, estado["custo_medio"]))
+            estado["cmv_medio"] += float(cmv_medio_produto[codigo])
+            estado["cmv_fifo"] += float(cmv_fifo_produto[codigo])
+            estado["camadas"] = camadas.get(codigo, deque())
+            estado["ultimo_custo"] = float(ultimo_custo_final[codigo])
+            estado["ultima_data"] = ultima_data_lote[codigo]
+        return pd.DataFrame(
+            {"medio": por_linha(cmv_medio, linha), "fifo": por_linha(cmv_fifo, linha_f)},
+            index=df.index,
+        )
+
+    def invalidar(self, produto):
+        """Marca o produto para ser recalculado (ver recalcular), após uma correção no seu histórico."""
+        self.desatualizados.add(produto)
+
+    def recalcular(self, df, produtos=None):
+        """Refaz do zero a valoração dos produtos presentes em df (o histórico completo de cada um).
+
+        produtos, se informado, lista os produtos refeitos; os que não aparecem
+        em df ficaram sem movimentações e são descartados.
+        """
+        produtos = pd.unique(df["Produto"].to_numpy()) if produtos is None else produtos
+        for produto in produtos:
+            self._produtos.pop(produto, None)
+            self.desatualizados.discard(produto)
+        self.adicionar_lote(df)
+
+    def custo_medio(self, produto):
+        estado = self._produtos.get(produto)
+        return 0.0 if estado is None else estado["custo_medio"]
+
+    def cmv(self, metodo="medio"):
+        """Custo das mercadorias vendidas por produto (Series indexada por produto)."""
+        if metodo not in METODOS:
+            raise ValueError(f"Método de valoração desconhecido: {metodo}. Use {', '.join(METODOS)}.")
+        return pd.Series(
+            {produto: estado[f"cmv_{metodo}"] for produto, estado in self._produtos.items()},
+            dtype=np.float64,
+        )
+
+    def valor_estoque(self, metodo="medio"):
+        """Valor do saldo atual por produto pelo método indicado."""
+        valores = {}
+        for produto, estado in self._produtos.items():
+            if metodo == "fifo":
+                valores[produto] = sum(quantidade * custo for quantidade, custo in estado["camadas"])
+            else:
+                valores[produto] = max(estado["saldo"], 0) * estado["custo_medio"]
+        return pd.Series(valores, dtype=np.float64)
+
+
+def custos_saidas(df, metodo="medio"):
+    """CMV de cada linha de df (0 para entradas), alinhado ao índice de df.
+
+    Para o lucro por saída: quantidade * preço de venda - CMV.
+    """
+    if df.empty:
+        return pd.Series(0.0, index=df.index)
+    codigos, _ = pd.factorize(df["Produto"].to_numpy())
+    datas = pd.to_datetime(df["Data"]).to_numpy(dtype="datetime64[ns]").view(np.int64)
+    ordem = np.lexsort((np.arange(len(df)), datas, codigos))
+    entrada = (df["Tipo"] == "entrada").to_numpy()[ordem]
+    quantidade = df["Quantidade"].to_numpy(dtype=np.int64)[ordem]
+    custo = df["Custo Unitário"].to_numpy(dtype=np.float64)[ordem]
+    if metodo == "fifo":
+        cmv, _ = _fifo(codigos[ordem], entrada, quantidade, custo)
+    else:
+        _, cmv, _ = _custo_medio_movel(codigos[ordem], entrada, quantidade, custo)
+    resultado = np.empty(len(df))
+    resultado[ordem] = cmv
+    return pd.Series(resultado, index=df.index)